@@ -1,29 +1,57 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, status, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, status, Query, Body, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from cachetools import TTLCache
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, model_validator
+from typing import List, Optional, Dict, Any, Iterable, Iterator, AsyncIterator, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-# from emergentintegrations.llm.chat import LlmChat, UserMessage
+try:
+    from emergentintegrations.llm.chat import LlmChat, UserMessage
+except ImportError:  # optional; without it the /ai endpoints answer from the local engines only
+    LlmChat = UserMessage = None
 import json
 import base64
+import csv
+import io
+import gzip
+import hashlib
+import time
+import zlib
+import math
+import unicodedata
+from collections import Counter, defaultdict
 from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+import numpy as np
+try:
+    import orjson
+except ImportError:  # orjson is optional; fast_json falls back to the stdlib encoder
+    orjson = None
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is negotiated
+    brotli = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: BSON dates decode straight to UTC-aware datetimes, so handlers never convert timestamps
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # Security
@@ -88,6 +116,8 @@ class Product(BaseModel):
     seo_title: Optional[str] = None
     seo_description: Optional[str] = None
     is_active: bool = True
+    wishlist_count: int = 0  # Maintained by wishlist add/remove
+    reserved_quantity: int = 0  # Held by checkouts in progress (stock_holds)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -111,6 +141,43 @@ class ProductCreate(BaseModel):
     seo_description: Optional[str] = None
     is_active: bool = True  
 
+class ProductCard(BaseModel):
+    """Compact listing view of a Product (view=card): only what a product grid card renders"""
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    name: str
+    slug: Optional[str] = None
+    category: str
+    price: float
+    compare_price: Optional[float] = None
+    images: List[str] = []  # First image only
+    stock_quantity: int = 0
+
+class ProductPatch(BaseModel):
+    """One line of a bulk price/stock update; identify the product by id or sku"""
+    model_config = ConfigDict(extra="forbid")
+
+    id: Optional[str] = None
+    sku: Optional[str] = None
+    price: Optional[float] = Field(None, ge=0)
+    compare_price: Optional[float] = Field(None, ge=0)
+    stock_quantity: Optional[int] = Field(None, ge=0)  # Absolute stock level
+    stock_delta: Optional[int] = None  # Relative change, applied with $inc
+    is_active: Optional[bool] = None
+
+    @model_validator(mode="after")
+    def check_patch(self):
+        if bool(self.id) == bool(self.sku):
+            raise ValueError("Provide exactly one of id or sku")
+        if self.stock_quantity is not None and self.stock_delta is not None:
+            raise ValueError("Provide stock_quantity or stock_delta, not both")
+        changes = self.model_dump(exclude={"id", "sku"}, exclude_none=True)
+        if changes.get("stock_delta") == 0:
+            del changes["stock_delta"]
+        if not changes:
+            raise ValueError("Nothing to update")
+        return self
+
 class Category(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -119,8 +186,10 @@ class Category(BaseModel):
     description: Optional[str] = None
     image: Optional[str] = None
     parent_id: Optional[str] = None
+    ancestors: List[str] = []  # Ancestor ids, root first; maintained on every category write
     is_active: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class CategoryCreate(BaseModel):
     name: str
@@ -152,8 +221,8 @@ class Order(BaseModel):
     shipping_carrier: Optional[str] = None
     notes: Optional[str] = None
 
-    created_at: datetime = datetime.utcnow()
-    updated_at: datetime = datetime.utcnow()
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
     class Config:
         extra = "allow" 
@@ -167,6 +236,16 @@ class OrderCreate(BaseModel):
     payment_method: str
     shipping_address: Dict[str, Any]
     billing_address: Dict[str, Any]
+    shipping_method_id: Optional[str] = None  # From /shipping/quote; cheapest option when omitted
+    wallet_credit: float = Field(0.0, ge=0)  # Wallet balance to apply to the total
+
+
+class StockHoldItem(BaseModel):
+    product_id: str
+    quantity: int = Field(ge=1)
+
+class StockHoldRequest(BaseModel):
+    items: List[StockHoldItem] = Field(min_length=1, max_length=100)
 
 
 class Page(BaseModel):
@@ -281,6 +360,11 @@ class ShippingMethod(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ShippingQuoteRequest(BaseModel):
+    subtotal: float = Field(ge=0)
+    weight_kg: float = Field(0.0, ge=0)
+    destinations: List[str] = Field(min_length=1, max_length=50)  # Country names or ISO codes
+
 class ShippingMethodCreate(BaseModel):
     name: str
     carrier: str
@@ -412,14 +496,13 @@ class ReferralSettingsUpdate(BaseModel):
 
 # ========== HELPER FUNCTIONS ==========
 
-import random
-import string
+import asyncio
 import re
 
-def generate_referral_code(length: int = 8) -> str:
-    """Generate a unique referral code"""
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choices(chars, k=length))
+def duplicate_key_field(error: DuplicateKeyError) -> Optional[str]:
+    """Name of the first indexed field that caused a DuplicateKeyError"""
+    key_pattern = (error.details or {}).get("keyPattern") or {}
+    return next(iter(key_pattern), None)
 
 def generate_slug(name: str) -> str:
     """Generate URL-friendly slug from product name"""
@@ -431,7 +514,869 @@ def generate_slug(name: str) -> str:
     slug = re.sub(r'[\s]+', '-', slug)
     # Remove multiple consecutive hyphens
     slug = re.sub(r'-+', '-', slug)
-    return slug
+    return slug.strip('-')
+
+# ========== ID ALLOCATION ==========
+
+# Crockford-style base32: no I, L, O or U, so codes read back unambiguously
+CODE_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+REFERRAL_CODE_LENGTH = 8
+REFERRAL_CODE_SPACE = len(CODE_ALPHABET) ** REFERRAL_CODE_LENGTH  # 2**40
+# Odd multiplier => n -> (n * M + C) mod 2**40 is a bijection, so distinct counters give distinct,
+# non-sequential-looking codes
+REFERRAL_CODE_MULTIPLIER = 0x9E3779B97F
+REFERRAL_CODE_OFFSET = 0x5DEECE66D
+
+class SequenceAllocator:
+    """Hands out increasing values of a named db.counters sequence, reserving them in blocks.
+
+    One find_one_and_update reserves block_size values, so most allocations cost no round-trip.
+    Values reserved by a process that exits are skipped, never reused.
+    """
+
+    def __init__(self, name: str, block_size: int = 20):
+        self.name = name
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _reserve(self, count: int):
+        counter = await db.counters.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._end = counter["value"] + 1
+        self._next = self._end - count
+
+    async def take(self, count: int) -> List[int]:
+        """Allocate count consecutive-or-later sequence values"""
+        async with self._lock:
+            values = []
+            while len(values) < count:
+                if self._next >= self._end:
+                    await self._reserve(max(self.block_size, count - len(values)))
+                take = min(count - len(values), self._end - self._next)
+                values.extend(range(self._next, self._next + take))
+                self._next += take
+            return values
+
+    async def next(self) -> int:
+        return (await self.take(1))[0]
+
+referral_code_sequence = SequenceAllocator("referral_code")
+sku_sequence = SequenceAllocator("sku")
+
+def encode_code(value: int, length: int) -> str:
+    """Fixed-width encoding of value in CODE_ALPHABET"""
+    base = len(CODE_ALPHABET)
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, base)
+        chars.append(CODE_ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+def referral_code_for(sequence_value: int) -> str:
+    """Map a sequence value to its unique 8-character referral code"""
+    scrambled = (sequence_value * REFERRAL_CODE_MULTIPLIER + REFERRAL_CODE_OFFSET) % REFERRAL_CODE_SPACE
+    return encode_code(scrambled, REFERRAL_CODE_LENGTH)
+
+async def generate_referral_code() -> str:
+    """Allocate a new referral code; unique by construction, no lookup needed"""
+    return referral_code_for(await referral_code_sequence.next())
+
+async def generate_skus(count: int, prefix: str = "GLENN") -> List[str]:
+    """Allocate count new SKUs ("GLENN000042"); six digits never clash with legacy 5-digit SKUs"""
+    return [f"{prefix}{value:06d}" for value in await sku_sequence.take(count)]
+
+async def generate_sku(prefix: str = "GLENN") -> str:
+    return (await generate_skus(1, prefix))[0]
+
+# ========== SLUG ALLOCATION ==========
+
+async def allocate_slugs(collection, sources: List[str], exclude_id: Optional[str] = None) -> List[str]:
+    """First free slugs derived from sources in collection: base, base-1, base-2, ...
+
+    All existing base / base-N slugs are read in one query of anchored prefix regexes on the
+    slug index, so allocation costs one round-trip however many similar documents exist.
+    Sources sharing a base within the batch get consecutive suffixes.
+    """
+    bases = [generate_slug(source) or "item" for source in sources]
+    used: Dict[str, set] = {base: set() for base in bases}
+
+    query: Dict[str, Any] = {"$or": [
+        {"slug": {"$regex": f"^{re.escape(base)}(-[0-9]+)?$"}} for base in used
+    ]}
+    if exclude_id:
+        query["id"] = {"$ne": exclude_id}
+
+    async for doc in collection.find(query, {"_id": 0, "slug": 1}):
+        slug = doc["slug"]
+        if slug in used:
+            used[slug].add(0)
+        prefix, _, suffix = slug.rpartition("-")
+        if suffix.isdigit() and prefix in used:
+            used[prefix].add(int(suffix))
+
+    slugs = []
+    for base in bases:
+        suffix = 0 if 0 not in used[base] else max(used[base]) + 1
+        used[base].add(suffix)
+        slugs.append(base if suffix == 0 else f"{base}-{suffix}")
+    return slugs
+
+async def allocate_slug(collection, source: str, exclude_id: Optional[str] = None) -> str:
+    """First free slug derived from source in collection"""
+    return (await allocate_slugs(collection, [source], exclude_id))[0]
+
+async def insert_with_slug(collection, doc: Dict[str, Any], source: str):
+    """Insert doc under a freshly allocated slug, re-allocating if a concurrent writer took it"""
+    while True:
+        doc["slug"] = await allocate_slug(collection, source)
+        try:
+            await collection.insert_one(doc)
+            return
+        except DuplicateKeyError as e:
+            if duplicate_key_field(e) != "slug":
+                raise
+
+async def update_with_slug(collection, doc_id: str, update_data: Dict[str, Any], source: str):
+    """$set update_data on doc_id with a slug allocated from source, excluding the doc's own slug"""
+    while True:
+        update_data["slug"] = await allocate_slug(collection, source, exclude_id=doc_id)
+        try:
+            await collection.update_one({"id": doc_id}, {"$set": update_data})
+            return
+        except DuplicateKeyError as e:
+            if duplicate_key_field(e) != "slug":
+                raise
+
+# ========== LISTING HELPERS ==========
+
+# Per-referrer referral totals; entries are dropped whenever that user gains a referral
+referral_stats_cache: TTLCache = TTLCache(maxsize=10000, ttl=600)
+
+def encode_cursor(sort_value: Any, last_id: str) -> str:
+    """Encode the last row's sort key and id into an opaque pagination cursor"""
+    if isinstance(sort_value, datetime):
+        sort_value = {"$date": sort_value.isoformat()}
+    payload = json.dumps({"v": sort_value, "id": last_id})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("utf-8")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor produced by encode_cursor into (sort_value, last_id)"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+        sort_value = payload["v"]
+        if isinstance(sort_value, dict) and "$date" in sort_value:
+            sort_value = datetime.fromisoformat(sort_value["$date"])
+        return sort_value, payload["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(sort_field: str, sort_dir: int, cursor: Optional[str]) -> Dict[str, Any]:
+    """Build the $match that resumes a (sort_field, id) ordered scan after the cursor"""
+    if not cursor:
+        return {}
+    sort_value, last_id = decode_cursor(cursor)
+    op = "$gt" if sort_dir == 1 else "$lt"
+    resume = [{sort_field: sort_value, "id": {op: last_id}}]
+    # Null/missing values sort before everything ascending and after everything descending,
+    # and no range operator matches them, so nullable sort keys need explicit branches
+    if sort_value is None:
+        if sort_dir == 1:
+            resume.append({sort_field: {"$ne": None}})
+    else:
+        resume.append({sort_field: {op: sort_value}})
+        if sort_dir == -1:
+            resume.append({sort_field: None})
+    return {"$or": resume}
+
+def date_range_filter(date_from: Optional[datetime], date_to: Optional[datetime]) -> Dict[str, Any]:
+    """Range condition on a stored timestamp field"""
+    condition = {}
+    if date_from:
+        condition["$gte"] = date_from
+    if date_to:
+        condition["$lte"] = date_to
+    return condition
+
+def user_lookup_stages(local_field: str, prefix: str) -> List[Dict[str, Any]]:
+    """$lookup stages adding <prefix>_email and <prefix>_name from the joined user"""
+    joined = f"_{prefix}"
+    return [
+        {"$lookup": {"from": "users", "localField": local_field, "foreignField": "id", "as": joined}},
+        {"$unwind": {"path": f"${joined}", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {
+            f"{prefix}_email": f"${joined}.email",
+            f"{prefix}_name": f"${joined}.full_name"
+        }},
+        {"$project": {joined: 0}}
+    ]
+
+async def paginate_aggregation(
+    collection,
+    pipeline: List[Dict[str, Any]],
+    tail: List[Dict[str, Any]],
+    sort_field: str,
+    sort_dir: int,
+    limit: int,
+    cursor: Optional[str]
+) -> Dict[str, Any]:
+    """Run a keyset-paginated aggregation: pipeline, then cursor/sort/limit, then tail stages"""
+    resume = keyset_filter(sort_field, sort_dir, cursor)
+    stages = list(pipeline)
+    if resume:
+        stages.append({"$match": resume})
+    stages += [
+        {"$sort": {sort_field: sort_dir, "id": sort_dir}},
+        {"$limit": limit + 1}
+    ] + tail
+
+    items = await collection.aggregate(stages).to_list(limit + 1)
+    has_more = len(items) > limit
+    items = items[:limit]
+    next_cursor = encode_cursor(items[-1].get(sort_field), items[-1]["id"]) if has_more else None
+
+    return {"items": items, "next_cursor": next_cursor, "has_more": has_more}
+
+async def aggregate_totals(collection, pipeline: List[Dict[str, Any]], group: Dict[str, Any]) -> Dict[str, Any]:
+    """Summary figures over a whole filtered listing with one $group (zeros when nothing matches)"""
+    stages = pipeline + [{"$group": {"_id": None, **group}}, {"$project": {"_id": 0}}]
+    groups = await collection.aggregate(stages, allowDiskUse=True).to_list(1)
+    return groups[0] if groups else {key: 0 for key in group}
+
+def stream_csv(cursor, columns: List[str], filename: str) -> StreamingResponse:
+    """Stream an async Mongo cursor to the client as CSV, one row at a time"""
+    async def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for doc in cursor:
+            writer.writerow([
+                doc[col].isoformat() if isinstance(doc.get(col), datetime) else doc.get(col, "")
+                for col in columns
+            ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def json_default(value: Any) -> str:
+    """json.dumps fallback: ISO 8601 for datetimes, str() for anything else"""
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def fast_json(content: Any, status_code: int = 200) -> JSONResponse:
+    """Serialize trusted DB output directly with orjson.
+
+    Returning a Response skips FastAPI's response_model re-validation and jsonable_encoder
+    pass, so only use it for documents this app wrote in the model's shape.
+    """
+    if orjson is None:
+        return JSONResponse(jsonable_encoder(content), status_code=status_code)
+    return ORJSONResponse(content, status_code=status_code)
+
+# ========== RESPONSE COMPRESSION ==========
+
+# Smaller bodies go out as-is: the encoding overhead outweighs the bytes saved
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# Per-request encoding favours speed; cached bodies are encoded once, so they get the top levels
+DYNAMIC_LEVELS = {"br": 4, "gzip": 6}
+PRECOMPRESSED_LEVELS = {"br": 11, "gzip": 9}
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br (when brotli is installed) or gzip from an Accept-Encoding header, honouring q=0"""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.strip()
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        offered[name.strip()] = quality
+
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    qualities = {encoding: offered.get(encoding, offered.get("*", 0.0)) for encoding in candidates}
+    best = max(candidates, key=qualities.get)  # ties go to br
+    return best if qualities[best] > 0 else None
+
+def timed_compress(body: bytes, encoding: str, level: int) -> tuple:
+    """Compress a whole body; returns (compressed, CPU seconds spent)"""
+    start = time.thread_time()
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=level)
+    else:
+        compressed = gzip.compress(body, compresslevel=level, mtime=0)
+    return compressed, time.thread_time() - start
+
+class StreamCompressor:
+    """Incremental encoder for streamed bodies (CSV/JSONL exports)"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._encoder = brotli.Compressor(quality=DYNAMIC_LEVELS["br"])
+        else:
+            self._encoder = zlib.compressobj(DYNAMIC_LEVELS["gzip"], zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._encoder.process(chunk) if self.encoding == "br" else self._encoder.compress(chunk)
+
+    def finish(self) -> bytes:
+        return self._encoder.finish() if self.encoding == "br" else self._encoder.flush()
+
+class CompressionMetrics:
+    """Per-route byte counts before/after compression and CPU time spent compressing"""
+
+    def __init__(self):
+        self.routes: Dict[str, Dict[str, float]] = defaultdict(lambda: {
+            "responses": 0, "compressed": 0, "cache_hits": 0,
+            "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0
+        })
+
+    def record(self, route: str, bytes_in: int, bytes_out: int, cpu_seconds: float = 0.0,
+               compressed: bool = False, cache_hit: bool = False):
+        stats = self.routes[route]
+        stats["responses"] += 1
+        stats["compressed"] += compressed
+        stats["cache_hits"] += cache_hit
+        stats["bytes_in"] += bytes_in
+        stats["bytes_out"] += bytes_out
+        stats["cpu_seconds"] += cpu_seconds
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "route": route,
+                "responses": stats["responses"],
+                "compressed": stats["compressed"],
+                "cache_hits": stats["cache_hits"],
+                "bytes_in": stats["bytes_in"],
+                "bytes_out": stats["bytes_out"],
+                "ratio": round(stats["bytes_out"] / stats["bytes_in"], 4) if stats["bytes_in"] else None,
+                "cpu_ms": round(stats["cpu_seconds"] * 1000, 3),
+            }
+            for route, stats in sorted(self.routes.items())
+        ]
+
+compression_metrics = CompressionMetrics()
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """Metrics key: method plus the matched route template, so path parameters don't fan out"""
+    route = scope.get("route")
+    return f"{scope.get('method', '')} {route.path if route is not None else '(unmatched)'}"
+
+def set_encoding_headers(message: Dict[str, Any], encoding: str, length: Optional[int]):
+    headers = MutableHeaders(raw=message["headers"])
+    headers["Content-Encoding"] = encoding
+    headers.add_vary_header("Accept-Encoding")
+    if length is None:
+        del headers["Content-Length"]
+    else:
+        headers["Content-Length"] = str(length)
+
+class CompressionMiddleware:
+    """gzip/brotli negotiation for every response the app sends.
+
+    Whole bodies below minimum_size pass through untouched and streamed bodies are encoded
+    chunk by chunk. Responses that already carry Content-Encoding (the precompressed
+    response cache) are forwarded as they are.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+        encoder: Optional[StreamCompressor] = None
+        streamed = {"in": 0, "out": 0, "cpu": 0.0}
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough, encoder
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                passthrough = (
+                    "content-encoding" in headers
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None and not more_body:
+                route = route_label(scope)
+                if len(body) < self.minimum_size:
+                    compression_metrics.record(route, len(body), len(body))
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressed, cpu = timed_compress(body, encoding, DYNAMIC_LEVELS[encoding])
+                compression_metrics.record(route, len(body), len(compressed), cpu, compressed=True)
+                set_encoding_headers(start_message, encoding, len(compressed))
+                await send(start_message)
+                await send({"type": "http.response.body", "body": compressed})
+                return
+
+            if encoder is None:
+                encoder = StreamCompressor(encoding)
+                set_encoding_headers(start_message, encoding, None)
+                await send(start_message)
+            start = time.thread_time()
+            chunk = encoder.compress(body)
+            if not more_body:
+                chunk += encoder.finish()
+            streamed["cpu"] += time.thread_time() - start
+            streamed["in"] += len(body)
+            streamed["out"] += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            if not more_body:
+                compression_metrics.record(
+                    route_label(scope), streamed["in"], streamed["out"], streamed["cpu"], compressed=True
+                )
+
+        await self.app(scope, receive, send_compressed)
+
+# ========== RESPONSE CACHE ==========
+
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+# Public listing payloads keyed by (namespace, path, query); writes drop whole namespaces
+response_cache: TTLCache = TTLCache(maxsize=2048, ttl=RESPONSE_CACHE_TTL)
+# namespace -> invalidation count; a load that overlapped an invalidation isn't stored
+response_cache_generations: Counter = Counter()
+
+class CachedResponse:
+    """A serialized JSON body plus its compressed variants, each encoded at most once"""
+
+    def __init__(self, body: bytes, route: str):
+        self.body = body
+        self.route = route
+        self.encoded: Dict[str, bytes] = {}
+        self.served = 0
+
+    async def render(self, encoding: Optional[str]) -> Response:
+        headers = {"Vary": "Accept-Encoding"}
+        self.served += 1
+        if encoding is None or len(self.body) < COMPRESSION_MIN_SIZE:
+            if encoding is not None:
+                compression_metrics.record(self.route, len(self.body), len(self.body), cache_hit=self.served > 1)
+            return Response(self.body, media_type="application/json", headers=headers)
+
+        body = self.encoded.get(encoding)
+        if body is None:
+            # Top-level brotli takes tens of ms on a large page; keep it off the event loop
+            body, cpu = await asyncio.to_thread(timed_compress, self.body, encoding, PRECOMPRESSED_LEVELS[encoding])
+            self.encoded[encoding] = body
+            compression_metrics.record(self.route, len(self.body), len(body), cpu, compressed=True)
+        else:
+            compression_metrics.record(self.route, len(self.body), len(body), compressed=True, cache_hit=True)
+        return Response(body, media_type="application/json", headers={**headers, "Content-Encoding": encoding})
+
+async def cached_json(request: Request, namespace: str, loader, key: Optional[tuple] = None) -> Response:
+    """Serve await loader() as JSON through the response cache, precompressed for the client.
+
+    Entries are keyed by path and query string unless the caller passes a normalized key.
+    """
+    if key is None:
+        key = (namespace, request.url.path, tuple(sorted(request.query_params.multi_items())))
+    else:
+        key = (namespace, *key)
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache_generations[namespace]
+        entry = CachedResponse(fast_json(await loader()).body, route_label(request.scope))
+        if response_cache_generations[namespace] == generation:
+            response_cache[key] = entry
+    return await entry.render(negotiate_encoding(request.headers.get("accept-encoding", "")))
+
+def invalidate_cached_responses(*namespaces: str):
+    response_cache_generations.update(namespaces)
+    for key in [key for key in response_cache.keys() if key[0] in namespaces]:
+        response_cache.pop(key, None)
+
+# ========== CONDITIONAL RESPONSES ==========
+
+# Browsers may reuse a response for max-age seconds, then show it while revalidating in the
+# background for stale-while-revalidate more
+CACHE_POLICIES = {
+    "product": "public, max-age=60, stale-while-revalidate=300",
+    "categories": "public, max-age=300, stale-while-revalidate=3600",
+    "page": "public, max-age=300, stale-while-revalidate=86400",
+    "blog": "public, max-age=120, stale-while-revalidate=600",
+    "settings": "public, max-age=300, stale-while-revalidate=3600",
+    "hero_slides": "public, max-age=300, stale-while-revalidate=3600",
+}
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag from version parts (ids, updated_at values, request parameters).
+
+    Weak because it names a document version, not the bytes: the same version is served
+    identity, gzip or br encoded.
+    """
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison of If-None-Match against etag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+def set_validators(response: Response, etag: str, policy: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_POLICIES[policy]
+    return response
+
+def not_modified(etag: str, policy: str) -> Response:
+    return set_validators(Response(status_code=304), etag, policy)
+
+async def collection_version(collection, query: Dict[str, Any]) -> tuple:
+    """(count, newest updated_at) of the documents matching query.
+
+    Any insert, update, delete or (de)activation among them changes one of the two, so
+    this versions a listing without reading the documents themselves.
+    """
+    result = await collection.aggregate([
+        {"$match": query},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "version": {"$max": "$updated_at"}}}
+    ]).to_list(1)
+    return (result[0]["count"], result[0]["version"]) if result else (0, None)
+
+# ========== PRODUCT DETAIL CACHE ==========
+
+# Product ids are uuid4 strings; anything else is looked up as a slug
+UUID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.IGNORECASE)
+UUID_SEARCH = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+# Validated detail payloads: product id -> payload with images as stored
+product_detail_cache: TTLCache = TTLCache(maxsize=5000, ttl=600)
+# Bumped whenever detail entries are dropped; a load that started before then isn't cached
+product_detail_generation = 0
+# (product id, base URL) -> (cached payload, copy with absolute image URLs). Only trusted while
+# that payload is still the cached one, and bounded, so the Host header can't grow it
+product_detail_url_cache: TTLCache = TTLCache(maxsize=5000, ttl=600)
+# slug -> product id; a hit is only trusted if the cached payload still carries that slug
+product_slug_cache: TTLCache = TTLCache(maxsize=5000, ttl=600)
+# Bumped on every product write; part of the key of anything derived from the whole catalog
+catalog_version = 0
+
+def absolute_image_urls(images: List[str], base_url: str) -> List[str]:
+    """Uploaded images are stored as /api/images/<id>; serve them as absolute URLs"""
+    return [img if img.startswith("http") else f"{base_url}{img}" for img in images]
+
+def with_base_url(payload: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+    """The detail payload with absolute image URLs for this base URL, built once per payload"""
+    key = (payload["id"], base_url)
+    memo = product_detail_url_cache.get(key)
+    if memo is not None and memo[0] is payload:
+        return memo[1]
+    absolute = {**payload, "images": absolute_image_urls(payload["images"], base_url)}
+    product_detail_url_cache[key] = (payload, absolute)
+    return absolute
+
+def cache_product_detail(doc: Dict[str, Any], generation: int) -> Dict[str, Any]:
+    """Validate a product document and cache its detail payload, unless the product caches
+    were invalidated since the load began (generation is product_detail_generation back then)"""
+    payload = Product(**doc).model_dump(exclude=PRODUCT_INTERNAL_FIELDS)
+    if generation == product_detail_generation:
+        product_detail_cache[payload["id"]] = payload
+        if payload.get("slug"):
+            product_slug_cache[payload["slug"]] = payload["id"]
+    return payload
+
+def cached_product_detail(product_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    return product_detail_cache.get(product_id) if product_id else None
+
+async def get_product_detail(value: str, base_url: str) -> Optional[Dict[str, Any]]:
+    """Product detail by id or slug: the cached payload, else one equality lookup on the indexed field"""
+    generation = product_detail_generation
+    if UUID_PATTERN.match(value):
+        cached = cached_product_detail(value)
+        if cached:
+            return with_base_url(cached, base_url)
+        doc = await db.products.find_one({"id": value}, {"_id": 0})
+        if doc is None:
+            # A slug can still happen to look like a UUID
+            doc = await db.products.find_one({"slug": value}, {"_id": 0})
+    else:
+        cached = cached_product_detail(product_slug_cache.get(value))
+        if cached and cached["slug"] == value:
+            return with_base_url(cached, base_url)
+        doc = await db.products.find_one({"slug": value}, {"_id": 0})
+
+    return with_base_url(cache_product_detail(doc, generation), base_url) if doc else None
+
+async def get_product_details(product_ids: List[str], base_url: str) -> Dict[str, Dict[str, Any]]:
+    """Detail payloads for many ids: cache hits, plus one $in query for the misses"""
+    generation = product_detail_generation
+    details = {}
+    missing = []
+    for product_id in product_ids:
+        cached = cached_product_detail(product_id)
+        if cached:
+            details[product_id] = cached
+        else:
+            missing.append(product_id)
+    if missing:
+        async for doc in db.products.find({"id": {"$in": missing}}, {"_id": 0}):
+            details[doc["id"]] = cache_product_detail(doc, generation)
+    return {product_id: with_base_url(payload, base_url) for product_id, payload in details.items()}
+
+async def find_product_details(
+    ids: List[str], slugs: List[str], base_url: str
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Detail payloads keyed by id and by slug: cache hits, plus one query over both indexed fields"""
+    generation = product_detail_generation
+    by_id, by_slug = {}, {}
+    missing_ids, missing_slugs = [], []
+    for product_id in ids:
+        cached = cached_product_detail(product_id)
+        if cached:
+            by_id[product_id] = cached
+        else:
+            missing_ids.append(product_id)
+    for slug in slugs:
+        cached = cached_product_detail(product_slug_cache.get(slug))
+        if cached and cached["slug"] == slug:
+            by_slug[slug] = cached
+        else:
+            missing_slugs.append(slug)
+
+    if missing_ids or missing_slugs:
+        query = {"$or": [{"id": {"$in": missing_ids}}, {"slug": {"$in": missing_slugs}}]}
+        async for doc in db.products.find(query, {"_id": 0}):
+            payload = cache_product_detail(doc, generation)
+            by_id[payload["id"]] = payload
+            if payload.get("slug"):
+                by_slug[payload["slug"]] = payload
+
+    return (
+        {key: with_base_url(payload, base_url) for key, payload in by_id.items()},
+        {key: with_base_url(payload, base_url) for key, payload in by_slug.items()}
+    )
+
+def invalidate_product_caches(product_ids: Optional[Iterable[str]] = None):
+    """Drop cached product payloads after a write: the given ids, or every product when None.
+
+    Listing responses are always dropped, since any product write can change them, and the
+    search index re-reads the products on its next query.
+    """
+    global catalog_version, product_detail_generation
+    catalog_version += 1
+    product_detail_generation += 1
+    if product_ids is None:
+        product_detail_cache.clear()
+    else:
+        product_ids = list(product_ids)
+        for product_id in product_ids:
+            product_detail_cache.pop(product_id, None)
+    product_search.mark_changed(product_ids)
+    invalidate_cached_responses("products", "homepage", "category_tree")
+
+# ========== CATEGORY TREE ==========
+
+class CategoryTree:
+    """In-memory slug -> descendant slugs map, built from the materialized ancestor paths.
+
+    Reloaded after category writes and at least every max_age seconds, so writes made by
+    other processes show up too.
+    """
+
+    def __init__(self, max_age: int = 300):
+        self.max_age = max_age
+        self.descendants: Dict[str, List[str]] = {}
+        self.loaded_at: Optional[float] = None
+        # Bumped by mark_changed; a reload that overlapped a change doesn't count as current
+        self.generation = 0
+        self._lock = asyncio.Lock()
+
+    def mark_changed(self):
+        self.generation += 1
+        self.loaded_at = None
+
+    def is_current(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age
+
+    async def ensure_current(self):
+        if self.is_current():
+            return
+        async with self._lock:
+            if self.is_current():
+                return
+            loaded_at, generation = time.monotonic(), self.generation
+            categories = await db.categories.find({}, {"_id": 0, "id": 1, "slug": 1, "ancestors": 1}).to_list(None)
+            slugs = {c["id"]: c["slug"] for c in categories}
+            descendants: Dict[str, List[str]] = {c["slug"]: [c["slug"]] for c in categories}
+            for c in categories:
+                for ancestor_id in c.get("ancestors") or []:
+                    if ancestor_id in slugs:
+                        descendants[slugs[ancestor_id]].append(c["slug"])
+            self.descendants = descendants
+            if self.generation == generation:
+                self.loaded_at = loaded_at
+
+    def expand(self, slug: str) -> List[str]:
+        """The slug plus every descendant category's slug"""
+        return self.descendants.get(slug, [slug])
+
+category_tree = CategoryTree()
+
+async def category_ancestors(parent_id: Optional[str], category_id: Optional[str] = None) -> List[str]:
+    """Ancestor ids, root first, for a category placed under parent_id; rejects cycles"""
+    if not parent_id:
+        return []
+    parent = await db.categories.find_one({"id": parent_id}, {"_id": 0, "ancestors": 1})
+    if not parent:
+        raise HTTPException(status_code=400, detail="Parent category not found")
+    ancestors = (parent.get("ancestors") or []) + [parent_id]
+    if category_id and category_id in ancestors:
+        raise HTTPException(status_code=400, detail="A category cannot be placed under itself or its descendants")
+    return ancestors
+
+async def move_category_subtree(category_id: str, ancestors: List[str]):
+    """Rewrite the ancestor paths of every descendant after category_id moved under ancestors"""
+    operations = []
+    async for doc in db.categories.find({"ancestors": category_id}, {"_id": 0, "id": 1, "ancestors": 1}):
+        below = doc["ancestors"][doc["ancestors"].index(category_id):]
+        operations.append(UpdateOne({"id": doc["id"]}, {"$set": {"ancestors": ancestors + below}}))
+    if operations:
+        await db.categories.bulk_write(operations, ordered=False)
+
+async def rebuild_category_ancestors() -> int:
+    """Recompute every ancestor path from parent_id (for categories created before paths existed)"""
+    categories = await db.categories.find({}, {"_id": 0, "id": 1, "parent_id": 1}).to_list(None)
+    parents = {c["id"]: c.get("parent_id") for c in categories}
+    operations = []
+    for category_id in parents:
+        ancestors = []
+        parent_id = parents.get(category_id)
+        while parent_id in parents and parent_id not in ancestors and parent_id != category_id:
+            ancestors.insert(0, parent_id)
+            parent_id = parents[parent_id]
+        operations.append(UpdateOne({"id": category_id}, {"$set": {"ancestors": ancestors}}))
+    if operations:
+        await db.categories.bulk_write(operations, ordered=False)
+    return len(operations)
+
+def build_category_tree(categories: List[Dict[str, Any]], counts: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Nest categories under their parents, with own and subtree product counts"""
+    nodes = {c["id"]: {**c, "product_count": counts.get(c["slug"], 0), "children": []} for c in categories}
+    roots = []
+    for node in sorted(nodes.values(), key=lambda n: n["name"]):
+        parent = nodes.get(node.get("parent_id"))
+        (parent["children"] if parent else roots).append(node)
+
+    def add_totals(node: Dict[str, Any]) -> int:
+        node["total_count"] = node["product_count"] + sum(add_totals(child) for child in node["children"])
+        return node["total_count"]
+
+    for root in roots:
+        add_totals(root)
+    return roots
+
+# ========== TIMESTAMP STORAGE ==========
+
+# Timestamp fields per collection. They are stored as native BSON dates, which the tz-aware
+# client decodes to datetimes; documents written before that switch hold ISO strings until
+# migrate_timestamps() converts them (Pydantic models still parse either form meanwhile).
+TIMESTAMP_FIELDS: Dict[str, List[str]] = {
+    "users": ["created_at"],
+    "products": ["created_at", "updated_at"],
+    "categories": ["created_at", "updated_at"],
+    "orders": ["created_at", "updated_at"],
+    "pages": ["created_at", "updated_at"],
+    "blog_posts": ["created_at", "updated_at", "published_at"],
+    "settings": ["updated_at"],
+    "payment_gateways": ["created_at", "updated_at"],
+    "shipping_methods": ["created_at", "updated_at"],
+    "hero_slides": ["created_at", "updated_at"],
+    "homepage_sections": ["created_at", "updated_at"],
+    "wishlist": ["created_at"],
+    "wallets": ["created_at", "updated_at"],
+    "wallet_transactions": ["created_at"],
+    "referrals": ["created_at", "rewarded_at"],
+    "referral_settings": ["updated_at"],
+    "images": ["created_at"],
+}
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse a legacy ISO 8601 timestamp string; naive values are taken as UTC"""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+async def migrate_timestamps(batch_size: int = 1000, on_batch=None) -> Dict[str, int]:
+    """Convert string timestamps to BSON dates in _id-ordered batches; safe to run online and re-run.
+
+    Each update matches the original string, so a document rewritten concurrently with a fresh
+    date is left alone. Unparseable strings are skipped. Returns converted field counts.
+    """
+    converted: Dict[str, int] = {}
+    for collection_name, fields in TIMESTAMP_FIELDS.items():
+        collection = db[collection_name]
+        has_strings = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        converted[collection_name] = 0
+        last_id = None
+
+        while True:
+            query = has_strings if last_id is None else {**has_strings, "_id": {"$gt": last_id}}
+            batch = await collection.find(query, {field: 1 for field in fields}) \
+                .sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+
+            operations = []
+            for doc in batch:
+                for field in fields:
+                    value = doc.get(field)
+                    if not isinstance(value, str):
+                        continue
+                    try:
+                        parsed = parse_timestamp(value)
+                    except ValueError:
+                        continue
+                    operations.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: parsed}}))
+
+            if operations:
+                result = await collection.bulk_write(operations, ordered=False)
+                converted[collection_name] += result.modified_count
+            last_id = batch[-1]["_id"]
+            if on_batch:
+                on_batch(collection_name, converted[collection_name])
+
+    return converted
+
+# ========== AUTH HELPERS ==========
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -446,6 +1391,25 @@ def create_access_token(data: dict) -> str:
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+# Flipped off the first time the server reports it cannot run multi-document transactions
+transactions_supported = True
+
+async def run_in_transaction(write_fn):
+    """Run write_fn(session) atomically; standalone servers without transactions get session=None"""
+    global transactions_supported
+    if transactions_supported:
+        try:
+            async with await client.start_session() as session:
+                await session.with_transaction(write_fn)
+            return
+        except OperationFailure as e:
+            # IllegalOperation (20): transactions need a replica set or mongos
+            if e.code != 20:
+                raise
+            transactions_supported = False
+            logger.warning("MongoDB transactions unavailable; falling back to sequential writes")
+    await write_fn(None)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     try:
         token = credentials.credentials
@@ -458,9 +1422,6 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if user_doc is None:
             raise HTTPException(status_code=401, detail="User not found")
         
-        if isinstance(user_doc['created_at'], str):
-            user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
-        
         return User(**user_doc)
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication")
@@ -472,117 +1433,115 @@ async def get_admin_user(current_user: User = Depends(get_current_user)) -> User
 
 # ========== AUTH ROUTES ==========
 
+async def get_referral_rewards() -> tuple:
+    """(referrer_reward, referred_reward) from the referral program settings"""
+    settings = await db.referral_settings.find_one({}, {"_id": 0, "referrer_reward": 1, "referred_reward": 1})
+    settings = settings or {}
+    return settings.get('referrer_reward', 5.0), settings.get('referred_reward', 5.0)
+
 @api_router.post("/auth/register")
 async def register(user_data: UserCreate):
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Validate referral code if provided
+    # Independent work runs concurrently: the bcrypt hash, the referrer and the reward settings.
+    # Email uniqueness is enforced by the unique index on users.email, not a pre-check query.
+    lookups = [asyncio.to_thread(hash_password, user_data.password)]
+    if user_data.referral_code:
+        lookups += [
+            db.users.find_one({"referral_code": user_data.referral_code}, {"_id": 0, "id": 1}),
+            get_referral_rewards()
+        ]
+    password_hash, *referral_lookups = await asyncio.gather(*lookups)
+
     referrer = None
     if user_data.referral_code:
-        referrer = await db.users.find_one({"referral_code": user_data.referral_code})
+        referrer, (referrer_reward, referred_reward) = referral_lookups
         if not referrer:
             raise HTTPException(status_code=400, detail="Invalid referral code")
-    
-    # Generate unique referral code for new user
+
+    now = datetime.now(timezone.utc)
+
     while True:
-        new_referral_code = generate_referral_code()
-        existing_code = await db.users.find_one({"referral_code": new_referral_code})
-        if not existing_code:
-            break
-    
-    # Create user
-    user = User(
-        email=user_data.email,
-        full_name=user_data.full_name,
-        phone=user_data.phone,
-        referral_code=new_referral_code,
-        referred_by=user_data.referral_code if referrer else None
-    )
-    
-    user_doc = user.model_dump()
-    user_doc['password'] = hash_password(user_data.password)
-    user_doc['created_at'] = user_doc['created_at'].isoformat()
-    
-    await db.users.insert_one(user_doc)
-    
-    # Create wallet for new user
-    wallet = {
-        "id": str(uuid.uuid4()),
-        "user_id": user.id,
-        "balance": 0.0,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.wallets.insert_one(wallet)
-    
-    # Process referral if applicable
-    if referrer:
-        # Get referral settings
-        settings = await db.referral_settings.find_one({})
-        referrer_reward = settings.get('referrer_reward', 5.0) if settings else 5.0
-        referred_reward = settings.get('referred_reward', 5.0) if settings else 5.0
-        
-        # Create referral record
-        referral = {
-            "id": str(uuid.uuid4()),
-            "referrer_id": referrer['id'],
-            "referred_id": user.id,
-            "referral_code": user_data.referral_code,
-            "status": "completed",
-            "referrer_reward": referrer_reward,
-            "referred_reward": referred_reward,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "rewarded_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.referrals.insert_one(referral)
-        
-        # Add reward to referrer's wallet
-        referrer_wallet = await db.wallets.find_one({"user_id": referrer['id']})
-        if referrer_wallet:
-            await db.wallets.update_one(
-                {"user_id": referrer['id']},
-                {"$inc": {"balance": referrer_reward}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
-            )
-        else:
-            await db.wallets.insert_one({
-                "id": str(uuid.uuid4()),
-                "user_id": referrer['id'],
-                "balance": referrer_reward,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            })
-        
-        # Add referrer reward transaction
-        await db.wallet_transactions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": referrer['id'],
-            "amount": referrer_reward,
-            "type": "referral_bonus",
-            "description": f"Referral bonus for inviting {user.full_name}",
-            "reference_id": referral['id'],
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        
-        # Add reward to new user's wallet
-        await db.wallets.update_one(
-            {"user_id": user.id},
-            {"$inc": {"balance": referred_reward}}
+        user = User(
+            email=user_data.email,
+            full_name=user_data.full_name,
+            phone=user_data.phone,
+            referral_code=await generate_referral_code(),
+            referred_by=user_data.referral_code if referrer else None
         )
-        
-        # Add new user reward transaction
-        await db.wallet_transactions.insert_one({
+        user_doc = user.model_dump()
+        user_doc['password'] = password_hash
+
+        wallet_doc = {
             "id": str(uuid.uuid4()),
             "user_id": user.id,
-            "amount": referred_reward,
-            "type": "referral_bonus",
-            "description": f"Welcome bonus from referral",
-            "reference_id": referral['id'],
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    
+            "balance": referred_reward if referrer else 0.0,
+            "created_at": now,
+            "updated_at": now
+        }
+
+        referral_doc = None
+        ledger_docs = []
+        if referrer:
+            referral_doc = {
+                "id": str(uuid.uuid4()),
+                "referrer_id": referrer['id'],
+                "referred_id": user.id,
+                "referral_code": user_data.referral_code,
+                "status": "completed",
+                "referrer_reward": referrer_reward,
+                "referred_reward": referred_reward,
+                "created_at": now,
+                "rewarded_at": now
+            }
+            ledger_docs = [
+                {
+                    "id": str(uuid.uuid4()),
+                    "user_id": referrer['id'],
+                    "amount": referrer_reward,
+                    "type": "referral_bonus",
+                    "description": f"Referral bonus for inviting {user.full_name}",
+                    "reference_id": referral_doc['id'],
+                    "created_at": now
+                },
+                {
+                    "id": str(uuid.uuid4()),
+                    "user_id": user.id,
+                    "amount": referred_reward,
+                    "type": "referral_bonus",
+                    "description": "Welcome bonus from referral",
+                    "reference_id": referral_doc['id'],
+                    "created_at": now
+                }
+            ]
+
+        async def write_registration(session):
+            # The user insert goes first so a duplicate email aborts before anything else is written
+            await db.users.insert_one(user_doc, session=session)
+            await db.wallets.insert_one(wallet_doc, session=session)
+            if referral_doc:
+                await db.referrals.insert_one(referral_doc, session=session)
+                await db.wallets.update_one(
+                    {"user_id": referrer['id']},
+                    {
+                        "$inc": {"balance": referrer_reward},
+                        "$set": {"updated_at": now},
+                        "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now}
+                    },
+                    upsert=True,
+                    session=session
+                )
+                await db.wallet_transactions.insert_many(ledger_docs, session=session)
+
+        try:
+            await run_in_transaction(write_registration)
+            break
+        except DuplicateKeyError as e:
+            if duplicate_key_field(e) == "referral_code":
+                continue  # Freshly generated code collided; retry with a new one
+            raise HTTPException(status_code=400, detail="Email already registered")
+
+    if referrer:
+        referral_stats_cache.pop(referrer['id'], None)
+
     access_token = create_access_token(data={"sub": user.id})
     return {"access_token": access_token, "token_type": "bearer", "user": user}
 
@@ -595,9 +1554,6 @@ async def login(login_data: UserLogin):
     if not verify_password(login_data.password, user_doc['password']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if isinstance(user_doc['created_at'], str):
-        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
-    
     user_doc.pop('password', None)
     user = User(**user_doc)
     
@@ -610,217 +1566,649 @@ async def get_me(current_user: User = Depends(get_current_user)):
 
 # ========== PRODUCT ROUTES ==========
 
-@api_router.get("/Allproducts")
-async def get_products(
+# Stored counters that product payloads don't expose
+PRODUCT_INTERNAL_FIELDS = {"wishlist_count", "reserved_quantity"}
+# Fetch exactly the ProductCard fields, and only the first image
+PRODUCT_CARD_PROJECTION = {"_id": 0, **{field: 1 for field in ProductCard.model_fields}, "images": {"$slice": 1}}
+PRODUCT_FULL_PROJECTION = {
+    "_id": 0, **{field: 1 for field in Product.model_fields if field not in PRODUCT_INTERNAL_FIELDS}
+}
+# Model defaults for fields older documents may lack; listings skip per-row validation, so these
+# are filled in directly (the rows are only serialized, never mutated)
+PRODUCT_FIELD_DEFAULTS = {
+    name: field.default for name, field in Product.model_fields.items()
+    if not field.is_required() and field.default_factory is None
+}
+
+async def product_list_query(
     category: Optional[str] = None,
     search: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
-    tags: Optional[str] = None,
-    limit: int = Query(25, le=100),
-    skip: int = 0
-):
+    tags: Optional[str] = None
+) -> Dict[str, Any]:
+    """Mongo filter shared by the public product listings; category includes its subcategories"""
     query = {"is_active": True}
-
+    
     if category:
-        query["category"] = category
-
+        await category_tree.ensure_current()
+        slugs = category_tree.expand(category)
+        query["category"] = slugs[0] if len(slugs) == 1 else {"$in": slugs}
     if search:
         query["$or"] = [
             {"name": {"$regex": search, "$options": "i"}},
             {"description": {"$regex": search, "$options": "i"}}
         ]
-
     if min_price is not None or max_price is not None:
         query["price"] = {}
         if min_price is not None:
             query["price"]["$gte"] = min_price
         if max_price is not None:
             query["price"]["$lte"] = max_price
-
     if tags:
         tag_list = tags.split(",")
         query["tags"] = {"$in": tag_list}
+    return query
+
+def product_list_projection(
+    view: str = Query("full", pattern="^(card|full)$"),
+    fields: Optional[str] = None
+) -> Dict[str, Any]:
+    """Projection for a listing: view=card for ProductCard, or an explicit fields=a,b,c list"""
+    if fields:
+        requested = {f.strip() for f in fields.split(",") if f.strip()}
+        unknown = requested - (set(Product.model_fields) - PRODUCT_INTERNAL_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        return {"_id": 0, "id": 1, **{f: 1 for f in requested}}
+    if view == "card":
+        return PRODUCT_CARD_PROJECTION
+    return PRODUCT_FULL_PROJECTION
+
+# Listing sort orders. id breaks ties so skip/limit pages are stable; each order is served by
+# an (is_active, [category,] key, id) index, so no listing sorts in memory
+PRODUCT_SORTS = {
+    "newest": [("created_at", -1), ("id", -1)],
+    "price_asc": [("price", 1), ("id", 1)],
+    "price_desc": [("price", -1), ("id", -1)],
+    "name": [("name", 1), ("id", 1)],
+    "most_wished": [("wishlist_count", -1), ("id", -1)],
+}
+
+def product_list_sort(
+    sort: str = Query("newest", pattern="^(newest|price_asc|price_desc|name|most_wished)$")
+) -> List[tuple]:
+    return PRODUCT_SORTS[sort]
+
+async def list_products(
+    query: Dict[str, Any], projection: Dict[str, Any], sort: List[tuple], skip: int, limit: int
+) -> List[Dict[str, Any]]:
+    """One page of products restricted to the projection, with model defaults for missing fields"""
+    docs = await db.products.find(query, projection).sort(sort).skip(skip).limit(limit).to_list(limit)
+    defaults = {name: value for name, value in PRODUCT_FIELD_DEFAULTS.items() if name in projection}
+    return [{**defaults, **doc} for doc in docs] if defaults else docs
 
+@api_router.get("/Allproducts")
+async def get_products(
+    request: Request,
+    query: Dict[str, Any] = Depends(product_list_query),
+    projection: Dict[str, Any] = Depends(product_list_projection),
+    sort: List[tuple] = Depends(product_list_sort),
+    limit: int = Query(25, le=100),
+    skip: int = 0
+):
+    async def load():
+        total, products = await asyncio.gather(
+            db.products.count_documents(query),
+            list_products(query, projection, sort, skip, limit)
+        )
+        return {
+            "data": products,
+            "total": total,
+            "limit": limit,
+            "skip": skip
+        }
 
-    total = await db.products.count_documents(query)
-
-    products = await db.products.find(query, {"_id": 0}) \
-        .skip(skip).limit(limit).to_list(limit)
-
-    for product in products:
-        if isinstance(product.get('created_at'), str):
-            product['created_at'] = datetime.fromisoformat(product['created_at'])
-        if isinstance(product.get('updated_at'), str):
-            product['updated_at'] = datetime.fromisoformat(product['updated_at'])
-
-    return {
-        "data": products,
-        "total": total,
-        "limit": limit,
-        "skip": skip
-    }
+    return await cached_json(request, "products", load)
     
 
 @api_router.get("/products/all")
 async def get_products(
-    category: Optional[str] = None,
-    search: Optional[str] = None,
-    min_price: Optional[float] = None,
-    max_price: Optional[float] = None,
-    tags: Optional[str] = None,
+    request: Request,
+    query: Dict[str, Any] = Depends(product_list_query),
+    projection: Dict[str, Any] = Depends(product_list_projection),
+    sort: List[tuple] = Depends(product_list_sort),
     limit: int = Query(25, le=100),
     skip: int = Query(0)
 ):
-    query = {"is_active": True}
-
-    if category:
-        query["category"] = category
-
-    if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
+    async def load():
+        total, products = await asyncio.gather(
+            db.products.count_documents(query),
+            list_products(query, projection, sort, skip, limit)
+        )
+        return {
+            "total": total,
+            "products": products
+        }
 
-    if min_price is not None or max_price is not None:
-        query["price"] = {}
-        if min_price is not None:
-            query["price"]["$gte"] = min_price
-        if max_price is not None:
-            query["price"]["$lte"] = max_price
+    return await cached_json(request, "products", load)
 
-    if tags:
-        tag_list = tags.split(",")
-        query["tags"] = {"$in": tag_list}
+@api_router.get("/products", response_model=List[Product])
+async def get_products(
+    request: Request,
+    query: Dict[str, Any] = Depends(product_list_query),
+    projection: Dict[str, Any] = Depends(product_list_projection),
+    sort: List[tuple] = Depends(product_list_sort),
+    limit: int = Query(50, le=100),
+    skip: int = 0
+):
+    """List products; view=card returns ProductCard documents"""
+    return await cached_json(request, "products", lambda: list_products(query, projection, sort, skip, limit))
 
-    # ✅ TOTAL COUNT
-    total = await db.products.count_documents(query)
+# Price histogram boundaries in EUR; prices from the last boundary up share one open bucket
+PRICE_FACET_BOUNDARIES = [0, 10, 25, 50, 100, 250, 500]
+FACET_TAG_LIMIT = 50
 
-    # ✅ PAGINATED DATA
-    products = await db.products.find(query, {"_id": 0}) \
-        .skip(skip).limit(limit).to_list(limit)
+def price_facet(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """$facet stages counting products per price bucket; the top bucket is open-ended ("500+").
 
-    # datetime fix
-    for product in products:
-        if isinstance(product.get('created_at'), str):
-            product['created_at'] = datetime.fromisoformat(product['created_at'])
-        if isinstance(product.get('updated_at'), str):
-            product['updated_at'] = datetime.fromisoformat(product['updated_at'])
+    Missing or non-numeric prices are left out rather than counted with the most expensive.
+    """
+    return [
+        {"$match": {**match, "price": {"$type": "number"}}},
+        {"$bucket": {
+            "groupBy": "$price",
+            "boundaries": PRICE_FACET_BOUNDARIES + [float("inf")],
+            "default": "other",  # Negative or NaN; not reported
+            "output": {"count": {"$sum": 1}}
+        }}
+    ]
 
-    return {
-        "total": total,
-        "products": products
-    }
+def price_histogram(buckets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    counts = {bucket["_id"]: bucket["count"] for bucket in buckets}
+    bounds = PRICE_FACET_BOUNDARIES + [None]
+    return [{"min": low, "max": high, "count": counts.get(low, 0)} for low, high in zip(bounds[:-1], bounds[1:])]
 
-@api_router.get("/products", response_model=List[Product])
-async def get_products(
+@api_router.get("/products/facets")
+async def get_product_facets(
+    request: Request,
     category: Optional[str] = None,
     search: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
-    tags: Optional[str] = None,
-    limit: int = Query(50, le=100),
-    skip: int = 0
+    tags: Optional[str] = None
 ):
-    query = {"is_active": True}
-    
-    if category:
-        query["category"] = category
-    if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
+    """Category counts, tag counts and a price histogram for the current filter, in one $facet.
+
+    Each facet is counted with every filter except its own, so the UI can still show how many
+    products the other categories, tags or price buckets would give. A category's count covers
+    its whole subtree, matching what filtering by it returns.
+    """
+    search = (search or "").strip() or None
+
+    async def condition(**kwargs) -> Dict[str, Any]:
+        return {k: v for k, v in (await product_list_query(**kwargs)).items() if k != "is_active"}
+
+    by_category = await condition(category=category)
+    by_price = await condition(min_price=min_price, max_price=max_price)
+    tag_list = sorted({t.strip() for t in tags.split(",") if t.strip()}) if tags else []
+    by_tags = await condition(tags=",".join(tag_list)) if tag_list else {}
+    base = await product_list_query(search=search)
+
+    async def load():
+        pipeline = [
+            {"$match": base},
+            {"$facet": {
+                "total": [{"$match": {**by_category, **by_price, **by_tags}}, {"$count": "count"}],
+                "categories": [
+                    {"$match": {**by_price, **by_tags}},
+                    {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+                    # Credit each category's count to its ancestors too, via the materialized path
+                    {"$lookup": {"from": "categories", "localField": "_id", "foreignField": "slug", "as": "_node"}},
+                    {"$unwind": {"path": "$_node", "preserveNullAndEmptyArrays": True}},
+                    {"$lookup": {"from": "categories", "localField": "_node.ancestors", "foreignField": "id", "as": "_ancestors"}},
+                    {"$project": {"count": 1, "path": {"$concatArrays": [["$_id"], "$_ancestors.slug"]}}},
+                    {"$unwind": "$path"},
+                    {"$group": {"_id": "$path", "count": {"$sum": "$count"}}},
+                    {"$sort": {"count": -1, "_id": 1}}
+                ],
+                "tags": [
+                    {"$match": {**by_category, **by_price}},
+                    {"$unwind": "$tags"},
+                    {"$sortByCount": "$tags"},
+                    {"$limit": FACET_TAG_LIMIT}
+                ],
+                "price": price_facet({**by_category, **by_tags})
+            }}
         ]
-    if min_price is not None or max_price is not None:
-        query["price"] = {}
-        if min_price is not None:
-            query["price"]["$gte"] = min_price
-        if max_price is not None:
-            query["price"]["$lte"] = max_price
-    if tags:
-        tag_list = tags.split(",")
-        query["tags"] = {"$in": tag_list}
-    
-    products = await db.products.find(query, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
-    
-    for product in products:
-        if isinstance(product.get('created_at'), str):
-            product['created_at'] = datetime.fromisoformat(product['created_at'])
-        if isinstance(product.get('updated_at'), str):
-            product['updated_at'] = datetime.fromisoformat(product['updated_at'])
-    
-    return products
+        facets = (await db.products.aggregate(pipeline).to_list(1))[0]
 
-from fastapi import Request
+        return {
+            "total": facets["total"][0]["count"] if facets["total"] else 0,
+            "categories": [{"value": c["_id"], "count": c["count"]} for c in facets["categories"]],
+            "tags": [{"value": t["_id"], "count": t["count"]} for t in facets["tags"]],
+            "price": price_histogram(facets["price"])
+        }
 
-@api_router.get("/products/{value}", response_model=Product)
-async def get_product(value: str, request: Request):
-    product = await db.products.find_one(
-        {"$or": [{"id": value}, {"slug": value}]},
-        {"_id": 0}
-    )
+    key = ("facets", category, (search or "").lower(), min_price, max_price, tuple(tag_list))
+    return await cached_json(request, "products", load, key=key)
 
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
+PRODUCT_BATCH_LIMIT = 100
 
-    base_url = str(request.base_url).rstrip("/")
+def split_values(values: Optional[str]) -> List[str]:
+    """Comma-separated query parameter -> distinct values in the order given"""
+    return list(dict.fromkeys(v.strip() for v in (values or "").split(",") if v.strip()))
 
-    product["images"] = [
-        img if img.startswith("http") else f"{base_url}{img}"
-        for img in product.get("images", [])
+@api_router.get("/products/batch")
+async def get_products_batch(
+    request: Request,
+    ids: Optional[str] = None,
+    slugs: Optional[str] = None,
+    view: str = Query("full", pattern="^(card|full)$")
+):
+    """Many products by id and/or slug in one request, e.g. to refresh a cart or compare list.
+
+    Products come back in the order requested; ids and slugs that match no active product are
+    listed in not_found so the client can drop them.
+    """
+    id_list, slug_list = split_values(ids), split_values(slugs)
+    if len(id_list) + len(slug_list) > PRODUCT_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {PRODUCT_BATCH_LIMIT} products per batch")
+
+    base_url = str(request.base_url).rstrip("/")
+    by_id, by_slug = await find_product_details(id_list, slug_list, base_url)
+
+    products, seen = [], set()
+    not_found = {"ids": [], "slugs": []}
+    for field, values, found in (("ids", id_list, by_id), ("slugs", slug_list, by_slug)):
+        for value in values:
+            product = found.get(value)
+            if product is None or not product["is_active"]:
+                not_found[field].append(value)
+            elif product["id"] not in seen:
+                seen.add(product["id"])
+                products.append(product)
+
+    if view == "card":
+        products = [
+            {**{f: product[f] for f in ProductCard.model_fields}, "images": product["images"][:1]}
+            for product in products
+        ]
+    return fast_json({"products": products, "not_found": not_found})
+
+@api_router.get("/products/availability")
+async def get_products_availability(ids: str):
+    """Stock not held by other checkouts, e.g. {"<id>": 3}; unknown ids are left out"""
+    product_ids = split_values(ids)
+    if len(product_ids) > PRODUCT_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {PRODUCT_BATCH_LIMIT} products per request")
+    return await available_stock(product_ids)
+
+# ========== PRODUCT IMPORT / EXPORT ==========
+
+PRODUCT_IMPORT_CHUNK_SIZE = 500
+PRODUCT_EXPORT_COLUMNS = [
+    "id", "name", "slug", "description", "category", "price", "compare_price", "sku",
+    "images", "stock_quantity", "low_stock_threshold", "tags", "specifications", "variants",
+    "seo_title", "seo_description", "is_active", "created_at", "updated_at"
+]
+PRODUCT_LIST_COLUMNS = {"images", "tags"}  # ";"-separated in CSV
+PRODUCT_JSON_COLUMNS = {"specifications", "variants"}  # JSON-encoded in CSV
+# Fields an import never overwrites on an existing product
+PRODUCT_IMPORT_INSERT_ONLY = {"id", "slug", "created_at"}
+
+class ProductImportUpdate(ProductCreate):
+    """Import row for an existing SKU: any subset of the ProductCreate columns"""
+    name: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    price: Optional[float] = None
+
+def decode_csv_product_row(row: Dict[str, str]) -> Dict[str, Any]:
+    """Turn a CSV row into ProductCreate input; empty cells leave the stored value untouched"""
+    data: Dict[str, Any] = {}
+    for key, value in row.items():
+        if key is None or value is None:
+            continue
+        key, value = key.strip(), value.strip()
+        if not value:
+            continue
+        if key in PRODUCT_LIST_COLUMNS:
+            data[key] = [item.strip() for item in value.split(";") if item.strip()]
+        elif key in PRODUCT_JSON_COLUMNS:
+            data[key] = json.loads(value)
+        elif key == "is_active":
+            data[key] = value.lower() in ("true", "1", "yes", "y")
+        else:
+            data[key] = value
+    return data
+
+def encode_csv_product_row(product: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of decode_csv_product_row for export"""
+    row = {}
+    for column in PRODUCT_EXPORT_COLUMNS:
+        value = product.get(column)
+        if column in PRODUCT_LIST_COLUMNS:
+            value = ";".join(value or [])
+        elif column in PRODUCT_JSON_COLUMNS:
+            value = json.dumps(value if value is not None else ({} if column == "specifications" else []))
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        row[column] = "" if value is None else value
+    return row
+
+def read_product_rows(stream: Iterable[str], fmt: str) -> Iterator[tuple]:
+    """Yield (row_number, data, error) for each record of a CSV or JSONL text stream"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            try:
+                yield reader.line_num, decode_csv_product_row(row), None
+            except ValueError as e:
+                yield reader.line_num, None, f"Invalid JSON cell: {e}"
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+            if isinstance(data, dict):
+                yield line_number, data, None
+            else:
+                yield line_number, None, "Expected a JSON object"
+
+def validate_import_row(data: Dict[str, Any]) -> ProductCreate:
+    """Validate an import row; a row with a SKU but only some columns becomes a ProductImportUpdate"""
+    try:
+        # A blank SKU is allocated from the SKU sequence at write time
+        return ProductCreate(**{"sku": "", **data})
+    except ValidationError as e:
+        if not data.get("sku") or any(err["type"] != "missing" for err in e.errors()):
+            raise
+        return ProductImportUpdate(**data)
+
+async def write_product_chunk(chunk: List[tuple], report: Dict[str, Any]):
+    """Upsert a chunk of (row_number, ProductCreate) keyed on SKU with one unordered bulk_write.
+
+    Existing products only get the columns the row supplied; the remaining defaults are
+    written on insert. ProductImportUpdate rows must match an existing SKU.
+    """
+    missing_sku = [product for _, product in chunk if not product.sku]
+    for product, sku in zip(missing_sku, await generate_skus(len(missing_sku))):
+        product.sku = sku
+
+    # Later rows repeating a SKU in the same chunk would race in an unordered write
+    rows, seen = [], {}
+    for row_number, product in chunk:
+        if product.sku in seen:
+            report["errors"].append({"row": row_number, "error": f"Duplicate SKU {product.sku} (row {seen[product.sku]})"})
+            continue
+        seen[product.sku] = row_number
+        rows.append((row_number, product))
+
+    existing = {
+        doc["sku"] async for doc in db.products.find({"sku": {"$in": list(seen)}}, {"_id": 0, "sku": 1})
+    }
+    for row_number, product in rows:
+        if isinstance(product, ProductImportUpdate) and product.sku not in existing:
+            required = [name for name in ("name", "description", "category", "price") if name not in product.model_fields_set]
+            report["errors"].append({"row": row_number, "error": f"Unknown SKU {product.sku}: {', '.join(required)} required for new products"})
+    rows = [
+        (row_number, product) for row_number, product in rows
+        if product.sku in existing or not isinstance(product, ProductImportUpdate)
     ]
 
-    return Product(**product)
+    new_rows = [product for _, product in rows if product.sku not in existing]
+    new_slugs = await allocate_slugs(db.products, [p.slug or p.name for p in new_rows])
+    slugs = {product.sku: slug for product, slug in zip(new_rows, new_slugs)}
+
+    now = datetime.now(timezone.utc)
+    operations = []
+    for _, product in rows:
+        fields = product.model_dump(exclude_unset=True, exclude=PRODUCT_IMPORT_INSERT_ONLY)
+        fields["sku"] = product.sku
+        fields["updated_at"] = now
+        if product.sku in existing:
+            operations.append(UpdateOne({"sku": product.sku}, {"$set": fields}))
+            continue
+        # New SKU: the columns the row left out get their defaults (a path may not be in both operators)
+        defaults = {
+            key: value for key, value in product.model_dump(exclude=PRODUCT_IMPORT_INSERT_ONLY).items()
+            if key not in fields
+        }
+        operations.append(UpdateOne(
+            {"sku": product.sku},
+            {
+                "$set": fields,
+                "$setOnInsert": {
+                    **defaults,
+                    "id": str(uuid.uuid4()), "slug": slugs.get(product.sku), "wishlist_count": 0, "created_at": now
+                }
+            },
+            upsert=True
+        ))
+    if not operations:
+        return
 
-def generate_slug(name: str):
-    return name.strip().lower().replace(" ", "-")
+    try:
+        result = await db.products.bulk_write(operations, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for error in details.get("writeErrors", []):
+            report["errors"].append({"row": rows[error["index"]][0], "error": error.get("errmsg", "Write failed")})
+
+    report["inserted"] += details.get("nUpserted", 0)
+    report["updated"] += details.get("nMatched", 0)
+
+async def import_products(records: Iterable[tuple], chunk_size: int = PRODUCT_IMPORT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Validate (row_number, data, error) records against ProductCreate and upsert them in chunks"""
+    report: Dict[str, Any] = {"processed": 0, "inserted": 0, "updated": 0, "errors": []}
+    chunk: List[tuple] = []
+
+    for row_number, data, error in records:
+        report["processed"] += 1
+        if error:
+            report["errors"].append({"row": row_number, "error": error})
+            continue
+        try:
+            chunk.append((row_number, validate_import_row(data)))
+        except ValidationError as e:
+            message = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            report["errors"].append({"row": row_number, "error": message})
+            continue
+
+        if len(chunk) >= chunk_size:
+            await write_product_chunk(chunk, report)
+            chunk = []
+
+    if chunk:
+        await write_product_chunk(chunk, report)
+
+    report["errors"].sort(key=lambda err: err["row"])
+    return report
+
+async def export_products(fmt: str) -> AsyncIterator[str]:
+    """Stream every product as CSV or JSONL text from a server-side cursor"""
+    cursor = db.products.find({}, {"_id": 0}).sort("id", 1).batch_size(PRODUCT_IMPORT_CHUNK_SIZE)
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=PRODUCT_EXPORT_COLUMNS)
+        writer.writeheader()
+        async for product in cursor:
+            writer.writerow(encode_csv_product_row(product))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        async for product in cursor:
+            yield json.dumps(product, default=json_default) + "\n"
 
-def generate_sku(prefix="GLENN"):
-    number = random.randint(10000, 99999)  
-    return f"{prefix}{number}"
+def product_file_format(filename: Optional[str], fmt: Optional[str]) -> str:
+    fmt = fmt or ("jsonl" if (filename or "").lower().endswith((".jsonl", ".ndjson")) else "csv")
+    if fmt not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+    return fmt
 
-@api_router.post("/products", response_model=Product)
-async def create_product(
-    product_data: ProductCreate,
+@api_router.post("/products/import")
+async def import_products_file(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|jsonl)$"),
     admin: User = Depends(get_admin_user)
 ):
-    product_dict = product_data.model_dump()
+    """Admin: Bulk upsert products (keyed on SKU) from a CSV or JSONL upload, with per-row errors"""
+    fmt = product_file_format(file.filename, format)
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return await import_products(read_product_rows(stream, fmt))
+    finally:
+        stream.detach()
+        invalidate_product_caches()
+
+@api_router.get("/products/export")
+async def export_products_file(
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    admin: User = Depends(get_admin_user)
+):
+    """Admin: Stream the full catalog as CSV or JSONL"""
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_products(format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'}
+    )
 
-    if not product_dict.get("slug"):
-        base_slug = generate_slug(product_dict["name"])
-        slug = base_slug
-        counter = 1
+# ========== BULK PRICE / STOCK UPDATES ==========
 
-        while await db.products.find_one({"slug": slug}):
-            slug = f"{base_slug}-{counter}"
-            counter += 1
+async def unmatched_patches(patches: List[ProductPatch], now: datetime, skip: set) -> List[Dict[str, Any]]:
+    """Lines of a bulk patch that matched no product, from one $in read after the write.
 
-        product_dict["slug"] = slug
+    Every applied line stamps updated_at with the batch's time, so a known product without it
+    was a negative stock_delta larger than the stock.
+    """
+    ids = [patch.id for patch in patches if patch.id]
+    skus = [patch.sku for patch in patches if patch.sku]
+    found: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    cursor = db.products.find(
+        {"$or": [{"id": {"$in": ids}}, {"sku": {"$in": skus}}]}, {"_id": 0, "id": 1, "sku": 1, "updated_at": 1}
+    )
+    async for doc in cursor:
+        found[("id", doc["id"])] = doc
+        found[("sku", doc.get("sku"))] = doc
+
+    unmatched = []
+    for index, patch in enumerate(patches):
+        if index in skip:
+            continue
+        doc = found.get(("id", patch.id) if patch.id else ("sku", patch.sku))
+        if doc is None:
+            unmatched.append({"index": index, "error": "Unknown product id" if patch.id else "Unknown SKU"})
+        elif doc.get("updated_at") != now:
+            unmatched.append({"index": index, "error": "Not enough stock for stock_delta"})
+    return unmatched
+
+@api_router.patch("/products/bulk")
+async def bulk_patch_products(
+    patches: List[ProductPatch] = Body(..., max_length=10000),
+    admin: User = Depends(get_admin_user)
+):
+    """Admin: Apply price/stock patches in one unordered bulk_write.
 
-    if not product_dict.get("sku"):
-        while True:
-            sku = generate_sku("GLENN")
+    Only the listed fields are touched, so no slug/SKU work or re-read is needed. A negative
+    stock_delta only applies if enough stock remains; lines that match no product are listed
+    in unmatched by index.
+    """
+    now = datetime.now(timezone.utc)
+    # Stored with millisecond precision; unmatched_patches compares against the stored value
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    operations = []
+    for patch in patches:
+        query: Dict[str, Any] = {"id": patch.id} if patch.id else {"sku": patch.sku}
+        fields = patch.model_dump(exclude={"id", "sku", "stock_delta"}, exclude_none=True)
+        update: Dict[str, Any] = {"$set": {**fields, "updated_at": now}}
+        if patch.stock_delta:
+            update["$inc"] = {"stock_quantity": patch.stock_delta}
+            if patch.stock_delta < 0:
+                query["stock_quantity"] = {"$gte": -patch.stock_delta}
+        operations.append(UpdateOne(query, update))
+
+    if not operations:
+        return {"matched": 0, "modified": 0, "errors": [], "unmatched": []}
+
+    errors = []
+    try:
+        result = await db.products.bulk_write(operations, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        errors = [
+            {"index": error["index"], "error": error.get("errmsg", "Write failed")}
+            for error in details.get("writeErrors", [])
+        ]
+    invalidate_product_caches()
 
-            existing = await db.products.find_one({"sku": sku})
-            if not existing:
-                product_dict["sku"] = sku
-                break
+    matched = details.get("nMatched", 0)
+    failed = {error["index"] for error in errors}
+    unmatched = []
+    if matched + len(failed) < len(operations):
+        unmatched = await unmatched_patches(patches, now, failed)
 
-    product = Product(**product_dict)
-    product_doc = product.model_dump()
+    return {
+        "matched": matched,
+        "modified": details.get("nModified", 0),
+        "errors": errors,
+        "unmatched": unmatched
+    }
+
+from fastapi import Request
+
+@api_router.get("/products/{value}", response_model=Product)
+async def get_product(value: str, request: Request):
+    base_url = str(request.base_url).rstrip("/")
+    product = await get_product_detail(value, base_url)
 
-    if isinstance(product_doc.get("created_at"), datetime):
-        product_doc["created_at"] = product_doc["created_at"].isoformat()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
 
-    if isinstance(product_doc.get("updated_at"), datetime):
-        product_doc["updated_at"] = product_doc["updated_at"].isoformat()
+    etag = make_etag(product["id"], product["updated_at"], base_url)
+    if etag_matches(request, etag):
+        return not_modified(etag, "product")
 
-    try:
-        await db.products.insert_one(product_doc)
-    except DuplicateKeyError:
-        return {"error": "SKU already exists, try again"}
+    return set_validators(fast_json(product), etag, "product")
+
+@api_router.post("/products", response_model=Product)
+async def create_product(
+    product_data: ProductCreate,
+    admin: User = Depends(get_admin_user)
+):
+    product_dict = product_data.model_dump()
+    slug_source = product_dict.get("slug") or product_dict["name"]
+    sku_generated = not product_dict.get("sku")
+
+    while True:
+        product_dict["slug"] = await allocate_slug(db.products, slug_source)
+        if sku_generated:
+            product_dict["sku"] = await generate_sku("GLENN")
+
+        product = Product(**product_dict)
+        product_doc = product.model_dump()
+
+        try:
+            await db.products.insert_one(product_doc)
+            break
+        except DuplicateKeyError as e:
+            # A concurrent writer took the slug, or a generated SKU clashed with a hand-typed one
+            field = duplicate_key_field(e)
+            if field == "slug" or (sku_generated and field == "sku"):
+                continue
+            raise HTTPException(status_code=400, detail="SKU already exists")
 
+    invalidate_product_caches([product.id])
     return product
 
 @api_router.put("/products/{product_id}", response_model=Product)
@@ -836,112 +2224,458 @@ async def update_product(
     update_data = product_data.model_dump()
 
     if not update_data.get('slug') or update_data['name'] != existing.get('name'):
-        base_slug = generate_slug(update_data['name'])
-        slug = base_slug
-        counter = 1
-
-        while True:
-            existing_slug = await db.products.find_one({
-                "slug": slug,
-                "id": {"$ne": product_id}  
-            })
-            if not existing_slug:
-                break
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-
-        update_data['slug'] = slug
-    if update_data.get("sku"):
-        existing_sku = await db.products.find_one({
-            "sku": update_data["sku"],
-            "id": {"$ne": product_id}
-        })
-
-        if existing_sku:
-            raise HTTPException(status_code=400, detail="SKU already exists")
-
+        slug_source = update_data['name']
     else:
-        while True:
-            sku = generate_sku("GLENN")
-
-            existing_sku = await db.products.find_one({
-                "sku": sku,
-                "id": {"$ne": product_id}
-            })
-
-            if not existing_sku:
-                update_data["sku"] = sku
-                break
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-    await db.products.update_one(
-        {"id": product_id},
-        {"$set": update_data}
-    )
+        slug_source = update_data['slug']
+    if not update_data.get("sku"):
+        update_data["sku"] = await generate_sku("GLENN")
+    update_data['updated_at'] = datetime.now(timezone.utc)
+    try:
+        await update_with_slug(db.products, product_id, update_data, slug_source)
+    except DuplicateKeyError:
+        # SKU uniqueness is enforced by the unique index on products.sku
+        raise HTTPException(status_code=400, detail="SKU already exists")
+    invalidate_product_caches([product_id])
 
     updated_product = await db.products.find_one(
         {"id": product_id},
         {"_id": 0}
     )
 
-    # Convert back to datetime
-    if isinstance(updated_product.get('created_at'), str):
-        updated_product['created_at'] = datetime.fromisoformat(updated_product['created_at'])
-
-    if isinstance(updated_product.get('updated_at'), str):
-        updated_product['updated_at'] = datetime.fromisoformat(updated_product['updated_at'])
-
     return Product(**updated_product)
 @api_router.delete("/products/{product_id}")
 async def delete_product(product_id: str, admin: User = Depends(get_admin_user)):
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    invalidate_product_caches([product_id])
     return {"message": "Product deleted successfully"}
 
 # ========== CATEGORY ROUTES ==========
 
+def categories_changed():
+    """After a category write: reload the descendant map and drop responses that expand categories"""
+    category_tree.mark_changed()
+    invalidate_cached_responses("category_tree", "products", "homepage")
+
 @api_router.get("/categories", response_model=List[Category])
-async def get_categories():
-    categories = await db.categories.find({"is_active": True}, {"_id": 0}).to_list(100)
-    for cat in categories:
-        if isinstance(cat.get('created_at'), str):
-            cat['created_at'] = datetime.fromisoformat(cat['created_at'])
+async def get_categories(request: Request, response: Response):
+    query = {"is_active": True}
+    # Versioned before the read: a write in between only costs the client one extra refetch
+    etag = make_etag("categories", *await collection_version(db.categories, query))
+    if etag_matches(request, etag):
+        return not_modified(etag, "categories")
+
+    categories = await db.categories.find(query, {"_id": 0}).to_list(None)
+    set_validators(response, etag, "categories")
     return categories
 
-@api_router.post("/categories", response_model=Category)
-async def create_category(category_data: CategoryCreate, admin: User = Depends(get_admin_user)):
-    category = Category(**category_data.model_dump())
-    category_doc = category.model_dump()
-    category_doc['created_at'] = category_doc['created_at'].isoformat()
-    
-    await db.categories.insert_one(category_doc)
-    return category
+@api_router.get("/categories/tree")
+async def get_category_tree(request: Request):
+    """Active categories nested by parent, with product_count (own) and total_count (subtree)"""
+    async def load():
+        categories, counts = await asyncio.gather(
+            db.categories.find({"is_active": True}, {"_id": 0}).to_list(None),
+            db.products.aggregate([
+                {"$match": {"is_active": True}},
+                {"$group": {"_id": "$category", "count": {"$sum": 1}}}
+            ]).to_list(None)
+        )
+        return build_category_tree(categories, {c["_id"]: c["count"] for c in counts})
+
+    return await cached_json(request, "category_tree", load)
+
+@api_router.post("/categories", response_model=Category)
+async def create_category(category_data: CategoryCreate, admin: User = Depends(get_admin_user)):
+    category = Category(
+        **category_data.model_dump(),
+        ancestors=await category_ancestors(category_data.parent_id)
+    )
+    category_doc = category.model_dump()
+    
+    await insert_with_slug(db.categories, category_doc, category_data.slug or category_data.name)
+    category.slug = category_doc['slug']
+    categories_changed()
+    return category
+
+@api_router.put("/categories/{category_id}", response_model=Category)
+async def update_category(category_id: str, category_data: CategoryCreate, admin: User = Depends(get_admin_user)):
+    existing = await db.categories.find_one({"id": category_id})
+    if not existing:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    update_data = category_data.model_dump()
+    update_data['ancestors'] = await category_ancestors(category_data.parent_id, category_id)
+    update_data['updated_at'] = datetime.now(timezone.utc)
+    await update_with_slug(db.categories, category_id, update_data, category_data.slug or category_data.name)
+    if update_data['ancestors'] != existing.get('ancestors', []):
+        await move_category_subtree(category_id, update_data['ancestors'])
+    categories_changed()
+    
+    updated_category = await db.categories.find_one({"id": category_id}, {"_id": 0})
+    
+    return Category(**updated_category)
+
+@api_router.delete("/categories/{category_id}")
+async def delete_category(category_id: str, admin: User = Depends(get_admin_user)):
+    category = await db.categories.find_one_and_delete({"id": category_id}, {"_id": 0, "parent_id": 1})
+    if category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    # Children move up to the deleted category's parent
+    await db.categories.update_many(
+        {"parent_id": category_id},
+        {"$set": {"parent_id": category.get("parent_id"), "updated_at": datetime.now(timezone.utc)}}
+    )
+    await db.categories.update_many({"ancestors": category_id}, {"$pull": {"ancestors": category_id}})
+    categories_changed()
+    return {"message": "Category deleted successfully"}
+
+# ========== ORDER PRICING ==========
+
+# Used when no configured shipping method serves the destination (same rule as the checkout page)
+DEFAULT_SHIPPING_COST = 5.0
+DEFAULT_FREE_SHIPPING_THRESHOLD = 50.0
+# Largest difference between a client-sent amount and the server's price that is put down to rounding
+PRICE_TOLERANCE = 0.01
+ORDER_ITEM_LIMIT = 100
+ORDER_PRICING_PROJECTION = {"_id": 0, "id": 1, "name": 1, "price": 1, "is_active": 1}
+
+def money(amount: float) -> float:
+    return round(amount, 2)
+
+async def order_shipping(subtotal: float, country: Optional[str], method_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """The quoted shipping option for the order: the chosen method, else the cheapest; None if none apply"""
+    await shipping_rates.ensure_current()
+    options = shipping_rates.quote(subtotal, 0.0, [country or ""])[0]["methods"]
+    if method_id:
+        option = next((o for o in options if o["id"] == method_id), None)
+        if option is None:
+            raise HTTPException(status_code=400, detail="Shipping method not available for this destination")
+        return option
+    return options[0] if options else None
+
+async def price_order(order_data: OrderCreate) -> Dict[str, Any]:
+    """Price an order from the catalog: line prices from one $in query, VAT from the cached site
+    settings, shipping from the rate table and the requested wallet credit.
+
+    Returns the priced items and amounts; client-sent prices and totals are never used.
+    """
+    if not order_data.items:
+        raise HTTPException(status_code=400, detail="Order has no items")
+    if len(order_data.items) > ORDER_ITEM_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {ORDER_ITEM_LIMIT} items per order")
+    for item in order_data.items:
+        quantity = item.get("quantity")
+        if not isinstance(item.get("product_id"), str) or not isinstance(quantity, int) or quantity < 1:
+            raise HTTPException(status_code=400, detail="Each item needs a product_id and a positive quantity")
+
+    product_ids = list({item["product_id"] for item in order_data.items})
+    products = {
+        doc["id"]: doc
+        async for doc in db.products.find({"id": {"$in": product_ids}}, ORDER_PRICING_PROJECTION)
+    }
+    settings = await get_site_settings()
+
+    items, unavailable, subtotal = [], [], 0.0
+    for item in order_data.items:
+        product = products.get(item["product_id"])
+        if product is None or not product.get("is_active", True):
+            unavailable.append(item.get("name") or item["product_id"])
+            continue
+        items.append({**item, "name": product["name"], "price": product["price"]})
+        subtotal += product["price"] * item["quantity"]
+    if unavailable:
+        raise HTTPException(status_code=400, detail=f"No longer available: {', '.join(unavailable)}")
+
+    subtotal = money(subtotal)
+    tax = money(subtotal * settings.tax_rate / 100)
+    shipping = await order_shipping(subtotal, order_data.shipping_address.get("country"), order_data.shipping_method_id)
+    if shipping is not None:
+        shipping_cost = shipping["cost"]
+    else:
+        shipping_cost = 0.0 if subtotal > DEFAULT_FREE_SHIPPING_THRESHOLD else DEFAULT_SHIPPING_COST
+
+    total = money(subtotal + tax + shipping_cost)
+    wallet_credit = money(order_data.wallet_credit)
+    if wallet_credit > total:
+        raise HTTPException(status_code=400, detail="Wallet credit exceeds the order total")
+
+    return {
+        "items": items,
+        "subtotal": subtotal,
+        "tax": tax,
+        "shipping_cost": shipping_cost,
+        "shipping_method_id": shipping["id"] if shipping else None,
+        "shipping_carrier": shipping["carrier"] if shipping else None,
+        "wallet_credit": wallet_credit,
+        "total": money(total - wallet_credit),
+    }
+
+def check_order_totals(order_data: OrderCreate, pricing: Dict[str, Any]):
+    """Reject an order whose client-side amounts differ from the server's, e.g. after a price change"""
+    fields = ("subtotal", "shipping_cost", "tax", "total")
+    if any(abs(getattr(order_data, f) - pricing[f]) > PRICE_TOLERANCE + 1e-9 for f in fields):
+        raise HTTPException(status_code=409, detail={
+            "message": "Prices have changed, please review your order",
+            "expected": {f: pricing[f] for f in fields}
+        })
+
+# ========== STOCK HOLDS ==========
+
+# A checkout reserves its items for this long; products.reserved_quantity counts every unreleased hold
+STOCK_HOLD_SECONDS = int(os.environ.get("STOCK_HOLD_SECONDS", "900"))
+STOCK_HOLD_SWEEP_INTERVAL = 30
+# A claim still unfinished after this long belongs to a releaser that failed; the next claim takes it over
+STOCK_HOLD_CLAIM_TIMEOUT = 300
+# Released holds are purged by the TTL index on released_at this long after release; unreleased
+# holds never are, since their units are still counted in products.reserved_quantity
+STOCK_HOLD_PURGE_AFTER = 86400
+
+# product_id -> quantity held by unexpired holds; dropped when this process places or releases holds
+held_stock_cache: TTLCache = TTLCache(maxsize=1, ttl=5)
+
+def release_reserved(totals: Dict[str, int]) -> List[UpdateOne]:
+    """Updates returning held quantities to the products, never taking reserved_quantity below zero.
+
+    Reservations are not catalog edits: updated_at and the product caches are left alone.
+    """
+    return [
+        UpdateOne({"id": product_id}, [{"$set": {
+            "reserved_quantity": {"$max": [0, {"$subtract": [{"$ifNull": ["$reserved_quantity", 0]}, quantity]}]}
+        }}])
+        for product_id, quantity in totals.items()
+    ]
+
+async def claim_holds(query: Dict[str, Any], session=None) -> Tuple[str, Dict[str, int]]:
+    """Tag the matching unreleased holds for one releaser and total them per product.
+
+    Tagging is atomic per hold, so the sweeper and an order never both release the same hold.
+    Claims older than STOCK_HOLD_CLAIM_TIMEOUT are taken over, so a releaser that failed
+    half-way doesn't keep the units reserved for good.
+    """
+    now = datetime.now(timezone.utc)
+    token = str(uuid.uuid4())
+    claimed = await db.stock_holds.update_many(
+        {
+            **query,
+            "released_at": None,
+            "$or": [
+                {"claimed_by": None},
+                {"claimed_at": {"$lt": now - timedelta(seconds=STOCK_HOLD_CLAIM_TIMEOUT)}}
+            ]
+        },
+        {"$set": {"claimed_by": token, "claimed_at": now}},
+        session=session
+    )
+    if not claimed.modified_count:
+        return token, {}
+    pipeline = [
+        {"$match": {"claimed_by": token}},
+        {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}}
+    ]
+    totals = {g["_id"]: g["quantity"] async for g in db.stock_holds.aggregate(pipeline, session=session)}
+    return token, totals
+
+async def mark_holds_released(token: str, session=None):
+    await db.stock_holds.update_many(
+        {"claimed_by": token}, {"$set": {"released_at": datetime.now(timezone.utc)}}, session=session
+    )
+
+async def unclaim_holds(token: str):
+    await db.stock_holds.update_many(
+        {"claimed_by": token, "released_at": None}, {"$set": {"claimed_by": None, "claimed_at": None}}
+    )
+
+async def release_holds(query: Dict[str, Any]) -> int:
+    """Release the matching holds in bulk: one claim, one bulk update of the products, one mark.
+
+    The three writes share a transaction where available; without one, a failure leaves the
+    holds claimed and the next sweep after STOCK_HOLD_CLAIM_TIMEOUT retries them.
+    """
+    released = 0
+
+    async def write_release(session):
+        nonlocal released
+        token, totals = await claim_holds(query, session=session)
+        if totals:
+            await db.products.bulk_write(release_reserved(totals), ordered=False, session=session)
+            await mark_holds_released(token, session=session)
+        released = sum(totals.values())
+
+    await run_in_transaction(write_release)
+    if released:
+        held_stock_cache.clear()
+    return released
+
+async def place_holds(user_id: str, items: List[StockHoldItem]) -> datetime:
+    """Reserve every item for user_id or none of them; replaces the user's previous holds.
+
+    Each reservation is one conditional update, so concurrent checkouts can't hold more
+    than stock_quantity between them.
+    """
+    await release_holds({"user_id": user_id})
+
+    quantities: Dict[str, int] = defaultdict(int)
+    for item in items:
+        quantities[item.product_id] += item.quantity
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=STOCK_HOLD_SECONDS)
+
+    # Hold documents go in first, so a crash can leave stock under-reserved but never locked
+    hold_docs = [
+        {"id": str(uuid.uuid4()), "user_id": user_id, "product_id": product_id, "quantity": quantity,
+         "expires_at": expires_at, "created_at": now, "claimed_by": None, "claimed_at": None, "released_at": None}
+        for product_id, quantity in quantities.items()
+    ]
+    await db.stock_holds.insert_many(hold_docs)
+
+    results = await asyncio.gather(*[
+        db.products.update_one(
+            {
+                "id": product_id,
+                "is_active": True,
+                "$expr": {"$gte": [
+                    {"$subtract": ["$stock_quantity", {"$ifNull": ["$reserved_quantity", 0]}]}, quantity
+                ]}
+            },
+            {"$inc": {"reserved_quantity": quantity}}
+        )
+        for product_id, quantity in quantities.items()
+    ])
+    held = {doc["id"] for doc, result in zip(hold_docs, results) if result.modified_count}
+    held_stock_cache.clear()
+
+    if len(held) < len(hold_docs):
+        await db.stock_holds.delete_many({"id": {"$in": [d["id"] for d in hold_docs if d["id"] not in held]}})
+        await release_holds({"id": {"$in": list(held)}})
+        unavailable = [d["product_id"] for d in hold_docs if d["id"] not in held]
+        raise HTTPException(status_code=409, detail={
+            "message": "Some items are no longer available in the requested quantity",
+            "available": await available_stock(unavailable)
+        })
+    return expires_at
+
+async def held_quantities() -> Dict[str, int]:
+    """Quantity held by unexpired holds per product, from one aggregate shared for a few seconds"""
+    held = held_stock_cache.get("held")
+    if held is None:
+        pipeline = [
+            {"$match": {"expires_at": {"$gt": datetime.now(timezone.utc)}, "released_at": None}},
+            {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}}
+        ]
+        held = {g["_id"]: g["quantity"] async for g in db.stock_holds.aggregate(pipeline)}
+        held_stock_cache["held"] = held
+    return held
+
+async def available_stock(product_ids: List[str]) -> Dict[str, int]:
+    """Stock not held by an unexpired checkout, per product id"""
+    held = await held_quantities()
+    return {
+        doc["id"]: max(0, doc.get("stock_quantity", 0) - held.get(doc["id"], 0))
+        async for doc in db.products.find({"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "stock_quantity": 1})
+    }
+
+def other_holds(held: int) -> Dict[str, Any]:
+    """Units reserved by other customers' holds, given what the buyer holds on the product"""
+    return {"$max": [0, {"$subtract": [{"$ifNull": ["$reserved_quantity", 0]}, held]}]}
+
+async def restore_stock(taken: Dict[str, int], ordered: Dict[str, int]):
+    """Undo take_stock where there is no transaction to roll back; taken maps each product id
+    to the reserved units its update released"""
+    if taken:
+        await db.products.bulk_write([
+            UpdateOne({"id": pid}, {"$inc": {"stock_quantity": ordered[pid], "reserved_quantity": released}})
+            for pid, released in taken.items()
+        ], ordered=False)
+
+async def take_stock(ordered: Dict[str, int], held: Dict[str, int], now: datetime, session=None) -> Dict[str, int]:
+    """Decrement stock for an order, but only where enough is left once other customers' holds
+    are set aside; the buyer's own holds on the product are released by the same update.
+
+    All lines or none: 409 with the available quantities otherwise. In a transaction this is one
+    bulk write that the caller's abort undoes; without one, lines are taken one at a time and put
+    back on failure. Returns product id -> reserved units actually released, for restore_stock
+    (the release is clamped at zero, so a drifted counter gives back less than held); empty in
+    a transaction, where there is nothing to restore by hand.
+    """
+    updates = {
+        product_id: (
+            {"id": product_id, "$expr": {"$gte": [
+                {"$subtract": ["$stock_quantity", other_holds(held.get(product_id, 0))]}, quantity
+            ]}},
+            [{"$set": {
+                "stock_quantity": {"$subtract": ["$stock_quantity", quantity]},
+                "reserved_quantity": other_holds(held.get(product_id, 0)),
+                "updated_at": now
+            }}]
+        )
+        for product_id, quantity in ordered.items()
+    }
+
+    short = False
+    if session is not None:
+        result = await db.products.bulk_write(
+            [UpdateOne(query, update) for query, update in updates.values()], ordered=False, session=session
+        )
+        short = result.matched_count < len(updates)
+        taken: Dict[str, int] = {}
+    else:
+        taken = {}
+        for product_id, (query, update) in updates.items():
+            before = await db.products.find_one_and_update(
+                query, update, projection={"_id": 0, "reserved_quantity": 1}, return_document=ReturnDocument.BEFORE
+            )
+            if before is None:
+                short = True
+                break
+            taken[product_id] = min(held.get(product_id, 0), max(before.get("reserved_quantity") or 0, 0))
+        if short:
+            await restore_stock(taken, ordered)
+
+    if short:
+        raise HTTPException(status_code=409, detail={
+            "message": "Some items are no longer available in the requested quantity",
+            "available": await available_stock(list(ordered))
+        })
+    return taken
 
-@api_router.put("/categories/{category_id}", response_model=Category)
-async def update_category(category_id: str, category_data: CategoryCreate, admin: User = Depends(get_admin_user)):
-    existing = await db.categories.find_one({"id": category_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
-    await db.categories.update_one({"id": category_id}, {"$set": category_data.model_dump()})
-    
-    updated_category = await db.categories.find_one({"id": category_id}, {"_id": 0})
-    if isinstance(updated_category.get('created_at'), str):
-        updated_category['created_at'] = datetime.fromisoformat(updated_category['created_at'])
-    
-    return Category(**updated_category)
+async def release_expired_holds() -> int:
+    """Release every hold past its expiry; returns the units given back"""
+    return await release_holds({"expires_at": {"$lte": datetime.now(timezone.utc)}})
 
-@api_router.delete("/categories/{category_id}")
-async def delete_category(category_id: str, admin: User = Depends(get_admin_user)):
-    result = await db.categories.delete_one({"id": category_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Category not found")
-    return {"message": "Category deleted successfully"}
+async def sweep_stock_holds():
+    """Background job: release expired holds in bulk every STOCK_HOLD_SWEEP_INTERVAL seconds"""
+    while True:
+        try:
+            released = await release_expired_holds()
+            if released:
+                logger.info(f"Released {released} units from expired stock holds")
+        except Exception as e:
+            logger.warning(f"Stock hold sweep failed: {e}")
+        await asyncio.sleep(STOCK_HOLD_SWEEP_INTERVAL)
+
+@api_router.post("/checkout/hold")
+async def hold_checkout_stock(request: StockHoldRequest, current_user: User = Depends(get_current_user)):
+    """Reserve the cart's items while the customer checks out; 409 with what is available otherwise"""
+    expires_at = await place_holds(current_user.id, request.items)
+    return {"expires_at": expires_at, "hold_seconds": STOCK_HOLD_SECONDS}
+
+@api_router.delete("/checkout/hold")
+async def release_checkout_stock(current_user: User = Depends(get_current_user)):
+    """Give back the stock held for the current user's checkout"""
+    return {"released": await release_holds({"user_id": current_user.id})}
 
 # ========== ORDER ROUTES ==========
 
 @api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
+async def create_order(
+    order_data: OrderCreate,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    pricing = await price_order(order_data)
+    check_order_totals(order_data, pricing)
+
     order_id = str(uuid.uuid4())
     order_number = f"GLN-{await db.orders.count_documents({}) + 1:06d}"
 
@@ -949,20 +2683,56 @@ async def create_order(order_data: OrderCreate, current_user: User = Depends(get
         id=order_id,                
         order_number=order_number,
         user_id=current_user.id,     
-        **order_data.model_dump()
+        **{**order_data.model_dump(), **pricing}
     )
 
     order_doc = order.model_dump()
-    order_doc['created_at'] = order_doc['created_at'].isoformat()
-    order_doc['updated_at'] = order_doc['updated_at'].isoformat()
-
-    for item in order_data.items:
-        product = await db.products.find_one({"id": item['product_id']})
-        if product:
-            new_stock = max(0, product['stock_quantity'] - item['quantity'])
-            await db.products.update_one({"id": item['product_id']}, {"$set": {"stock_quantity": new_stock}})
+    now = datetime.now(timezone.utc)
+    ordered: Dict[str, int] = defaultdict(int)
+    for item in pricing["items"]:
+        ordered[item["product_id"]] += item["quantity"]
+
+    async def pay_with_wallet(session):
+        if pricing["wallet_credit"] > 0:
+            debit = await db.wallets.update_one(
+                {"user_id": current_user.id, "balance": {"$gte": pricing["wallet_credit"]}},
+                {"$inc": {"balance": -pricing["wallet_credit"]}, "$set": {"updated_at": now}},
+                session=session
+            )
+            if debit.matched_count == 0:
+                raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+            transaction = WalletTransaction(
+                user_id=current_user.id,
+                amount=-pricing["wallet_credit"],
+                type="order_payment",
+                description=f"Payment for order {order_number}",
+                reference_id=order_id
+            )
+            await db.wallet_transactions.insert_one(transaction.model_dump(), session=session)
 
-    await db.orders.insert_one(order_doc)
+    async def write_order(session):
+        # The order takes over the user's holds on its products; other customers' holds are
+        # respected, so units held by someone else can't be sold
+        hold_token, held = await claim_holds(
+            {"user_id": current_user.id, "product_id": {"$in": list(ordered)}}, session=session
+        )
+        taken: Dict[str, int] = {}
+        try:
+            taken = await take_stock(ordered, held, now, session=session)
+            await pay_with_wallet(session)
+            await mark_holds_released(hold_token, session=session)
+            await db.orders.insert_one(order_doc, session=session)
+        except Exception:
+            if session is None:
+                # No transaction to abort: give back the stock and the claimed holds
+                await restore_stock(taken, ordered)
+                await unclaim_holds(hold_token)
+            raise
+
+    await run_in_transaction(write_order)
+    held_stock_cache.clear()
+    invalidate_product_caches(item['product_id'] for item in pricing["items"])
+    background_tasks.add_task(record_order_recommendations, [item['product_id'] for item in pricing["items"]])
     return order
 
 @api_router.get("/orders", response_model=List[Order])
@@ -1000,14 +2770,8 @@ async def get_orders(
         order.setdefault("tracking_number", None)
         order.setdefault("shipping_carrier", None)
         order.setdefault("notes", None)
-        order.setdefault("created_at", datetime.utcnow())
-        order.setdefault("updated_at", datetime.utcnow())
-
-        # Convert timestamps if they are strings
-        if isinstance(order.get("created_at"), str):
-            order["created_at"] = datetime.fromisoformat(order["created_at"])
-        if isinstance(order.get("updated_at"), str):
-            order["updated_at"] = datetime.fromisoformat(order["updated_at"])
+        order.setdefault("created_at", datetime.now(timezone.utc))
+        order.setdefault("updated_at", datetime.now(timezone.utc))
 
         result.append(Order(**order))
     
@@ -1031,11 +2795,6 @@ async def get_order(order_id: str, current_user: User = Depends(get_current_user
         else:
             item["image"] = None
 
-    if isinstance(order.get('created_at'), str):
-        order['created_at'] = datetime.fromisoformat(order['created_at'])
-    if isinstance(order.get('updated_at'), str):
-        order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-
     return Order(**order)
 
 @api_router.put("/orders/{order_id}/status")
@@ -1048,7 +2807,7 @@ async def update_order_status(
 ):
     update_data = {
         "status": status,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc)
     }
     
     if tracking_number:
@@ -1067,34 +2826,32 @@ async def update_order_status(
 @api_router.get("/pages", response_model=List[Page])
 async def get_pages(is_active: bool = True):
     pages = await db.pages.find({"is_active": is_active}, {"_id": 0}).to_list(100)
-    for page in pages:
-        if isinstance(page.get('created_at'), str):
-            page['created_at'] = datetime.fromisoformat(page['created_at'])
-        if isinstance(page.get('updated_at'), str):
-            page['updated_at'] = datetime.fromisoformat(page['updated_at'])
     return pages
 
 @api_router.get("/pages/{slug}", response_model=Page)
-async def get_page_by_slug(slug: str):
-    page = await db.pages.find_one({"slug": slug, "is_active": True}, {"_id": 0})
+async def get_page_by_slug(slug: str, request: Request, response: Response):
+    lookup = {"slug": slug, "is_active": True}
+    if request.headers.get("if-none-match"):
+        current = await db.pages.find_one(lookup, {"_id": 0, "id": 1, "updated_at": 1})
+        if current:
+            etag = make_etag(current["id"], current.get("updated_at"))
+            if etag_matches(request, etag):
+                return not_modified(etag, "page")
+
+    page = await db.pages.find_one(lookup, {"_id": 0})
     if not page:
         raise HTTPException(status_code=404, detail="Page not found")
     
-    if isinstance(page.get('created_at'), str):
-        page['created_at'] = datetime.fromisoformat(page['created_at'])
-    if isinstance(page.get('updated_at'), str):
-        page['updated_at'] = datetime.fromisoformat(page['updated_at'])
-    
+    set_validators(response, make_etag(page["id"], page.get("updated_at")), "page")
     return Page(**page)
 
 @api_router.post("/pages", response_model=Page)
 async def create_page(page_data: PageCreate, admin: User = Depends(get_admin_user)):
     page = Page(**page_data.model_dump())
     page_doc = page.model_dump()
-    page_doc['created_at'] = page_doc['created_at'].isoformat()
-    page_doc['updated_at'] = page_doc['updated_at'].isoformat()
     
-    await db.pages.insert_one(page_doc)
+    await insert_with_slug(db.pages, page_doc, page_data.slug or page_data.title)
+    page.slug = page_doc['slug']
     return page
 
 @api_router.put("/pages/{page_id}", response_model=Page)
@@ -1104,15 +2861,11 @@ async def update_page(page_id: str, page_data: PageCreate, admin: User = Depends
         raise HTTPException(status_code=404, detail="Page not found")
     
     update_data = page_data.model_dump()
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
-    await db.pages.update_one({"id": page_id}, {"$set": update_data})
+    await update_with_slug(db.pages, page_id, update_data, page_data.slug or page_data.title)
     
     updated_page = await db.pages.find_one({"id": page_id}, {"_id": 0})
-    if isinstance(updated_page.get('created_at'), str):
-        updated_page['created_at'] = datetime.fromisoformat(updated_page['created_at'])
-    if isinstance(updated_page.get('updated_at'), str):
-        updated_page['updated_at'] = datetime.fromisoformat(updated_page['updated_at'])
     
     return Page(**updated_page)
 
@@ -1126,22 +2879,21 @@ async def delete_page(page_id: str, admin: User = Depends(get_admin_user)):
 # ========== BLOG ROUTES ==========
 
 @api_router.get("/blog", response_model=List[BlogPost])
-async def get_blog_posts(category: Optional[str] = None, limit: int = Query(20, le=50), skip: int = 0):
+async def get_blog_posts(request: Request, category: Optional[str] = None, limit: int = Query(20, le=50), skip: int = 0):
     query = {"is_published": True}
     if category:
         query["category"] = category
     
-    posts = await db.blog_posts.find(query, {"_id": 0}).sort("published_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    for post in posts:
-        if isinstance(post.get('created_at'), str):
-            post['created_at'] = datetime.fromisoformat(post['created_at'])
-        if isinstance(post.get('updated_at'), str):
-            post['updated_at'] = datetime.fromisoformat(post['updated_at'])
-        if isinstance(post.get('published_at'), str):
-            post['published_at'] = datetime.fromisoformat(post['published_at'])
-    
-    return posts
+    etag = make_etag("blog", category, limit, skip, *await collection_version(db.blog_posts, query))
+    if etag_matches(request, etag):
+        return not_modified(etag, "blog")
+
+    async def load():
+        posts = await db.blog_posts.find(query, {"_id": 0}).sort("published_at", -1).skip(skip).limit(limit).to_list(limit)
+        # Validated once per cache fill instead of on every request
+        return [BlogPost(**post).model_dump() for post in posts]
+
+    return set_validators(await cached_json(request, "blog", load), etag, "blog")
 
 @api_router.post("/blog", response_model=BlogPost)
 async def create_blog_post(
@@ -1157,126 +2909,734 @@ async def create_blog_post(
         post.published_at = datetime.now(timezone.utc)
 
     post_doc = post.model_dump()
-    post_doc["created_at"] = post_doc["created_at"].isoformat()
-    post_doc["updated_at"] = post_doc["updated_at"].isoformat()
 
-    if post_doc.get("published_at"):
-        post_doc["published_at"] = post_doc["published_at"].isoformat()
-
-    await db.blog_posts.insert_one(post_doc)
+    await insert_with_slug(db.blog_posts, post_doc, post_data.slug or post_data.title)
+    post.slug = post_doc["slug"]
+    invalidate_cached_responses("blog")
     return post
 
 
 # ========== SETTINGS ROUTES ==========
 
+# Read on every checkout for the VAT rate; dropped when an admin saves the settings
+site_settings_cache: TTLCache = TTLCache(maxsize=1, ttl=300)
+
+async def get_site_settings() -> SiteSettings:
+    settings = site_settings_cache.get("settings")
+    if settings is None:
+        doc = await db.settings.find_one({}, {"_id": 0})
+        settings = SiteSettings(**doc) if doc else SiteSettings()
+        site_settings_cache["settings"] = settings
+    return settings
+
 @api_router.get("/settings", response_model=SiteSettings)
-async def get_settings():
+async def get_settings(request: Request, response: Response):
+    if request.headers.get("if-none-match"):
+        current = await db.settings.find_one({}, {"_id": 0, "updated_at": 1})
+        if current:
+            etag = make_etag("settings", current.get("updated_at"))
+            if etag_matches(request, etag):
+                return not_modified(etag, "settings")
+
     settings = await db.settings.find_one({}, {"_id": 0})
     if not settings:
         # Create default settings
         default_settings = SiteSettings()
         settings_doc = default_settings.model_dump()
-        settings_doc['updated_at'] = settings_doc['updated_at'].isoformat()
         await db.settings.insert_one(settings_doc)
+        set_validators(response, make_etag("settings", default_settings.updated_at), "settings")
         return default_settings
     
-    if isinstance(settings.get('updated_at'), str):
-        settings['updated_at'] = datetime.fromisoformat(settings['updated_at'])
-    
+    set_validators(response, make_etag("settings", settings.get("updated_at")), "settings")
     return SiteSettings(**settings)
 
 @api_router.put("/settings", response_model=SiteSettings)
 async def update_settings(settings_data: SiteSettingsUpdate, admin: User = Depends(get_admin_user)):
     update_data = {k: v for k, v in settings_data.model_dump().items() if v is not None}
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.settings.update_one({}, {"$set": update_data}, upsert=True)
+    site_settings_cache.clear()
+    shipping_rates.mark_changed()
     
     updated_settings = await db.settings.find_one({}, {"_id": 0})
-    if isinstance(updated_settings.get('updated_at'), str):
-        updated_settings['updated_at'] = datetime.fromisoformat(updated_settings['updated_at'])
     
     return SiteSettings(**updated_settings)
 
-# ========== AI ROUTES ==========
+# ========== RECOMMENDATION ENGINE ==========
+
+RECOMMENDATION_LIMIT = 12
+# Co-purchase counts kept per product; the rest only ever affect lists beyond RECOMMENDATION_LIMIT
+CO_PURCHASE_KEEP = 200
+# Tags on more products than this say little about similarity and would make the pair scan quadratic
+COMMON_TAG_LIMIT = 500
+# Blend for the "related" list; each signal is scaled to 0..1 per product before weighting
+RECOMMENDATION_WEIGHTS = {"co_purchase": 0.5, "content": 0.3, "wishlist": 0.2}
+
+def add_basket(counts: Dict[str, Counter], basket: Iterable[str]):
+    """Count every ordered pair of distinct products that appear together in one basket"""
+    items = set(basket)
+    for a in items:
+        for b in items:
+            if a != b:
+                counts[a][b] += 1
+
+def content_scores(products: List[Dict[str, Any]], popularity: Counter) -> Dict[str, Dict[str, float]]:
+    """Tag Jaccard (0.7) plus same category (0.3) for products sharing a tag or a category.
+
+    Category-only candidates are limited to the category's best sellers, so large
+    categories don't turn into an all-pairs scan.
+    """
+    tags = {p["id"]: set(p.get("tags") or []) for p in products}
+    category = {p["id"]: p.get("category") for p in products}
+    by_tag: Dict[str, List[str]] = defaultdict(list)
+    by_category: Dict[str, List[str]] = defaultdict(list)
+    for p in products:
+        for tag in tags[p["id"]]:
+            by_tag[tag].append(p["id"])
+        by_category[category[p["id"]]].append(p["id"])
+    for members in by_category.values():
+        members.sort(key=lambda pid: -popularity[pid])
+
+    scores: Dict[str, Dict[str, float]] = defaultdict(dict)
+    def score(a: str, b: str):
+        if a == b or b in scores[a]:
+            return
+        union = tags[a] | tags[b]
+        jaccard = len(tags[a] & tags[b]) / len(union) if union else 0.0
+        scores[a][b] = 0.7 * jaccard + (0.3 if category[a] == category[b] else 0.0)
+
+    for members in by_tag.values():
+        if len(members) <= COMMON_TAG_LIMIT:
+            for a in members:
+                for b in members:
+                    score(a, b)
+    for members in by_category.values():
+        top_sellers = members[:RECOMMENDATION_LIMIT * 2]
+        for a in members:
+            for b in top_sellers:
+                score(a, b)
+    return scores
+
+def top_ids(scores: Dict[str, float], limit: int = RECOMMENDATION_LIMIT) -> List[str]:
+    return [pid for pid, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]]
+
+def blend_scores(signals: Dict[str, Dict[str, float]], allowed: set) -> Dict[str, float]:
+    total: Dict[str, float] = defaultdict(float)
+    for name, scores in signals.items():
+        scores = {pid: value for pid, value in scores.items() if pid in allowed}
+        peak = max(scores.values(), default=0)
+        if peak:
+            for pid, value in scores.items():
+                total[pid] += RECOMMENDATION_WEIGHTS[name] * value / peak
+    return total
+
+async def build_recommendations(batch_size: int = 500) -> int:
+    """Batch job: recompute product_recommendations for every active product.
+
+    Mines co-purchases from orders.items and co-occurrence from wishlists, adds tag/category
+    similarity, and writes one document per product. Documents of products that are no longer
+    active are removed. Returns the number of products written.
+    """
+    started = datetime.now(timezone.utc)
+    products = await db.products.find(
+        {"is_active": True}, {"_id": 0, "id": 1, "category": 1, "tags": 1}
+    ).to_list(None)
+    active = {p["id"] for p in products}
 
-@api_router.post("/ai/recommendations")
-async def get_ai_recommendations(product_id: Optional[str] = None, category: Optional[str] = None):
-    try:
-        # Get product context
-        context = ""
-        if product_id:
-            product = await db.products.find_one({"id": product_id}, {"_id": 0})
-            if product:
-                context = f"Current product: {product['name']} - {product['description']}"
-        
-        # Get available products
-        query = {"is_active": True}
+    co_purchases: Dict[str, Counter] = defaultdict(Counter)
+    purchases: Counter = Counter()
+    async for order in db.orders.find({}, {"_id": 0, "items.product_id": 1}):
+        basket = {item.get("product_id") for item in order.get("items", []) if item.get("product_id")}
+        purchases.update(basket)
+        add_basket(co_purchases, basket)
+
+    wishlisted: Dict[str, Counter] = defaultdict(Counter)
+    async for group in db.wishlist.aggregate([{"$group": {"_id": "$user_id", "products": {"$addToSet": "$product_id"}}}]):
+        add_basket(wishlisted, group["products"])
+
+    similar = content_scores(products, purchases)
+
+    written = 0
+    operations = []
+    for product in products:
+        pid = product["id"]
+        kept = dict(co_purchases[pid].most_common(CO_PURCHASE_KEEP))
+        related = blend_scores(
+            {"co_purchase": kept, "content": similar.get(pid, {}), "wishlist": wishlisted[pid]},
+            active
+        )
+        operations.append(UpdateOne({"product_id": pid}, {"$set": {
+            "category": product.get("category"),
+            "purchases": purchases[pid],
+            "co_purchases": kept,
+            "also_bought": top_ids({k: v for k, v in kept.items() if k in active}),
+            "related": top_ids(related),
+            "updated_at": started
+        }}, upsert=True))
+        if len(operations) >= batch_size:
+            await db.product_recommendations.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+    if operations:
+        await db.product_recommendations.bulk_write(operations, ordered=False)
+        written += len(operations)
+
+    await db.product_recommendations.delete_many({"updated_at": {"$lt": started}})
+    return written
+
+async def record_order_recommendations(product_ids: Iterable[str]):
+    """Incremental update after an order: bump purchase and co-purchase counts, refresh also_bought.
+
+    Only also_bought moves between batch runs; the blended related list waits for the next
+    build_recommendations. co_purchases is trimmed to CO_PURCHASE_KEEP here as in the batch job.
+    """
+    # Ids come from the client's order and become field names, so only accept real product ids
+    basket = {pid for pid in product_ids if isinstance(pid, str) and UUID_PATTERN.match(pid)}
+    categories = {
+        doc["id"]: doc.get("category")
+        async for doc in db.products.find({"id": {"$in": list(basket)}}, {"_id": 0, "id": 1, "category": 1})
+    }
+    basket &= categories.keys()
+    now = datetime.now(timezone.utc)
+    for pid in basket:
+        others = basket - {pid}
+        doc = await db.product_recommendations.find_one_and_update(
+            {"product_id": pid},
+            {
+                "$inc": {"purchases": 1, **{f"co_purchases.{other}": 1 for other in others}},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"category": categories[pid]}
+            },
+            projection={"_id": 0, "co_purchases": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if others:
+            counts = Counter(doc.get("co_purchases", {}))
+            update: Dict[str, Any] = {"$set": {"also_bought": top_ids(dict(counts.most_common(RECOMMENDATION_LIMIT)))}}
+            if len(counts) > CO_PURCHASE_KEEP:
+                # $unset only the dropped keys, so counts bumped meanwhile by another order are kept
+                kept = dict(counts.most_common(CO_PURCHASE_KEEP))
+                update["$unset"] = {f"co_purchases.{other}": "" for other in counts if other not in kept}
+            await db.product_recommendations.update_one({"product_id": pid}, update)
+
+async def active_cards(product_ids: List[str], category: Optional[str] = None) -> List[Dict[str, Any]]:
+    """ProductCards for the ids that are still active, in the given order"""
+    if not product_ids:
+        return []
+    query: Dict[str, Any] = {"id": {"$in": product_ids}, "is_active": True}
+    if category:
+        query["category"] = category
+    cards = await db.products.find(query, PRODUCT_CARD_PROJECTION).to_list(len(product_ids))
+    by_id = {card["id"]: card for card in cards}
+    return [by_id[pid] for pid in product_ids if pid in by_id]
+
+async def best_seller_ids(category: Optional[str], exclude: Optional[str], limit: int) -> List[str]:
+    query = {"category": category} if category else {}
+    docs = await db.product_recommendations.find(query, {"_id": 0, "product_id": 1}) \
+        .sort("purchases", -1).limit(limit + 1).to_list(limit + 1)
+    return [doc["product_id"] for doc in docs if doc["product_id"] != exclude][:limit]
+
+# ========== PRODUCT SEARCH INDEX ==========
+
+def search_terms(text: str) -> List[str]:
+    """Lowercase, accent-folded alphanumeric tokens ("Capa Proteção USB-C" -> capa, protecao, usb, c)"""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    return re.findall(r"[a-z0-9]+", "".join(ch for ch in folded if not unicodedata.combining(ch)))
+
+class ProductSearchIndex:
+    """TF-IDF vectors of the active catalog, scored by vectorized cosine similarity.
+
+    Each product keeps its own term weights; the sparse matrix (row ids, term ids, weights)
+    and the filter columns are assembled with NumPy. Product writes only mark ids dirty, and
+    just those products are re-read and re-tokenized.
+
+    Tokenizing and assembling run in a worker thread and the finished matrix (with its own
+    vocabulary snapshot) is swapped in, so only the very first query waits for a build; later
+    refreshes run in the background while queries keep using the previous matrix.
+    """
+
+    FIELD_WEIGHTS = {"name": 3.0, "tags": 2.0, "category": 2.0, "description": 1.0}
+    PROJECTION = {"_id": 0, "id": 1, "name": 1, "description": 1, "tags": 1, "category": 1, "price": 1, "is_active": 1}
+
+    def __init__(self, max_age: int = 600):
+        # Full reload interval, so writes made by other processes show up eventually
+        self.max_age = max_age
+        self.rows: Dict[str, Dict[str, Any]] = {}
+        self.vocabulary: Dict[str, int] = {}
+        self.document_frequency: Counter = Counter()
+        self.dirty: set = set()
+        self.loaded_at: Optional[float] = None
+        # Bumped by full-reload requests; a reload that overlapped one doesn't count as current
+        self.generation = 0
+        self.matrix: Optional[Dict[str, Any]] = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def mark_changed(self, product_ids: Optional[Iterable[str]] = None):
+        """Called after product writes; None means reload everything"""
+        if product_ids is None:
+            self.generation += 1
+            self.loaded_at = None
+        else:
+            self.dirty.update(product_ids)
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def _add(self, doc: Dict[str, Any]):
+        counts: Counter = Counter()
+        fields = {
+            "name": doc.get("name") or "",
+            "tags": " ".join(doc.get("tags") or []),
+            "category": doc.get("category") or "",
+            "description": doc.get("description") or "",
+        }
+        for field, text in fields.items():
+            for term in search_terms(text):
+                counts[self.vocabulary.setdefault(term, len(self.vocabulary))] += self.FIELD_WEIGHTS[field]
+        terms = {term_id: 1.0 + math.log(count) for term_id, count in counts.items()}
+        self.document_frequency.update(terms.keys())
+        self.rows[doc["id"]] = {
+            "terms": terms,
+            "category": doc.get("category"),
+            "price": doc.get("price") or 0.0,
+            "tags": doc.get("tags") or [],
+        }
+
+    def _remove(self, product_id: str):
+        row = self.rows.pop(product_id, None)
+        if row:
+            self.document_frequency.subtract(row["terms"].keys())
+
+    def _load_all(self, docs: List[Dict[str, Any]]):
+        self.rows, self.vocabulary, self.document_frequency = {}, {}, Counter()
+        for doc in docs:
+            self._add(doc)
+
+    def _reload(self, product_ids: set, docs: List[Dict[str, Any]]):
+        found = {doc["id"]: doc for doc in docs}
+        for product_id in product_ids:
+            self._remove(product_id)
+            doc = found.get(product_id)
+            if doc and doc.get("is_active", True):
+                self._add(doc)
+
+    def _assemble(self) -> Dict[str, Any]:
+        ids = list(self.rows)
+        rows = [self.rows[product_id] for product_id in ids]
+        nnz = sum(len(row["terms"]) for row in rows)
+        row_index = np.repeat(np.arange(len(rows)), [len(row["terms"]) for row in rows])
+        term_index = np.fromiter((t for row in rows for t in row["terms"]), dtype=np.int64, count=nnz)
+        tf = np.fromiter((w for row in rows for w in row["terms"].values()), dtype=np.float64, count=nnz)
+
+        df = np.zeros(len(self.vocabulary))
+        for term_id, count in self.document_frequency.items():
+            df[term_id] = count
+        idf = np.log((1 + len(rows)) / (1 + df)) + 1.0
+
+        weights = tf * idf[term_index]
+        norms = np.sqrt(np.bincount(row_index, weights=weights ** 2, minlength=len(rows)))
+        weights /= np.maximum(norms, 1e-12)[row_index]
+
+        tag_rows: Dict[str, List[int]] = defaultdict(list)
+        for i, row in enumerate(rows):
+            for tag in row["tags"]:
+                tag_rows[tag].append(i)
+
+        return {
+            "ids": ids,
+            "vocabulary": dict(self.vocabulary),
+            "row_index": row_index,
+            "term_index": term_index,
+            "weights": weights,
+            "idf": idf,
+            "categories": np.array([row["category"] for row in rows], dtype=object),
+            "prices": np.array([row["price"] for row in rows], dtype=np.float64),
+            "tag_rows": tag_rows,
+        }
+
+    async def refresh(self):
+        """Re-read what changed, rebuild the matrix in a worker thread and swap it in"""
+        async with self._lock:
+            if self.is_stale():
+                generation, loaded_at = self.generation, time.monotonic()
+                # Ids marked during the read stay dirty and are re-read on the next refresh
+                self.dirty = set()
+                docs = await db.products.find({"is_active": True}, self.PROJECTION).to_list(None)
+                update = lambda: self._load_all(docs)
+            elif self.dirty:
+                generation, loaded_at = None, None
+                changed, self.dirty = self.dirty, set()
+                docs = await db.products.find({"id": {"$in": list(changed)}}, self.PROJECTION).to_list(None)
+                update = lambda: self._reload(changed, docs)
+            elif self.matrix is not None:
+                return
+            else:
+                generation, loaded_at, update = None, None, lambda: None
+
+            def rebuild() -> Dict[str, Any]:
+                update()
+                return self._assemble()
+
+            self.matrix = await asyncio.to_thread(rebuild)
+            if loaded_at is not None and self.generation == generation:
+                self.loaded_at = loaded_at
+
+    async def _refresh_in_background(self):
+        try:
+            await self.refresh()
+        except Exception:
+            logger.exception("Product search index refresh failed")
+
+    async def ensure_current(self):
+        """Build the matrix on first use; afterwards refresh it in the background when stale or dirty"""
+        if self.matrix is None:
+            await self.refresh()
+        elif (self.is_stale() or self.dirty) and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+
+    def search(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        tags: Optional[List[str]] = None,
+        limit: int = 20
+    ) -> tuple:
+        """Top (product_id, score) pairs plus the number of matches, after the listing filters"""
+        m = self.matrix
+        vocabulary = m["vocabulary"]
+        query_counts = Counter(vocabulary[t] for t in search_terms(query) if t in vocabulary)
+        if not m["ids"] or not query_counts:
+            return [], 0
+
+        q = np.zeros(len(m["idf"]))
+        for term_id, count in query_counts.items():
+            q[term_id] = (1.0 + math.log(count)) * m["idf"][term_id]
+        q /= np.linalg.norm(q)
+
+        # One pass over every stored weight: the cosine of the query with each product
+        scores = np.bincount(m["row_index"], weights=m["weights"] * q[m["term_index"]], minlength=len(m["ids"]))
+
+        mask = scores > 0
         if category:
-            query["category"] = category
-        
-        products = await db.products.find(query, {"_id": 0}).limit(20).to_list(20)
-        
-        products_info = "\n".join([
-            f"- {p['name']} (€{p['price']}): {p['description'][:100]}"
-            for p in products
-        ])
-        
+            mask &= m["categories"] == category
+        if min_price is not None:
+            mask &= m["prices"] >= min_price
+        if max_price is not None:
+            mask &= m["prices"] <= max_price
+        if tags:
+            tagged = np.zeros(len(m["ids"]), dtype=bool)
+            for tag in tags:
+                tagged[m["tag_rows"].get(tag, [])] = True
+            mask &= tagged
+
+        candidates = np.flatnonzero(mask)
+        top = candidates[np.argsort(-scores[candidates], kind="stable")[:limit]]
+        return [(m["ids"][i], float(scores[i])) for i in top], len(candidates)
+
+product_search = ProductSearchIndex()
+
+# ========== LLM GATEWAY ==========
+
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 8))
+# Longest a request waits on an uncached completion; the call itself keeps running up to
+# LLM_TIMEOUT and fills the cache for the next request
+LLM_INLINE_TIMEOUT = float(os.environ.get('LLM_INLINE_TIMEOUT', 0.8))
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 3600))
+
+class EmergentLlm:
+    """gpt-4o-mini through emergentintegrations; one fresh chat session per completion"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def complete(self, system_message: str, text: str) -> str:
         chat = LlmChat(
-            api_key=os.environ['EMERGENT_LLM_KEY'],
-            session_id="recommendations",
-            system_message="You are a helpful e-commerce assistant. Recommend 3-5 relevant products based on the context."
+            api_key=self.api_key,
+            session_id=str(uuid.uuid4()),
+            system_message=system_message
         ).with_model("openai", "gpt-4o-mini")
-        
-        message = UserMessage(
-            text=f"{context}\n\nAvailable products:\n{products_info}\n\nRecommend the best 3-5 products and explain why."
+        return await chat.send_message(UserMessage(text=text))
+
+class FakeLlm:
+    """Local stand-in for development and tests (LLM_PROVIDER=fake).
+
+    Answers with the product ids found in the prompt, in order, as a JSON array. delay and
+    fail make it possible to exercise the timeout and circuit breaker paths.
+    """
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def complete(self, system_message: str, text: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("Fake LLM failure")
+        return json.dumps(list(dict.fromkeys(UUID_SEARCH.findall(text))))
+
+class CircuitBreaker:
+    """Stop calling a failing dependency for reset_timeout seconds after failure_threshold
+    consecutive failures; then let a single trial call through (half-open)."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_running = False
+
+class LlmGateway:
+    """Cached, deduplicated, time-boxed LLM completions.
+
+    Completions are cached per normalized key (callers include the catalog version), concurrent
+    identical requests share one in-flight call, and every call is bounded by timeout and the
+    circuit breaker. complete() returns None whenever no answer is available, and callers then
+    serve their local result. cached() and prefetch() let a caller answer from the cache only
+    and warm it in the background instead of waiting.
+    """
+
+    def __init__(self, llm, timeout: float = LLM_TIMEOUT, cache_ttl: int = LLM_CACHE_TTL,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.llm = llm
+        self.timeout = timeout
+        self.cache: TTLCache = TTLCache(maxsize=5000, ttl=cache_ttl)
+        self.breaker = breaker or CircuitBreaker()
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+        self.stats: Counter = Counter()
+
+    async def complete(self, key: tuple, system_message: str, text: str,
+                       wait: Optional[float] = None) -> Optional[str]:
+        """The completion for key; with wait, give up after that many seconds while the call
+        carries on and caches its answer"""
+        if self.llm is None:
+            return None
+        if key in self.cache:
+            self.stats["hits"] += 1
+            return self.cache[key]
+        if key in self.inflight:
+            self.stats["coalesced"] += 1
+            call = self.inflight[key]
+        elif not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            return None
+        else:
+            self.stats["misses"] += 1
+            call = self._start(key, system_message, text)
+        try:
+            # Shielded: a client disconnecting must not cancel the call other requests are waiting on
+            return await asyncio.wait_for(asyncio.shield(call), wait)
+        except asyncio.TimeoutError:
+            self.stats["not_waited"] += 1
+            return None
+
+    def cached(self, key: tuple) -> Optional[str]:
+        if key in self.cache:
+            self.stats["hits"] += 1
+            return self.cache[key]
+        return None
+
+    def prefetch(self, key: tuple, system_message: str, text: str):
+        """Start the completion in the background unless it is cached, in flight or short-circuited"""
+        if self.llm is None or key in self.cache or key in self.inflight:
+            return
+        if not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            return
+        self.stats["prefetched"] += 1
+        self._start(key, system_message, text)
+
+    def _start(self, key: tuple, system_message: str, text: str) -> asyncio.Future:
+        # inflight keeps a reference until the call is done, so a prefetch is never collected early
+        call = asyncio.ensure_future(self._call(key, system_message, text))
+        self.inflight[key] = call
+        call.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return call
+
+    async def _call(self, key: tuple, system_message: str, text: str) -> Optional[str]:
+        try:
+            answer = await asyncio.wait_for(self.llm.complete(system_message, text), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self.breaker.record_failure()
+            return None
+        except Exception as e:
+            self.stats["failures"] += 1
+            self.breaker.record_failure()
+            logger.warning(f"LLM call failed: {e}")
+            return None
+        self.breaker.record_success()
+        self.cache[key] = answer
+        return answer
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "provider": type(self.llm).__name__ if self.llm else None,
+            "breaker": self.breaker.state,
+            "cached": len(self.cache),
+            "inflight": len(self.inflight),
+            **self.stats
+        }
+
+def configured_llm():
+    """LLM_PROVIDER=fake for the local stub, =none to disable; otherwise the Emergent LLM when
+    the library and EMERGENT_LLM_KEY are both available"""
+    provider = os.environ.get('LLM_PROVIDER', 'emergent').lower()
+    if provider == "fake":
+        return FakeLlm(delay=float(os.environ.get('FAKE_LLM_DELAY', 0)))
+    if provider == "emergent" and LlmChat is not None and os.environ.get('EMERGENT_LLM_KEY'):
+        return EmergentLlm(os.environ['EMERGENT_LLM_KEY'])
+    return None
+
+llm_gateway = LlmGateway(configured_llm())
+
+# ========== AI ROUTES ==========
+
+@api_router.post("/ai/recommendations")
+async def get_ai_recommendations(
+    product_id: Optional[str] = None,
+    category: Optional[str] = None,
+    limit: int = Query(6, ge=1, le=RECOMMENDATION_LIMIT)
+):
+    """Recommendations served from product_recommendations (see build_recommendations).
+
+    With product_id: its blended "related" list and its "also bought" list; products without
+    a precomputed entry yet fall back to best sellers of their category. Without it: best sellers.
+    """
+    rec = None
+    if product_id:
+        rec = await db.product_recommendations.find_one(
+            {"product_id": product_id}, {"_id": 0, "related": 1, "also_bought": 1, "category": 1}
         )
-        
-        response = await chat.send_message(message)
-        
-        return {"recommendations": response}
-    except Exception as e:
-        return {"recommendations": "Unable to generate recommendations at this time."}
+
+    if rec and rec.get("related"):
+        related_ids = rec["related"]
+    else:
+        if product_id and not category:
+            product = await db.products.find_one({"id": product_id}, {"_id": 0, "category": 1})
+            category = product.get("category") if product else None
+        related_ids = await best_seller_ids(category, product_id, RECOMMENDATION_LIMIT)
+
+    recommendations, also_bought = await asyncio.gather(
+        active_cards(related_ids, category),
+        active_cards(rec.get("also_bought", []) if rec else [])
+    )
+    recommendations, also_bought = recommendations[:limit], also_bought[:limit]
+
+    explanation = None
+    if recommendations:
+        products_info = "\n".join(f"- {p['name']} (€{p['price']})" for p in recommendations)
+        explanation = await llm_gateway.complete(
+            ("recommendations", product_id, category, limit, catalog_version),
+            "You are a helpful e-commerce assistant. Explain briefly why these products are recommended.",
+            f"Recommended products:\n{products_info}",
+            wait=LLM_INLINE_TIMEOUT
+        )
+
+    return fast_json({
+        "recommendations": recommendations,
+        "also_bought": also_bought,
+        "explanation": explanation
+    })
+
+@api_router.post("/ai/recommendations/rebuild")
+async def rebuild_recommendations(admin: User = Depends(get_admin_user)):
+    """Admin: Run the recommendation batch job now"""
+    return {"products": await build_recommendations()}
 
 @api_router.post("/ai/search")
-async def ai_search(query: str):
-    try:
-        # Get all products
-        products = await db.products.find({"is_active": True}, {"_id": 0}).limit(50).to_list(50)
-        
-        products_info = "\n".join([
-            f"ID: {p['id']} | {p['name']} (€{p['price']}): {p['description'][:100]}"
-            for p in products
-        ])
-        
-        chat = LlmChat(
-            api_key=os.environ['EMERGENT_LLM_KEY'],
-            session_id="search",
-            system_message="You are a helpful search assistant. Find the most relevant products and return ONLY their IDs as a JSON array."
-        ).with_model("openai", "gpt-4o-mini")
-        
-        message = UserMessage(
-            text=f"User query: {query}\n\nProducts:\n{products_info}\n\nReturn only a JSON array of product IDs, like: [\"id1\", \"id2\"]"
+async def ai_search(
+    query: str,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    tags: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    rerank: bool = False
+):
+    """Rank the whole active catalog against the query with the local TF-IDF index.
+
+    When an LLM is configured it re-ranks the local candidates. By default the local ranking
+    is returned at once (source="local") and the re-rank runs in the background, so repeating
+    the query serves it (source="llm"). rerank=true waits for the LLM, up to LLM_TIMEOUT; if it
+    is slow, failing or returns nothing usable, the local ranking is served as-is.
+    """
+    await product_search.ensure_current()
+    tag_list = tags.split(",") if tags else None
+    matches, total = product_search.search(query, category, min_price, max_price, tag_list, limit)
+
+    scores = dict(matches)
+    results = await active_cards(list(scores))
+    for card in results:
+        card["score"] = round(scores[card["id"]], 4)
+
+    source = "local"
+    if results:
+        products_info = "\n".join(f"ID: {p['id']} | {p['name']} (€{p['price']})" for p in results)
+        key = ("search", " ".join(search_terms(query)), category, min_price, max_price,
+               tuple(sorted(tag_list or [])), limit, catalog_version)
+        prompt = (
+            "You are a helpful search assistant. Order the products by relevance and return ONLY their IDs as a JSON array.",
+            f"User query: {query}\n\nProducts:\n{products_info}\n\nReturn only a JSON array of product IDs, like: [\"id1\", \"id2\"]"
         )
-        
-        response = await chat.send_message(message)
-        
-        # Try to parse IDs from response
-        import re
-        ids = re.findall(r'[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}', response)
-        
-        # Get matching products
-        matching_products = [p for p in products if p['id'] in ids]
-        
-        return {"results": matching_products, "explanation": response}
-    except Exception as e:
-        return {"results": [], "explanation": "Search unavailable"}
+        if rerank:
+            answer = await llm_gateway.complete(key, *prompt)
+        else:
+            answer = llm_gateway.cached(key)
+            if answer is None:
+                llm_gateway.prefetch(key, *prompt)
+        by_id = {card["id"]: card for card in results}
+        ranked = [by_id[pid] for pid in dict.fromkeys(UUID_SEARCH.findall(answer or "")) if pid in by_id]
+        if ranked:
+            results, source = ranked, "llm"
+
+    return fast_json({"results": results, "total": total, "source": source})
+
+@api_router.get("/ai/status")
+async def ai_status(admin: User = Depends(get_admin_user)):
+    """Admin: LLM gateway provider, circuit breaker state and cache/coalescing counters"""
+    return llm_gateway.status()
 
 # ========== HOMEPAGE SECTIONS ROUTES ==========
 
 @api_router.get("/homepage-sections")
-async def get_homepage_sections(active_only: bool = True):
+async def get_homepage_sections(request: Request, active_only: bool = True):
     """Get all homepage sections"""
+    return await cached_json(request, "homepage", lambda: load_homepage_sections(active_only))
+
+async def load_homepage_sections(active_only: bool) -> List[Dict[str, Any]]:
     query = {"is_active": True} if active_only else {}
     sections = await db.homepage_sections.find(query, {"_id": 0}).sort("order", 1).to_list(100)
     
@@ -1296,8 +3656,8 @@ async def get_homepage_sections(active_only: bool = True):
                 "is_active": True,
                 "order": 1,
                 "config": {"limit": 4, "sort_by": "created_at", "sort_order": "desc"},
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -1307,8 +3667,8 @@ async def get_homepage_sections(active_only: bool = True):
                 "is_active": True,
                 "order": 2,
                 "config": {"limit": 8, "featured": True},
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -1318,12 +3678,12 @@ async def get_homepage_sections(active_only: bool = True):
                 "is_active": True,
                 "order": 3,
                 "config": {},
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
             }
         ]
-        for section in default_sections:
-            await db.homepage_sections.insert_one(section)
+        # Insert copies: insert_many adds an ObjectId _id to the dicts it is given
+        await db.homepage_sections.insert_many([dict(section) for section in default_sections])
         sections = default_sections
     
     return sections
@@ -1341,10 +3701,9 @@ async def create_homepage_section(section_data: HomepageSectionCreate, admin: Us
     """Create a new homepage section"""
     section = HomepageSection(**section_data.model_dump())
     section_doc = section.model_dump()
-    section_doc['created_at'] = section_doc['created_at'].isoformat()
-    section_doc['updated_at'] = section_doc['updated_at'].isoformat()
     
     await db.homepage_sections.insert_one(section_doc)
+    invalidate_cached_responses("homepage")
     return section
 
 @api_router.put("/homepage-sections/{section_id}")
@@ -1355,9 +3714,10 @@ async def update_homepage_section(section_id: str, section_data: HomepageSection
         raise HTTPException(status_code=404, detail="Section not found")
     
     update_data = {k: v for k, v in section_data.model_dump().items() if v is not None}
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.homepage_sections.update_one({"id": section_id}, {"$set": update_data})
+    invalidate_cached_responses("homepage")
     
     updated = await db.homepage_sections.find_one({"id": section_id}, {"_id": 0})
     return updated
@@ -1368,11 +3728,20 @@ async def delete_homepage_section(section_id: str, admin: User = Depends(get_adm
     result = await db.homepage_sections.delete_one({"id": section_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Section not found")
+    invalidate_cached_responses("homepage")
     return {"message": "Section deleted successfully"}
 
 @api_router.get("/homepage-sections/{section_id}/products")
-async def get_section_products(section_id: str, limit: int = Query(8, le=20)):
+async def get_section_products(
+    request: Request,
+    section_id: str,
+    limit: int = Query(8, le=20),
+    projection: Dict[str, Any] = Depends(product_list_projection)
+):
     """Get products for a specific homepage section"""
+    return await cached_json(request, "homepage", lambda: load_section_products(section_id, limit, projection))
+
+async def load_section_products(section_id: str, limit: int, projection: Dict[str, Any]) -> List[Dict[str, Any]]:
     section = await db.homepage_sections.find_one({"id": section_id}, {"_id": 0})
     if not section:
         raise HTTPException(status_code=404, detail="Section not found")
@@ -1386,9 +3755,7 @@ async def get_section_products(section_id: str, limit: int = Query(8, le=20)):
     if 'product_ids' in config and config['product_ids']:
         query['id'] = {'$in': config['product_ids']}
     
-    products = await db.products.find(query, {"_id": 0}).sort(sort_field, sort_order).limit(config.get('limit', limit)).to_list(limit)
-    
-    return products
+    return await db.products.find(query, projection).sort(sort_field, sort_order).limit(config.get('limit', limit)).to_list(limit)
 
 # ========== IMAGE UPLOAD ROUTES (DATABASE STORAGE) ==========
 
@@ -1465,21 +3832,20 @@ async def delete_image(image_id: str, admin: User = Depends(get_admin_user)):
 # ========== HERO SLIDER ROUTES ==========
 
 @api_router.get("/hero-slides", response_model=List[HeroSlide])
-async def get_hero_slides():
-    slides = await db.hero_slides.find({"is_active": True}, {"_id": 0}).sort("order", 1).to_list(100)
-    for slide in slides:
-        if isinstance(slide.get('created_at'), str):
-            slide['created_at'] = datetime.fromisoformat(slide['created_at'])
-        if isinstance(slide.get('updated_at'), str):
-            slide['updated_at'] = datetime.fromisoformat(slide['updated_at'])
+async def get_hero_slides(request: Request, response: Response):
+    query = {"is_active": True}
+    etag = make_etag("hero_slides", *await collection_version(db.hero_slides, query))
+    if etag_matches(request, etag):
+        return not_modified(etag, "hero_slides")
+
+    slides = await db.hero_slides.find(query, {"_id": 0}).sort("order", 1).to_list(100)
+    set_validators(response, etag, "hero_slides")
     return slides
 
 @api_router.post("/hero-slides", response_model=HeroSlide)
 async def create_hero_slide(slide_data: HeroSlideCreate, admin: User = Depends(get_admin_user)):
     slide = HeroSlide(**slide_data.model_dump())
     slide_doc = slide.model_dump()
-    slide_doc['created_at'] = slide_doc['created_at'].isoformat()
-    slide_doc['updated_at'] = slide_doc['updated_at'].isoformat()
     
     await db.hero_slides.insert_one(slide_doc)
     return slide
@@ -1491,15 +3857,11 @@ async def update_hero_slide(slide_id: str, slide_data: HeroSlideCreate, admin: U
         raise HTTPException(status_code=404, detail="Slide not found")
     
     update_data = slide_data.model_dump()
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.hero_slides.update_one({"id": slide_id}, {"$set": update_data})
     
     updated_slide = await db.hero_slides.find_one({"id": slide_id}, {"_id": 0})
-    if isinstance(updated_slide.get('created_at'), str):
-        updated_slide['created_at'] = datetime.fromisoformat(updated_slide['created_at'])
-    if isinstance(updated_slide.get('updated_at'), str):
-        updated_slide['updated_at'] = datetime.fromisoformat(updated_slide['updated_at'])
     
     return HeroSlide(**updated_slide)
 
@@ -1519,7 +3881,7 @@ async def toggle_hero_slide(slide_id: str, admin: User = Depends(get_admin_user)
     new_status = not slide.get('is_active', True)
     await db.hero_slides.update_one(
         {"id": slide_id},
-        {"$set": {"is_active": new_status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"is_active": new_status, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Slide status updated", "is_active": new_status}
@@ -1529,19 +3891,12 @@ async def toggle_hero_slide(slide_id: str, admin: User = Depends(get_admin_user)
 @api_router.get("/payment-gateways", response_model=List[PaymentGateway])
 async def get_payment_gateways(admin: User = Depends(get_admin_user)):
     gateways = await db.payment_gateways.find({}, {"_id": 0}).to_list(100)
-    for gateway in gateways:
-        if isinstance(gateway.get('created_at'), str):
-            gateway['created_at'] = datetime.fromisoformat(gateway['created_at'])
-        if isinstance(gateway.get('updated_at'), str):
-            gateway['updated_at'] = datetime.fromisoformat(gateway['updated_at'])
     return gateways
 
 @api_router.post("/payment-gateways", response_model=PaymentGateway)
 async def create_payment_gateway(gateway_data: PaymentGatewayCreate, admin: User = Depends(get_admin_user)):
     gateway = PaymentGateway(**gateway_data.model_dump())
     gateway_doc = gateway.model_dump()
-    gateway_doc['created_at'] = gateway_doc['created_at'].isoformat()
-    gateway_doc['updated_at'] = gateway_doc['updated_at'].isoformat()
     
     await db.payment_gateways.insert_one(gateway_doc)
     return gateway
@@ -1553,15 +3908,11 @@ async def update_payment_gateway(gateway_id: str, gateway_data: PaymentGatewayCr
         raise HTTPException(status_code=404, detail="Payment gateway not found")
     
     update_data = gateway_data.model_dump()
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.payment_gateways.update_one({"id": gateway_id}, {"$set": update_data})
     
     updated_gateway = await db.payment_gateways.find_one({"id": gateway_id}, {"_id": 0})
-    if isinstance(updated_gateway.get('created_at'), str):
-        updated_gateway['created_at'] = datetime.fromisoformat(updated_gateway['created_at'])
-    if isinstance(updated_gateway.get('updated_at'), str):
-        updated_gateway['updated_at'] = datetime.fromisoformat(updated_gateway['updated_at'])
     
     return PaymentGateway(**updated_gateway)
 
@@ -1581,31 +3932,155 @@ async def toggle_payment_gateway(gateway_id: str, admin: User = Depends(get_admi
     new_status = not gateway.get('is_active', True)
     await db.payment_gateways.update_one(
         {"id": gateway_id},
-        {"$set": {"is_active": new_status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"is_active": new_status, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Payment gateway status updated", "is_active": new_status}
 
+# ========== SHIPPING QUOTES ==========
+
+# Countries per ShippingMethod zone, by name and ISO 3166 alpha-2 code; anything else is International.
+# SiteSettings.shipping_zones entries ({"name": "Europe", "countries": [...]}) extend these.
+DEFAULT_SHIPPING_ZONES = {
+    "Portugal": ["Portugal", "PT"],
+    "Europe": [
+        "Austria", "AT", "Belgium", "BE", "Bulgaria", "BG", "Croatia", "HR", "Cyprus", "CY",
+        "Czechia", "Czech Republic", "CZ", "Denmark", "DK", "Estonia", "EE", "Finland", "FI",
+        "France", "FR", "Germany", "DE", "Greece", "GR", "Hungary", "HU", "Ireland", "IE",
+        "Italy", "IT", "Latvia", "LV", "Lithuania", "LT", "Luxembourg", "LU", "Malta", "MT",
+        "Netherlands", "NL", "Poland", "PL", "Romania", "RO", "Slovakia", "SK", "Slovenia", "SI",
+        "Spain", "ES", "Sweden", "SE", "Iceland", "IS", "Liechtenstein", "LI", "Norway", "NO",
+        "Switzerland", "CH", "United Kingdom", "UK", "GB",
+    ],
+}
+INTERNATIONAL_ZONE = "International"
+
+class ShippingRateTable:
+    """Active shipping methods as parallel numpy arrays plus a zone -> applicable-methods mask.
+
+    A quote prices every method for the cart in one vectorized pass and then picks each
+    destination's methods by mask. Rebuilt after shipping method or settings writes and at
+    least every max_age seconds.
+    """
+
+    def __init__(self, max_age: int = 300):
+        self.max_age = max_age
+        self.methods: List[Dict[str, Any]] = []
+        self.base_rate = np.zeros(0)
+        self.per_kg_rate = np.zeros(0)
+        self.free_threshold = np.zeros(0)
+        self.zone_masks: Dict[str, np.ndarray] = {}
+        self.everywhere = np.zeros(0, dtype=bool)
+        self.country_zones: Dict[str, str] = {}
+        self.loaded_at: Optional[float] = None
+        # Bumped by mark_changed; a rebuild that overlapped a change doesn't count as current
+        self.generation = 0
+        self._lock = asyncio.Lock()
+
+    def mark_changed(self):
+        self.generation += 1
+        self.loaded_at = None
+
+    def is_current(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age
+
+    async def ensure_current(self):
+        if self.is_current():
+            return
+        async with self._lock:
+            if self.is_current():
+                return
+            loaded_at, generation = time.monotonic(), self.generation
+            methods = await db.shipping_methods.find({"is_active": True}, {"_id": 0, "config": 0}).to_list(None)
+            settings = await db.settings.find_one({}, {"_id": 0, "shipping_zones": 1}) or {}
+            self.load(methods, settings.get("shipping_zones") or [])
+            if self.generation == generation:
+                self.loaded_at = loaded_at
+
+    def load(self, methods: List[Dict[str, Any]], shipping_zones: List[Dict[str, Any]]):
+        zones = {name: list(countries) for name, countries in DEFAULT_SHIPPING_ZONES.items()}
+        for zone in shipping_zones:
+            if zone.get("name"):
+                zones.setdefault(zone["name"], []).extend(zone.get("countries") or [])
+        self.country_zones = {
+            country.strip().lower(): name for name, countries in zones.items() for country in countries
+        }
+
+        methods.sort(key=lambda m: (m["base_rate"], m["name"]))
+        self.methods = methods
+        self.base_rate = np.array([m["base_rate"] for m in methods], dtype=float)
+        self.per_kg_rate = np.array([m.get("per_kg_rate") or 0.0 for m in methods], dtype=float)
+        self.free_threshold = np.array(
+            [m["free_shipping_threshold"] if m.get("free_shipping_threshold") is not None else np.inf
+             for m in methods],
+            dtype=float
+        )
+        self.everywhere = np.array([not m.get("zones") for m in methods], dtype=bool)
+        self.zone_masks = {}
+        for i, method in enumerate(methods):
+            for zone in method.get("zones") or []:
+                mask = self.zone_masks.setdefault(zone.strip().lower(), np.zeros(len(methods), dtype=bool))
+                mask[i] = True
+
+    def zone_of(self, destination: str) -> str:
+        return self.country_zones.get(destination.strip().lower(), INTERNATIONAL_ZONE)
+
+    def applicable(self, destination: str) -> np.ndarray:
+        """Methods shipping to the destination: those listing its zone or the country itself, or no zones"""
+        mask = self.everywhere.copy()
+        for key in (self.zone_of(destination).lower(), destination.strip().lower()):
+            if key in self.zone_masks:
+                mask |= self.zone_masks[key]
+        return mask
+
+    def quote(self, subtotal: float, weight_kg: float, destinations: List[str]) -> List[Dict[str, Any]]:
+        free = subtotal >= self.free_threshold
+        costs = np.round(np.where(free, 0.0, self.base_rate + self.per_kg_rate * weight_kg), 2)
+        quotes = []
+        for destination in destinations:
+            rows = np.flatnonzero(self.applicable(destination))
+            rows = rows[np.argsort(costs[rows], kind="stable")]
+            quotes.append({
+                "destination": destination,
+                "zone": self.zone_of(destination),
+                "methods": [
+                    {
+                        "id": self.methods[i]["id"],
+                        "name": self.methods[i]["name"],
+                        "carrier": self.methods[i]["carrier"],
+                        "type": self.methods[i]["type"],
+                        "cost": float(costs[i]),
+                        "free": bool(free[i]),
+                        "estimated_days_min": self.methods[i].get("estimated_days_min", 2),
+                        "estimated_days_max": self.methods[i].get("estimated_days_max", 5),
+                    }
+                    for i in rows
+                ]
+            })
+        return quotes
+
+shipping_rates = ShippingRateTable()
+
+@api_router.post("/shipping/quote")
+async def quote_shipping(quote: ShippingQuoteRequest):
+    """Shipping options and prices for a cart (subtotal, weight) to one or more destinations, cheapest first"""
+    await shipping_rates.ensure_current()
+    return {"quotes": shipping_rates.quote(quote.subtotal, quote.weight_kg, quote.destinations)}
+
 # ========== SHIPPING ROUTES ==========
 
 @api_router.get("/shipping-methods", response_model=List[ShippingMethod])
 async def get_shipping_methods(admin: User = Depends(get_admin_user)):
     methods = await db.shipping_methods.find({}, {"_id": 0}).to_list(100)
-    for method in methods:
-        if isinstance(method.get('created_at'), str):
-            method['created_at'] = datetime.fromisoformat(method['created_at'])
-        if isinstance(method.get('updated_at'), str):
-            method['updated_at'] = datetime.fromisoformat(method['updated_at'])
     return methods
 
 @api_router.post("/shipping-methods", response_model=ShippingMethod)
 async def create_shipping_method(method_data: ShippingMethodCreate, admin: User = Depends(get_admin_user)):
     method = ShippingMethod(**method_data.model_dump())
     method_doc = method.model_dump()
-    method_doc['created_at'] = method_doc['created_at'].isoformat()
-    method_doc['updated_at'] = method_doc['updated_at'].isoformat()
     
     await db.shipping_methods.insert_one(method_doc)
+    shipping_rates.mark_changed()
     return method
 
 @api_router.put("/shipping-methods/{method_id}", response_model=ShippingMethod)
@@ -1615,15 +4090,12 @@ async def update_shipping_method(method_id: str, method_data: ShippingMethodCrea
         raise HTTPException(status_code=404, detail="Shipping method not found")
     
     update_data = method_data.model_dump()
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.shipping_methods.update_one({"id": method_id}, {"$set": update_data})
+    shipping_rates.mark_changed()
     
     updated_method = await db.shipping_methods.find_one({"id": method_id}, {"_id": 0})
-    if isinstance(updated_method.get('created_at'), str):
-        updated_method['created_at'] = datetime.fromisoformat(updated_method['created_at'])
-    if isinstance(updated_method.get('updated_at'), str):
-        updated_method['updated_at'] = datetime.fromisoformat(updated_method['updated_at'])
     
     return ShippingMethod(**updated_method)
 
@@ -1632,6 +4104,7 @@ async def delete_shipping_method(method_id: str, admin: User = Depends(get_admin
     result = await db.shipping_methods.delete_one({"id": method_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Shipping method not found")
+    shipping_rates.mark_changed()
     return {"message": "Shipping method deleted successfully"}
 
 @api_router.put("/shipping-methods/{method_id}/toggle")
@@ -1643,8 +4116,9 @@ async def toggle_shipping_method(method_id: str, admin: User = Depends(get_admin
     new_status = not method.get('is_active', True)
     await db.shipping_methods.update_one(
         {"id": method_id},
-        {"$set": {"is_active": new_status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"is_active": new_status, "updated_at": datetime.now(timezone.utc)}}
     )
+    shipping_rates.mark_changed()
     
     return {"message": "Shipping method status updated", "is_active": new_status}
 
@@ -1679,10 +4153,42 @@ async def get_dashboard_analytics(admin: User = Depends(get_admin_user)):
         "recent_orders": recent_orders
     }
 
+@api_router.get("/analytics/compression")
+async def get_compression_metrics(admin: User = Depends(get_admin_user)):
+    """Admin: Per-route compression ratio (bytes out / bytes in) and CPU time since startup"""
+    return {
+        "encodings": ["br", "gzip"] if brotli is not None else ["gzip"],
+        "min_size": COMPRESSION_MIN_SIZE,
+        "cached_responses": len(response_cache),
+        "routes": compression_metrics.snapshot()
+    }
+
 # ========== WISHLIST ROUTES ==========
 
 from fastapi import Request
 
+# Per-user set of wishlisted product ids; entries are dropped whenever that user adds or removes
+wishlist_ids_cache: TTLCache = TTLCache(maxsize=10000, ttl=600)
+WISHLIST_CHECK_LIMIT = 200
+
+async def wishlist_product_ids(user_id: str) -> frozenset:
+    cached = wishlist_ids_cache.get(user_id)
+    if cached is None:
+        cached = frozenset(await db.wishlist.distinct("product_id", {"user_id": user_id}))
+        wishlist_ids_cache[user_id] = cached
+    return cached
+
+async def rebuild_wishlist_counts() -> int:
+    """Recount products.wishlist_count from the wishlist collection; returns products with entries"""
+    operations = [
+        UpdateOne({"id": group["_id"]}, {"$set": {"wishlist_count": group["count"]}})
+        async for group in db.wishlist.aggregate([{"$group": {"_id": "$product_id", "count": {"$sum": 1}}}])
+    ]
+    for start in range(0, len(operations), 1000):
+        await db.products.bulk_write(operations[start:start + 1000], ordered=False)
+    await db.products.update_many({"wishlist_count": {"$exists": False}}, {"$set": {"wishlist_count": 0}})
+    return len(operations)
+
 @api_router.get("/wishlist")
 async def get_wishlist(
     request: Request,
@@ -1693,21 +4199,8 @@ async def get_wishlist(
     ).to_list(100)
 
     product_ids = [item["product_id"] for item in wishlist_items]
-
-    products = await db.products.find(
-        {"id": {"$in": product_ids}}, {"_id": 0}
-    ).to_list(100)
-
     base_url = str(request.base_url).rstrip("/")
-
-    #  normalize product images
-    products_map = {}
-    for p in products:
-        p["images"] = [
-            img if img.startswith("http") else f"{base_url}{img}"
-            for img in p.get("images", [])
-        ]
-        products_map[p["id"]] = p
+    products_map = await get_product_details(product_ids, base_url)
 
     result = []
     for item in wishlist_items:
@@ -1722,30 +4215,42 @@ async def get_wishlist(
 
 
 @api_router.post("/wishlist")
-async def add_to_wishlist(item: WishlistItemCreate, current_user: User = Depends(get_current_user)):
+async def add_to_wishlist(
+    item: WishlistItemCreate,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
     """Add product to wishlist"""
-    # Check if product exists
-    product = await db.products.find_one({"id": item.product_id})
-    if not product:
+    # Check if product exists (served from the product detail cache when warm)
+    base_url = str(request.base_url).rstrip("/")
+    if not await get_product_details([item.product_id], base_url):
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    # Check if already in wishlist
-    existing = await db.wishlist.find_one({
-        "user_id": current_user.id,
-        "product_id": item.product_id
-    })
-    if existing:
+
+    if item.product_id in wishlist_ids_cache.get(current_user.id, ()):
         raise HTTPException(status_code=400, detail="Product already in wishlist")
-    
+
     wishlist_item = WishlistItem(
         user_id=current_user.id,
         product_id=item.product_id
     )
-    
-    item_doc = wishlist_item.model_dump()
-    item_doc['created_at'] = item_doc['created_at'].isoformat()
-    
-    await db.wishlist.insert_one(item_doc)
+
+    # The unique (user_id, product_id) index makes the upsert the duplicate check
+    try:
+        result = await db.wishlist.update_one(
+            {"user_id": current_user.id, "product_id": item.product_id},
+            {"$setOnInsert": wishlist_item.model_dump()},
+            upsert=True
+        )
+        added = result.upserted_id is not None
+    except DuplicateKeyError:
+        added = False  # A concurrent add of the same product won the race
+    if not added:
+        raise HTTPException(status_code=400, detail="Product already in wishlist")
+
+    # Not a catalog edit and not part of any product payload: most_wished listings catch up when
+    # their cached responses expire
+    await db.products.update_one({"id": item.product_id}, {"$inc": {"wishlist_count": 1}})
+    wishlist_ids_cache.pop(current_user.id, None)
     return {"message": "Added to wishlist", "item": wishlist_item}
 
 @api_router.delete("/wishlist/{product_id}")
@@ -1757,16 +4262,27 @@ async def remove_from_wishlist(product_id: str, current_user: User = Depends(get
     })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item not found in wishlist")
+    # The guard keeps the count from going negative if it drifted (rebuild_wishlist_counts fixes it)
+    await db.products.update_one(
+        {"id": product_id, "wishlist_count": {"$gt": 0}},
+        {"$inc": {"wishlist_count": -1}}
+    )
+    wishlist_ids_cache.pop(current_user.id, None)
     return {"message": "Removed from wishlist"}
 
+@api_router.get("/wishlist/contains")
+async def check_wishlist_batch(ids: str, current_user: User = Depends(get_current_user)):
+    """Which of the given product ids (comma-separated) are in the wishlist; one call per product grid"""
+    product_ids = split_values(ids)
+    if len(product_ids) > WISHLIST_CHECK_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {WISHLIST_CHECK_LIMIT} products per check")
+    wishlisted = await wishlist_product_ids(current_user.id)
+    return {"product_ids": [product_id for product_id in product_ids if product_id in wishlisted]}
+
 @api_router.get("/wishlist/check/{product_id}")
 async def check_wishlist(product_id: str, current_user: User = Depends(get_current_user)):
     """Check if product is in wishlist"""
-    item = await db.wishlist.find_one({
-        "user_id": current_user.id,
-        "product_id": product_id
-    })
-    return {"in_wishlist": item is not None}
+    return {"in_wishlist": product_id in await wishlist_product_ids(current_user.id)}
 
 # ========== WALLET ROUTES ==========
 
@@ -1779,8 +4295,6 @@ async def get_wallet(current_user: User = Depends(get_current_user)):
         # Create wallet if doesn't exist
         wallet = Wallet(user_id=current_user.id)
         wallet_doc = wallet.model_dump()
-        wallet_doc['created_at'] = wallet_doc['created_at'].isoformat()
-        wallet_doc['updated_at'] = wallet_doc['updated_at'].isoformat()
         await db.wallets.insert_one(wallet_doc)
         wallet = wallet_doc
     
@@ -1820,8 +4334,8 @@ async def admin_wallet_topup(topup: WalletTopUp, admin: User = Depends(get_admin
             "id": str(uuid.uuid4()),
             "user_id": topup.user_id,
             "balance": 0,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         await db.wallets.insert_one(wallet)
     
@@ -1829,7 +4343,7 @@ async def admin_wallet_topup(topup: WalletTopUp, admin: User = Depends(get_admin
     new_balance = wallet.get('balance', 0) + topup.amount
     await db.wallets.update_one(
         {"user_id": topup.user_id},
-        {"$set": {"balance": new_balance, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"balance": new_balance, "updated_at": datetime.now(timezone.utc)}}
     )
     
     # Create transaction record
@@ -1840,70 +4354,139 @@ async def admin_wallet_topup(topup: WalletTopUp, admin: User = Depends(get_admin
         description=topup.description
     )
     trans_doc = transaction.model_dump()
-    trans_doc['created_at'] = trans_doc['created_at'].isoformat()
     await db.wallet_transactions.insert_one(trans_doc)
     
     return {"message": "Wallet updated", "new_balance": new_balance}
 
+WALLET_SORT_FIELDS = {"balance", "created_at", "updated_at"}
+WALLET_TOTALS = {
+    "count": {"$sum": 1},
+    "total_balance": {"$sum": "$balance"},
+    "average_balance": {"$avg": "$balance"}
+}
+WALLET_CSV_COLUMNS = ["id", "user_id", "user_email", "user_name", "balance", "created_at", "updated_at"]
+
 @api_router.get("/wallet/admin/all")
-async def admin_get_all_wallets(admin: User = Depends(get_admin_user)):
-    """Admin: Get all user wallets"""
-    wallets = await db.wallets.find({}, {"_id": 0}).to_list(1000)
-    
-    # Get user details
-    user_ids = [w['user_id'] for w in wallets]
-    users = await db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "email": 1, "full_name": 1}).to_list(1000)
-    users_map = {u['id']: u for u in users}
-    
-    result = []
-    for wallet in wallets:
-        user = users_map.get(wallet['user_id'], {})
-        result.append({
-            **wallet,
-            "user_email": user.get('email'),
-            "user_name": user.get('full_name')
-        })
-    
-    return result
+async def admin_get_all_wallets(
+    admin: User = Depends(get_admin_user),
+    search: Optional[str] = None,
+    min_balance: Optional[float] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    sort_by: str = "created_at",
+    sort_order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|csv)$")
+):
+    """Admin: Get user wallets joined with their owner, filtered and cursor-paginated.
+
+    The first page (no cursor) also carries totals over every matching wallet.
+    """
+    if sort_by not in WALLET_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {sorted(WALLET_SORT_FIELDS)}")
+    sort_dir = 1 if sort_order == "asc" else -1
+
+    match: Dict[str, Any] = {}
+    if min_balance is not None:
+        match["balance"] = {"$gte": min_balance}
+    created_range = date_range_filter(date_from, date_to)
+    if created_range:
+        match["created_at"] = created_range
+
+    pipeline = [{"$match": match}, {"$project": {"_id": 0}}]
+    lookup = user_lookup_stages("user_id", "user")
+    if search:
+        # The email/name filter needs the join first; otherwise join only the returned page
+        pattern = {"$regex": re.escape(search), "$options": "i"}
+        pipeline += lookup + [{"$match": {"$or": [{"user_email": pattern}, {"user_name": pattern}]}}]
+        lookup = []
+
+    if format == "csv":
+        export = db.wallets.aggregate(
+            pipeline + [{"$sort": {sort_by: sort_dir, "id": sort_dir}}] + lookup,
+            allowDiskUse=True
+        )
+        return stream_csv(export, WALLET_CSV_COLUMNS, "wallets.csv")
+
+    if cursor:
+        return await paginate_aggregation(db.wallets, pipeline, lookup, sort_by, sort_dir, limit, cursor)
+    page, totals = await asyncio.gather(
+        paginate_aggregation(db.wallets, pipeline, lookup, sort_by, sort_dir, limit, cursor),
+        aggregate_totals(db.wallets, pipeline, WALLET_TOTALS)
+    )
+    return {**page, "totals": totals}
 
 # ========== REFERRAL ROUTES ==========
 
+# Statuses whose rewards have been credited; registration pays both sides at once and writes "completed"
+REFERRAL_PAID_STATUSES = ["completed", "rewarded"]
+REFERRAL_PAID = {"$in": ["$status", REFERRAL_PAID_STATUSES]}
+
+async def get_referral_stats(user_id: str) -> Dict[str, Any]:
+    """Referral totals for a referrer, computed by one $group and cached until a new referral lands"""
+    cached = referral_stats_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    pipeline = [
+        {"$match": {"referrer_id": user_id}},
+        {"$group": {
+            "_id": None,
+            "total_referrals": {"$sum": 1},
+            "completed_referrals": {"$sum": {"$cond": [REFERRAL_PAID, 1, 0]}},
+            "total_earned": {"$sum": {"$cond": [
+                REFERRAL_PAID, {"$ifNull": ["$referrer_reward", 0]}, 0
+            ]}}
+        }}
+    ]
+    groups = await db.referrals.aggregate(pipeline).to_list(1)
+    stats = {"total_referrals": 0, "completed_referrals": 0, "total_earned": 0}
+    if groups:
+        stats = {k: groups[0][k] for k in stats}
+
+    referral_stats_cache[user_id] = stats
+    return stats
+
+async def get_referral_page(user_id: str, limit: int, cursor: Optional[str]) -> Dict[str, Any]:
+    """Newest-first page of a referrer's referrals"""
+    pipeline = [{"$match": {"referrer_id": user_id}}, {"$project": {"_id": 0}}]
+    return await paginate_aggregation(db.referrals, pipeline, [], "created_at", -1, limit, cursor)
+
 @api_router.get("/referral/my-code")
 async def get_my_referral_code(current_user: User = Depends(get_current_user)):
     """Get user's referral code (generate if doesn't exist)"""
-    user_doc = await db.users.find_one({"id": current_user.id})
-    
-    if not user_doc.get('referral_code'):
-        # Generate unique referral code
-        while True:
-            code = generate_referral_code()
-            existing = await db.users.find_one({"referral_code": code})
-            if not existing:
-                break
-        
+    referral_code = current_user.referral_code
+    if not referral_code:
+        code = await generate_referral_code()
         await db.users.update_one(
             {"id": current_user.id},
             {"$set": {"referral_code": code}}
         )
         referral_code = code
-    else:
-        referral_code = user_doc['referral_code']
     
-    # Get referral stats
-    referrals = await db.referrals.find({"referrer_id": current_user.id}, {"_id": 0}).to_list(100)
-    total_referrals = len(referrals)
-    completed_referrals = len([r for r in referrals if r['status'] == 'rewarded'])
-    total_earned = sum(r.get('referrer_reward', 0) for r in referrals if r['status'] == 'rewarded')
+    stats, page = await asyncio.gather(
+        get_referral_stats(current_user.id),
+        get_referral_page(current_user.id, 20, None)
+    )
     
     return {
         "referral_code": referral_code,
         "referral_link": f"https://glenntek.pt/auth?ref={referral_code}",
-        "total_referrals": total_referrals,
-        "completed_referrals": completed_referrals,
-        "total_earned": total_earned,
-        "referrals": referrals
+        **stats,
+        "referrals": page["items"],
+        "next_cursor": page["next_cursor"]
     }
 
+@api_router.get("/referral/my-referrals")
+async def get_my_referrals(
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None
+):
+    """Get the user's referrals, newest first, cursor-paginated"""
+    return await get_referral_page(current_user.id, limit, cursor)
+
 @api_router.get("/referral/validate/{code}")
 async def validate_referral_code(code: str):
     """Validate a referral code"""
@@ -1920,7 +4503,6 @@ async def get_referral_settings():
         # Create default settings
         default_settings = ReferralSettings()
         settings_doc = default_settings.model_dump()
-        settings_doc['updated_at'] = settings_doc['updated_at'].isoformat()
         await db.referral_settings.insert_one(settings_doc)
         return default_settings.model_dump()
     return settings
@@ -1932,44 +4514,85 @@ async def update_referral_settings(
 ):
     """Admin: Update referral program settings"""
     update_data = {k: v for k, v in settings_update.model_dump().items() if v is not None}
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.referral_settings.update_one({}, {"$set": update_data}, upsert=True)
     
     settings = await db.referral_settings.find_one({}, {"_id": 0})
     return settings
 
+REFERRAL_SORT_FIELDS = {"created_at", "rewarded_at", "referrer_reward"}
+REFERRAL_TOTALS = {
+    "count": {"$sum": 1},
+    "rewarded": {"$sum": {"$cond": [REFERRAL_PAID, 1, 0]}},
+    "total_paid_out": {"$sum": {"$cond": [
+        REFERRAL_PAID,
+        {"$add": [{"$ifNull": ["$referrer_reward", 0]}, {"$ifNull": ["$referred_reward", 0]}]},
+        0
+    ]}}
+}
+REFERRAL_CSV_COLUMNS = [
+    "id", "referral_code", "status",
+    "referrer_id", "referrer_email", "referrer_name",
+    "referred_id", "referred_email", "referred_name",
+    "referrer_reward", "referred_reward", "created_at", "rewarded_at"
+]
+
 @api_router.get("/referral/admin/all")
-async def admin_get_all_referrals(admin: User = Depends(get_admin_user)):
-    """Admin: Get all referrals"""
-    referrals = await db.referrals.find({}, {"_id": 0}).to_list(1000)
-    
-    # Get user details
-    user_ids = set()
-    for r in referrals:
-        user_ids.add(r['referrer_id'])
-        user_ids.add(r['referred_id'])
-    
-    users = await db.users.find({"id": {"$in": list(user_ids)}}, {"_id": 0, "id": 1, "email": 1, "full_name": 1}).to_list(1000)
-    users_map = {u['id']: u for u in users}
-    
-    result = []
-    for referral in referrals:
-        referrer = users_map.get(referral['referrer_id'], {})
-        referred = users_map.get(referral['referred_id'], {})
-        result.append({
-            **referral,
-            "referrer_email": referrer.get('email'),
-            "referrer_name": referrer.get('full_name'),
-            "referred_email": referred.get('email'),
-            "referred_name": referred.get('full_name')
-        })
-    
-    return result
+async def admin_get_all_referrals(
+    admin: User = Depends(get_admin_user),
+    search: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    sort_by: str = "created_at",
+    sort_order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|csv)$")
+):
+    """Admin: Get referrals joined with referrer and referred users, filtered and cursor-paginated.
+
+    The first page (no cursor) also carries totals over every matching referral.
+    """
+    if sort_by not in REFERRAL_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {sorted(REFERRAL_SORT_FIELDS)}")
+    sort_dir = 1 if sort_order == "asc" else -1
+
+    match: Dict[str, Any] = {}
+    if status:
+        match["status"] = status
+    created_range = date_range_filter(date_from, date_to)
+    if created_range:
+        match["created_at"] = created_range
+
+    pipeline = [{"$match": match}, {"$project": {"_id": 0}}]
+    lookup = user_lookup_stages("referrer_id", "referrer") + user_lookup_stages("referred_id", "referred")
+    if search:
+        email = {"$regex": re.escape(search), "$options": "i"}
+        pipeline += lookup + [{"$match": {"$or": [{"referrer_email": email}, {"referred_email": email}]}}]
+        lookup = []
+
+    if format == "csv":
+        export = db.referrals.aggregate(
+            pipeline + [{"$sort": {sort_by: sort_dir, "id": sort_dir}}] + lookup,
+            allowDiskUse=True
+        )
+        return stream_csv(export, REFERRAL_CSV_COLUMNS, "referrals.csv")
+
+    if cursor:
+        return await paginate_aggregation(db.referrals, pipeline, lookup, sort_by, sort_dir, limit, cursor)
+    page, totals = await asyncio.gather(
+        paginate_aggregation(db.referrals, pipeline, lookup, sort_by, sort_dir, limit, cursor),
+        aggregate_totals(db.referrals, pipeline, REFERRAL_TOTALS)
+    )
+    return {**page, "totals": totals}
 
 # Include the router
 app.include_router(api_router)
 
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1988,6 +4611,80 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create the indexes the query paths rely on (idempotent)"""
+    # stock_holds used to expire on expires_at, which purged holds whose units were still reserved
+    for name, spec in (await db.stock_holds.index_information()).items():
+        if spec.get("key") == [("expires_at", 1)] and "expireAfterSeconds" in spec:
+            await db.stock_holds.drop_index(name)
+
+    index_specs = [
+        (db.users, [("id", 1)], {"unique": True}),
+        (db.users, [("email", 1)], {"unique": True}),
+        (db.users, [("referral_code", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"referral_code": {"$type": "string"}}
+        }),
+        (db.wallets, [("user_id", 1)], {"unique": True}),
+        (db.products, [("id", 1)], {"unique": True}),
+        (db.products, [("sku", 1)], {"unique": True}),
+        (db.products, [("slug", 1)], {"unique": True, "partialFilterExpression": {"slug": {"$type": "string"}}}),
+        (db.categories, [("slug", 1)], {"unique": True}),
+        (db.categories, [("ancestors", 1)], {}),
+        # Listing filter + sort: one index per PRODUCT_SORTS key with and without category;
+        # price serves both directions
+        *[
+            (db.products, [("is_active", 1), *category_key, *keys], {})
+            for category_key in ([("category", 1)], [])
+            for keys in (
+                [("created_at", -1), ("id", -1)],
+                [("price", 1), ("id", 1)],
+                [("name", 1), ("id", 1)],
+                [("wishlist_count", -1), ("id", -1)],
+            )
+        ],
+        (db.wishlist, [("user_id", 1), ("product_id", 1)], {"unique": True}),
+        (db.stock_holds, [("released_at", 1)], {"expireAfterSeconds": STOCK_HOLD_PURGE_AFTER}),
+        (db.stock_holds, [("expires_at", 1)], {}),
+        (db.stock_holds, [("user_id", 1)], {}),
+        (db.stock_holds, [("claimed_by", 1)], {}),
+        (db.pages, [("slug", 1)], {"unique": True}),
+        (db.blog_posts, [("slug", 1)], {"unique": True}),
+        (db.wallets, [("created_at", -1), ("id", -1)], {}),
+        (db.wallets, [("updated_at", -1), ("id", -1)], {}),
+        (db.wallets, [("balance", -1), ("id", -1)], {}),
+        (db.product_recommendations, [("product_id", 1)], {"unique": True}),
+        (db.product_recommendations, [("purchases", -1)], {}),
+        (db.product_recommendations, [("category", 1), ("purchases", -1)], {}),
+        (db.referrals, [("created_at", -1), ("id", -1)], {}),
+        (db.referrals, [("referrer_id", 1), ("created_at", -1), ("id", -1)], {}),
+        (db.referrals, [("status", 1), ("created_at", -1), ("id", -1)], {}),
+        (db.referrals, [("rewarded_at", -1), ("id", -1)], {}),
+        (db.referrals, [("referrer_reward", -1), ("id", -1)], {}),
+    ]
+    for collection, keys, options in index_specs:
+        try:
+            await collection.create_index(keys, **options)
+        except OperationFailure as e:
+            logger.warning(f"Could not create index {keys} on {collection.name}: {e}")
+
+    # Categories created before ancestor paths were materialized
+    if await db.categories.count_documents({"ancestors": {"$exists": False}}, limit=1):
+        logger.info(f"Materialized ancestor paths for {await rebuild_category_ancestors()} categories")
+
+    # Products created before wishlist counts were maintained
+    if await db.products.count_documents({"wishlist_count": {"$exists": False}}, limit=1):
+        logger.info(f"Counted wishlist entries for {await rebuild_wishlist_counts()} products")
+
+background_jobs: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def start_background_jobs():
+    background_jobs.append(asyncio.create_task(sweep_stock_holds()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for job in background_jobs:
+        job.cancel()
     client.close()
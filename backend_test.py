@@ -844,12 +844,12 @@ class GlenntekAPITester:
                     self.log_test("Admin Referral Reward", False, f"No reward received, balance change: €{balance_increase}")
             
             # Verify referral record was created
-            success, all_referrals = self.run_test("Get All Referrals After Registration", "GET", "referral/admin/all", 200, headers=admin_headers)
+            success, all_referrals = self.run_test("Get All Referrals After Registration", "GET", "referral/admin/all?status=completed", 200, headers=admin_headers)
             
-            if success and all_referrals:
+            if success and all_referrals.get('items'):
                 # Look for the referral record
                 found_referral = False
-                for referral in all_referrals:
+                for referral in all_referrals['items']:
                     if referral.get('referral_code') == admin_referral_code and referral.get('status') == 'completed':
                         found_referral = True
                         self.log_test("Referral Record Created", True, f"Status: {referral.get('status')}")
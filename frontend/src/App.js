@@ -55,10 +55,30 @@ function App() {
     // Load cart from localStorage
     const savedCart = localStorage.getItem('cart');
     if (savedCart) {
-      setCart(JSON.parse(savedCart));
+      const items = JSON.parse(savedCart);
+      setCart(items);
+      refreshCart(items);
     }
   }, []);
 
+  // Re-read name, price, stock and image for every cart line in one request;
+  // products that were deleted or deactivated drop out of the cart
+  const refreshCart = async (items) => {
+    if (items.length === 0) return;
+    try {
+      const ids = items.map(item => item.id).join(',');
+      const response = await axios.get(`${API}/products/batch?ids=${ids}&view=card`);
+      const current = Object.fromEntries(response.data.products.map(product => [product.id, product]));
+      const newCart = items
+        .filter(item => current[item.id])
+        .map(item => ({ ...item, ...current[item.id] }));
+      setCart(newCart);
+      localStorage.setItem('cart', JSON.stringify(newCart));
+    } catch (error) {
+      // Keep the saved cart as it is
+    }
+  };
+
   const fetchUser = async () => {
     try {
       const response = await axios.get(`${API}/auth/me`);
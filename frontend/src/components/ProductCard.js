@@ -1,4 +1,4 @@
-import { useState, useContext } from "react";
+import { useState, useEffect, useContext } from "react";
 import { Link, useNavigate } from "react-router-dom";
 import axios from "axios";
 import { AuthContext } from "@/App";
@@ -10,6 +10,26 @@ import { toast } from "sonner";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Cards mounted in the same render share one /wishlist/contains request
+let pendingWishlistCheck = null;
+
+function isInWishlist(productId) {
+  if (!pendingWishlistCheck) {
+    const batch = { ids: new Set() };
+    batch.result = new Promise((resolve) => setTimeout(resolve, 0))
+      .then(() => {
+        pendingWishlistCheck = null;
+        return axios.get(`${API}/wishlist/contains`, {
+          params: { ids: [...batch.ids].join(",") },
+        });
+      })
+      .then((res) => new Set(res.data.product_ids));
+    pendingWishlistCheck = batch;
+  }
+  pendingWishlistCheck.ids.add(productId);
+  return pendingWishlistCheck.result.then((ids) => ids.has(productId));
+}
+
 export default function ProductCard({ product, showActions = true }) {
   const { user, addToCart } = useContext(AuthContext);
   const navigate = useNavigate();
@@ -17,11 +37,10 @@ export default function ProductCard({ product, showActions = true }) {
   const [wishlistLoading, setWishlistLoading] = useState(false);
 
   // Check wishlist status on mount
-  useState(() => {
+  useEffect(() => {
     if (user && product?.id) {
-      axios
-        .get(`${API}/wishlist/check/${product.id}`)
-        .then((res) => setInWishlist(res.data.in_wishlist))
+      isInWishlist(product.id)
+        .then(setInWishlist)
         .catch(() => {});
     }
   }, [user, product?.id]);
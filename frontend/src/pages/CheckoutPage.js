@@ -1,4 +1,4 @@
-import { useState, useContext } from "react";
+import { useState, useEffect, useContext } from "react";
 import { useNavigate } from "react-router-dom";
 import axios from "axios";
 import Layout from "@/components/Layout";
@@ -34,9 +34,91 @@ export default function CheckoutPage() {
     (sum, item) => sum + item.price * item.quantity,
     0,
   );
-  const shipping = subtotal > 50 ? 0 : 5;
-  const tax = subtotal * 0.23;
-  const total = subtotal + shipping + tax;
+  // Reserve the cart's stock while the customer fills in the form; the order takes over the hold.
+  // Keyed on the cart's contents, so a new cart array with the same items doesn't re-hold; each
+  // hold replaces the previous one
+  const holdKey = JSON.stringify(cart.map((item) => [item.id, item.quantity]));
+  useEffect(() => {
+    if (!user || cart.length === 0) return;
+    axios
+      .post(`${API}/checkout/hold`, {
+        items: cart.map((item) => ({
+          product_id: item.id,
+          quantity: item.quantity,
+        })),
+      })
+      .catch((error) => {
+        if (error.response?.status === 409) {
+          toast.error(error.response.data.detail.message);
+        }
+      });
+  }, [user, holdKey]);
+
+  // Leaving checkout gives the stock back; after an order there is nothing left to release
+  useEffect(() => {
+    if (!user) return;
+    return () => {
+      axios.delete(`${API}/checkout/hold`).catch(() => {});
+    };
+  }, [user]);
+
+  const [taxRate, setTaxRate] = useState(null);
+  const [shippingOptions, setShippingOptions] = useState([]);
+  const [shippingMethodId, setShippingMethodId] = useState(null);
+  const [quoting, setQuoting] = useState(true);
+  // Amounts the server priced the order at after a 409; placing the order again confirms them
+  const [serverPricing, setServerPricing] = useState(null);
+
+  // VAT is configured in the site settings; fall back to the default rate if they can't be read
+  useEffect(() => {
+    axios
+      .get(`${API}/settings`)
+      .then((res) => setTaxRate(res.data.tax_rate))
+      .catch(() => setTaxRate(23));
+  }, []);
+
+  // Options and prices for the destination come from the backend rate table
+  useEffect(() => {
+    if (!formData.country) {
+      setQuoting(false);
+      return;
+    }
+    let cancelled = false;
+    setQuoting(true);
+    const timer = setTimeout(() => {
+      axios
+        .post(`${API}/shipping/quote`, {
+          subtotal,
+          destinations: [formData.country],
+        })
+        .then((res) => {
+          if (cancelled) return;
+          const methods = res.data.quotes[0].methods;
+          setShippingOptions(methods);
+          setShippingMethodId((current) =>
+            methods.some((m) => m.id === current) ? current : methods[0]?.id ?? null,
+          );
+        })
+        .catch(() => !cancelled && setShippingOptions([]))
+        .finally(() => !cancelled && setQuoting(false));
+    }, 300);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [formData.country, subtotal]);
+
+  useEffect(() => {
+    setServerPricing(null);
+  }, [cart, formData.country, shippingMethodId]);
+
+  const selectedShipping = shippingOptions.find((m) => m.id === shippingMethodId);
+  const shipping =
+    serverPricing?.shipping_cost ??
+    (selectedShipping ? selectedShipping.cost : subtotal > 50 ? 0 : 5);
+  const tax = serverPricing?.tax ?? Math.round(subtotal * (taxRate ?? 23)) / 100;
+  const total = serverPricing?.total ?? subtotal + shipping + tax;
+  const pricingReady = taxRate !== null && !quoting;
 
   const handleChange = (e) => {
     setFormData({ ...formData, [e.target.name]: e.target.value });
@@ -67,8 +149,9 @@ export default function CheckoutPage() {
           price: item.price,
           quantity: item.quantity,
         })),
-        subtotal,
+        subtotal: serverPricing?.subtotal ?? subtotal,
         shipping_cost: shipping,
+        shipping_method_id: selectedShipping?.id,
         tax,
         total,
         payment_method: paymentMethod,
@@ -101,7 +184,19 @@ export default function CheckoutPage() {
       toast.success("Order placed successfully!");
       navigate(`/orders/${response.data.id}`);
     } catch (error) {
-      toast.error("Failed to place order. Please try again.");
+      const detail = error.response?.data?.detail;
+      if (error.response?.status === 409 && detail?.expected) {
+        // The server priced the order differently (e.g. a price changed since it was added):
+        // show its amounts and let the customer confirm them by placing the order again
+        setServerPricing(detail.expected);
+        toast.warning(`${detail.message}. Check the updated total and confirm.`);
+        return;
+      }
+      toast.error(
+        detail?.message ||
+          (typeof detail === "string" ? detail : null) ||
+          "Failed to place order. Please try again.",
+      );
       console.error(error);
     } finally {
       setLoading(false);
@@ -308,7 +403,7 @@ export default function CheckoutPage() {
                         className="font-semibold"
                         data-testid="summary-subtotal"
                       >
-                        €{subtotal.toFixed(2)}
+                        €{(serverPricing?.subtotal ?? subtotal).toFixed(2)}
                       </span>
                     </div>
                     <div className="flex justify-between">
@@ -320,8 +415,37 @@ export default function CheckoutPage() {
                         {shipping === 0 ? "FREE" : `€${shipping.toFixed(2)}`}
                       </span>
                     </div>
+                    {shippingOptions.length > 1 && (
+                      <RadioGroup
+                        value={shippingMethodId}
+                        onValueChange={setShippingMethodId}
+                        data-testid="shipping-options"
+                      >
+                        {shippingOptions.map((method) => (
+                          <div
+                            key={method.id}
+                            className="flex items-center space-x-2 text-sm"
+                          >
+                            <RadioGroupItem
+                              value={method.id}
+                              id={`shipping-${method.id}`}
+                            />
+                            <Label
+                              htmlFor={`shipping-${method.id}`}
+                              className="cursor-pointer flex-1 font-normal"
+                            >
+                              {method.name} ({method.estimated_days_min}-
+                              {method.estimated_days_max} days)
+                            </Label>
+                            <span>
+                              {method.free ? "FREE" : `€${method.cost.toFixed(2)}`}
+                            </span>
+                          </div>
+                        ))}
+                      </RadioGroup>
+                    )}
                     <div className="flex justify-between">
-                      <span className="text-gray-600">VAT (23%)</span>
+                      <span className="text-gray-600">VAT ({taxRate ?? 23}%)</span>
                       <span className="font-semibold" data-testid="summary-tax">
                         €{tax.toFixed(2)}
                       </span>
@@ -343,7 +467,7 @@ export default function CheckoutPage() {
                   <Button
                     type="submit"
                     className="w-full text-lg py-6"
-                    disabled={loading}
+                    disabled={loading || !pricingReady}
                     data-testid="place-order-button"
                   >
                     {loading ? (
@@ -351,6 +475,13 @@ export default function CheckoutPage() {
                         <Loader2 className="mr-2 h-5 w-5 animate-spin" />
                         Processing...
                       </>
+                    ) : !pricingReady ? (
+                      <>
+                        <Loader2 className="mr-2 h-5 w-5 animate-spin" />
+                        Calculating shipping...
+                      </>
+                    ) : serverPricing ? (
+                      "Confirm New Total"
                     ) : (
                       "Place Order"
                     )}
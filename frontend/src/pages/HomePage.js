@@ -75,15 +75,12 @@ const fetchData = async () => {
     for (const section of sections) {
       if (section.section_type === "new_arrivals") {
         const res = await axios.get(
-          `${API}/products?limit=${section.config?.limit || 4}`
+          `${API}/products?limit=${section.config?.limit || 4}&sort=newest&view=card`
         );
-        const sorted = res.data.sort(
-          (a, b) => new Date(b.created_at) - new Date(a.created_at)
-        );
-        setNewArrivals(sorted.slice(0, section.config?.limit || 4));
+        setNewArrivals(res.data);
       } else if (section.section_type === "featured_products") {
         const res = await axios.get(
-          `${API}/products?limit=${section.config?.limit || 8}`
+          `${API}/products?limit=${section.config?.limit || 8}&view=card`
         );
         setFeaturedProducts(res.data);
       }
@@ -24,6 +24,7 @@ export default function ProductsPage() {
   const [searchParams, setSearchParams] = useSearchParams();
   const [products, setProducts] = useState([]);
   const [categories, setCategories] = useState([]);
+  const [categoryCounts, setCategoryCounts] = useState({});
   const [loading, setLoading] = useState(true);
 
   const [search, setSearch] = useState(searchParams.get("search") || "");
@@ -32,7 +33,9 @@ export default function ProductsPage() {
   );
 
   const [priceRange, setPriceRange] = useState([0, 200]);
-  const [sortBy, setSortBy] = useState("name");
+  const [sortBy, setSortBy] = useState(
+    searchParams.get("new") === "true" ? "newest" : "name",
+  );
 
   // ✅ NEW STATES
   const [limit, setLimit] = useState(25);
@@ -45,7 +48,7 @@ export default function ProductsPage() {
 
   useEffect(() => {
     fetchProducts();
-  }, [searchParams, limit, skip]);
+  }, [searchParams, limit, skip, sortBy]);
 
   const fetchCategories = async () => {
     try {
@@ -70,29 +73,28 @@ export default function ProductsPage() {
       if (searchParams.get("max_price"))
         params.append("max_price", searchParams.get("max_price"));
 
-      // ✅ ADD PAGINATION PARAMS
+      const facetParams = new URLSearchParams(params);
       params.append("limit", limit);
       params.append("skip", skip);
+      params.append("view", "card");
+      params.append("sort", sortBy);
 
-      const response = await axios.get(
-        `${API}/products/all?${params.toString()}`,
-      );
+      const [response, facets] = await Promise.all([
+        axios.get(`${API}/products/all?${params.toString()}`),
+        axios.get(`${API}/products/facets?${facetParams.toString()}`),
+      ]);
 
-      let filteredProducts = response.data.products;
+      setCategoryCounts(
+        Object.fromEntries(
+          facets.data.categories.map((facet) => [facet.value, facet.count]),
+        ),
+      );
 
       // ✅ SET TOTAL
       setTotal(response.data.total);
 
-      // Sort products
-      if (sortBy === "price-asc") {
-        filteredProducts.sort((a, b) => a.price - b.price);
-      } else if (sortBy === "price-desc") {
-        filteredProducts.sort((a, b) => b.price - a.price);
-      } else if (sortBy === "name") {
-        filteredProducts.sort((a, b) => a.name.localeCompare(b.name));
-      }
-
-      setProducts(filteredProducts);
+      // Sorted server-side so the order holds across pages
+      setProducts(response.data.products);
     } catch (error) {
       toast.error("Failed to load products");
     } finally {
@@ -190,7 +192,7 @@ export default function ProductsPage() {
                       <SelectItem value="all">All Categories</SelectItem>
                       {categories.map((cat) => (
                         <SelectItem key={cat.id} value={cat.slug}>
-                          {cat.name}
+                          {cat.name} ({categoryCounts[cat.slug] ?? 0})
                         </SelectItem>
                       ))}
                     </SelectContent>
@@ -271,14 +273,22 @@ export default function ProductsPage() {
               </div>
 
               {/* SORT */}
-              <Select value={sortBy} onValueChange={setSortBy}>
+              <Select
+                value={sortBy}
+                onValueChange={(value) => {
+                  setSortBy(value);
+                  setSkip(0);
+                }}
+              >
                 <SelectTrigger className="w-48">
                   <SelectValue />
                 </SelectTrigger>
                 <SelectContent>
                   <SelectItem value="name">Name</SelectItem>
-                  <SelectItem value="price-asc">Price ↑</SelectItem>
-                  <SelectItem value="price-desc">Price ↓</SelectItem>
+                  <SelectItem value="newest">Newest</SelectItem>
+                  <SelectItem value="most_wished">Most wished</SelectItem>
+                  <SelectItem value="price_asc">Price ↑</SelectItem>
+                  <SelectItem value="price_desc">Price ↓</SelectItem>
                 </SelectContent>
               </Select>
             </div>
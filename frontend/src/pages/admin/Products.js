@@ -258,60 +258,6 @@ export default function AdminProducts() {
     }
   };
 
-  const clean = (v) => (v ?? "").toString().trim();
-
-  const toFloat = (v, fallback = 0) => {
-    const n = parseFloat(clean(v));
-    return Number.isFinite(n) ? n : fallback;
-  };
-
-  const toNullableFloat = (v) => {
-    const s = clean(v);
-    if (!s) return null;
-    const n = parseFloat(s);
-    return Number.isFinite(n) ? n : null;
-  };
-
-  const toInt = (v, fallback = 0) => {
-    const n = parseInt(clean(v), 10);
-    return Number.isFinite(n) ? n : fallback;
-  };
-
-  const toBool = (v, fallback = true) => {
-    const s = clean(v).toLowerCase();
-    if (!s) return fallback;
-    if (["true", "1", "yes", "y"].includes(s)) return true;
-    if (["false", "0", "no", "n"].includes(s)) return false;
-    return fallback;
-  };
-
-  // tags/images: "a;b;c"
-  const parseList = (v) => {
-    const s = clean(v);
-    return s
-      ? s
-          .split(";")
-          .map((x) => x.trim())
-          .filter(Boolean)
-      : [];
-  };
-
-  // specifications/variants: JSON string
-  const parseJSON = (v, fallback) => {
-    const s = clean(v);
-    if (!s) return fallback;
-    try {
-      return JSON.parse(s);
-    } catch {
-      return fallback;
-    }
-  };
-
-  const getVal = (headers, values, key) => {
-    const idx = headers.indexOf(key);
-    return idx >= 0 ? values[idx] : "";
-  };
-
   const handleBulkUpload = async () => {
     if (!csvFile) {
       toast.error("Please select a CSV file");
@@ -319,81 +265,27 @@ export default function AdminProducts() {
     }
 
     try {
-      const text = await csvFile.text();
-
-      // ✅ IMPORTANT: remove \r (windows) + trim
-      const lines = text
-        .split("\n")
-        .map((l) => l.replace("\r", "").trim())
-        .filter(Boolean);
+      const uploadData = new FormData();
+      uploadData.append("file", csvFile);
 
-      if (lines.length < 2) {
-        toast.error("CSV file is empty or invalid");
-        return;
-      }
-
-      const headers = lines[0].split(",").map((h) => h.trim()); // must match CSV header exactly
-
-      let successCount = 0;
-      let errorCount = 0;
-
-      for (let i = 1; i < lines.length; i++) {
-        const values = lines[i].split(",").map((v) => v.trim());
-        if (!values.length) continue;
-
-        // ✅ Product model mapping
-        const productData = {
-          name: clean(getVal(headers, values, "name")),
-          slug: clean(getVal(headers, values, "slug")) || null,
-          description: clean(getVal(headers, values, "description")),
-          category: clean(getVal(headers, values, "category")),
-          price: toFloat(getVal(headers, values, "price"), 0),
-          compare_price: toNullableFloat(
-            getVal(headers, values, "compare_price"),
-          ),
-          sku: clean(getVal(headers, values, "sku")),
-          images: parseList(getVal(headers, values, "images")),
-          variants: parseJSON(getVal(headers, values, "variants"), []),
-          stock_quantity: toInt(getVal(headers, values, "stock_quantity"), 0),
-          low_stock_threshold: toInt(
-            getVal(headers, values, "low_stock_threshold"),
-            10,
-          ),
-          tags: parseList(getVal(headers, values, "tags")),
-          specifications: parseJSON(
-            getVal(headers, values, "specifications"),
-            {},
-          ),
-          seo_title: clean(getVal(headers, values, "seo_title")) || null,
-          seo_description:
-            clean(getVal(headers, values, "seo_description")) || null,
-          is_active: toBool(getVal(headers, values, "is_active"), true),
-        };
-
-        // ✅ basic validation
-        if (!productData.name || !productData.sku) {
-          errorCount++;
-          continue;
-        }
-
-        try {
-          await axios.post(`${API}/products`, productData);
-          successCount++;
-        } catch (error) {
-          console.error(`Row ${i + 1} failed`, error?.response?.data || error);
-          errorCount++;
-        }
-      }
+      const { data: report } = await axios.post(
+        `${API}/products/import`,
+        uploadData,
+        { headers: { "Content-Type": "multipart/form-data" } },
+      );
 
+      report.errors.forEach((error) =>
+        console.error(`Row ${error.row} failed`, error.error),
+      );
       toast.success(
-        `Imported ${successCount} products successfully. ${errorCount} errors.`,
+        `Imported ${report.inserted + report.updated} products successfully. ${report.errors.length} errors.`,
       );
       setBulkDialogOpen(false);
       setCsvFile(null);
       fetchProducts();
     } catch (error) {
       console.error(error);
-      toast.error("Failed to process CSV file");
+      toast.error(error?.response?.data?.detail || "Failed to process CSV file");
     }
   };
 
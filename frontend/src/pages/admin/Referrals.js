@@ -23,6 +23,9 @@ const API = `${BACKEND_URL}/api`;
 
 export default function AdminReferrals() {
   const [referrals, setReferrals] = useState([]);
+  const [totals, setTotals] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [settings, setSettings] = useState({
     referrer_reward: 5.0,
     referred_reward: 5.0,
@@ -42,7 +45,9 @@ export default function AdminReferrals() {
         axios.get(`${API}/referral/admin/all`),
         axios.get(`${API}/referral/settings`),
       ]);
-      setReferrals(referralsRes.data);
+      setReferrals(referralsRes.data.items);
+      setNextCursor(referralsRes.data.next_cursor);
+      setTotals(referralsRes.data.totals);
       setSettings(settingsRes.data);
     } catch (error) {
       toast.error("Failed to load referral data");
@@ -51,6 +56,21 @@ export default function AdminReferrals() {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const res = await axios.get(`${API}/referral/admin/all`, {
+        params: { cursor: nextCursor },
+      });
+      setReferrals((current) => [...current, ...res.data.items]);
+      setNextCursor(res.data.next_cursor);
+    } catch (error) {
+      toast.error("Failed to load more referrals");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const saveSettings = async () => {
     setSaving(true);
     try {
@@ -63,16 +83,9 @@ export default function AdminReferrals() {
     }
   };
 
-  const totalReferrals = referrals.length;
-  const completedReferrals = referrals.filter(
-    (r) => r.status === "rewarded"
-  ).length;
-  const totalPaidOut = referrals
-    .filter((r) => r.status === "rewarded")
-    .reduce(
-      (sum, r) => sum + (r.referrer_reward || 0) + (r.referred_reward || 0),
-      0
-    );
+  const totalReferrals = totals?.count || 0;
+  const completedReferrals = totals?.rewarded || 0;
+  const totalPaidOut = totals?.total_paid_out || 0;
 
   return (
     <AdminLayout>
@@ -307,6 +320,13 @@ export default function AdminReferrals() {
                 </TableBody>
               </Table>
             )}
+            {nextCursor && (
+              <div className="p-4 text-center border-t">
+                <Button variant="outline" onClick={loadMore} disabled={loadingMore}>
+                  {loadingMore ? "Loading..." : "Load more"}
+                </Button>
+              </div>
+            )}
           </CardContent>
         </Card>
       </div>
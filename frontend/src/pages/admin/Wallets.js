@@ -35,8 +35,11 @@ const API = `${BACKEND_URL}/api`;
 
 export default function AdminWallets() {
   const [wallets, setWallets] = useState([]);
+  const [totals, setTotals] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const [users, setUsers] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [dialogOpen, setDialogOpen] = useState(false);
   const [searchTerm, setSearchTerm] = useState("");
   const [formData, setFormData] = useState({
@@ -46,21 +49,24 @@ export default function AdminWallets() {
   });
 
   useEffect(() => {
-    fetchData();
-  }, []);
+    // Search runs on the server so it covers every wallet, not just the loaded pages
+    const timer = setTimeout(() => fetchData(), searchTerm ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
+  const fetchWallets = (cursor) =>
+    axios
+      .get(`${API}/wallet/admin/all`, {
+        params: { search: searchTerm || undefined, cursor: cursor || undefined },
+      })
+      .then((res) => res.data);
 
   const fetchData = async () => {
     try {
-      const [walletsRes, usersRes] = await Promise.all([
-        axios.get(`${API}/wallet/admin/all`),
-        axios.get(`${API}/analytics/dashboard`).then((res) => res.data),
-      ]);
-      setWallets(walletsRes.data);
-
-      // Fetch all customers
-      const customersRes = await axios
-        .get(`${API}/orders`)
-        .catch(() => ({ data: [] }));
+      const page = await fetchWallets();
+      setWallets(page.items);
+      setNextCursor(page.next_cursor);
+      setTotals(page.totals);
     } catch (error) {
       toast.error("Failed to load wallets");
     } finally {
@@ -68,6 +74,19 @@ export default function AdminWallets() {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const page = await fetchWallets(nextCursor);
+      setWallets((current) => [...current, ...page.items]);
+      setNextCursor(page.next_cursor);
+    } catch (error) {
+      toast.error("Failed to load more wallets");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleTopUp = async (e) => {
     e.preventDefault();
     try {
@@ -85,13 +104,9 @@ export default function AdminWallets() {
     }
   };
 
-  const filteredWallets = wallets.filter(
-    (wallet) =>
-      wallet.user_email?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      wallet.user_name?.toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
-  const totalBalance = wallets.reduce((sum, w) => sum + (w.balance || 0), 0);
+  const walletCount = totals?.count || 0;
+  const totalBalance = totals?.total_balance || 0;
+  const averageBalance = totals?.average_balance || 0;
 
   return (
     <AdminLayout>
@@ -188,7 +203,7 @@ export default function AdminWallets() {
               <p className="text-sm text-gray-600 mb-1">
                 Total Users with Wallet
               </p>
-              <p className="text-3xl font-bold">{wallets.length}</p>
+              <p className="text-3xl font-bold">{walletCount}</p>
             </CardContent>
           </Card>
           <Card>
@@ -205,10 +220,7 @@ export default function AdminWallets() {
             <CardContent className="p-6">
               <p className="text-sm text-gray-600 mb-1">Average Balance</p>
               <p className="text-3xl font-bold">
-                €
-                {wallets.length > 0
-                  ? (totalBalance / wallets.length).toFixed(2)
-                  : "0.00"}
+                €{averageBalance.toFixed(2)}
               </p>
             </CardContent>
           </Card>
@@ -236,7 +248,7 @@ export default function AdminWallets() {
               <div className="p-8 text-center">
                 <div className="animate-spin rounded-full h-8 w-8 border-t-2 border-b-2 border-primary mx-auto"></div>
               </div>
-            ) : filteredWallets.length === 0 ? (
+            ) : wallets.length === 0 ? (
               <div className="p-8 text-center text-gray-500">
                 No wallets found
               </div>
@@ -252,7 +264,7 @@ export default function AdminWallets() {
                   </TableRow>
                 </TableHeader>
                 <TableBody>
-                  {filteredWallets.map((wallet) => (
+                  {wallets.map((wallet) => (
                     <TableRow key={wallet.id}>
                       <TableCell className="font-medium">
                         {wallet.user_name || "N/A"}
@@ -292,6 +304,13 @@ export default function AdminWallets() {
                 </TableBody>
               </Table>
             )}
+            {nextCursor && (
+              <div className="p-4 text-center border-t">
+                <Button variant="outline" onClick={loadMore} disabled={loadingMore}>
+                  {loadingMore ? "Loading..." : "Load more"}
+                </Button>
+              </div>
+            )}
           </CardContent>
         </Card>
       </div>
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark: checkout pricing latency for orders of 1, 10 and 50 line items
+
+Compares, against the products in the configured database (read-only):
+  * per-line reads - one products.find_one per line item, as checkout used to do
+  * price_order    - the server's pricing engine: one $in query, cached settings,
+                     in-memory shipping rates
+
+Reads MONGO_URL / DB_NAME from backend/.env:
+
+    python scripts/bench_checkout.py --rounds 50
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+
+import argparse
+import asyncio
+import time
+
+import server
+
+SIZES = (1, 10, 50)
+
+
+async def per_line_reads(order: server.OrderCreate):
+    for item in order.items:
+        await server.db.products.find_one({"id": item["product_id"]}, {"_id": 0})
+
+
+async def bench(label: str, fn, order: server.OrderCreate, rounds: int) -> float:
+    await fn(order)  # warm-up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await fn(order)
+    per_call = (time.perf_counter() - start) / rounds * 1000
+    print(f"   {label:<16} {per_call:8.2f} ms/checkout")
+    return per_call
+
+
+async def run(rounds: int, country: str):
+    product_ids = await server.db.products.distinct("id", {"is_active": True})
+    if not product_ids:
+        print("❌ No active products; seed the database first (scripts/seed_data.py)")
+        return
+
+    for size in SIZES:
+        items = [{"product_id": product_ids[i % len(product_ids)], "quantity": 1} for i in range(size)]
+        order = server.OrderCreate(
+            items=items, subtotal=0, shipping_cost=0, tax=0, total=0, payment_method="card",
+            shipping_address={"country": country}, billing_address={}
+        )
+        print(f"🛒 {size} line item{'s' if size > 1 else ''}")
+        naive = await bench("per-line reads", per_line_reads, order, rounds)
+        engine = await bench("price_order", server.price_order, order, rounds)
+        print(f"   speed-up {naive / engine:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--country", default="Portugal", help="Shipping destination")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.rounds, args.country))
+    server.client.close()
+
+
+if __name__ == "__main__":
+    main()
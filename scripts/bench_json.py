@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: response_model serialization vs the orjson fast path
+
+Compares, for a page of realistic product documents:
+  * response_model path - what FastAPI does for response_model=List[Product]:
+    validate every document into Product, dump in JSON mode, then json.dumps
+  * fast path           - fast_json(): orjson.dumps of the DB documents as-is
+
+    python scripts/bench_json.py --page-size 100 --rounds 200
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "glenntek_ecommerce")
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+from server import Product
+
+
+def make_product(i: int) -> dict:
+    created = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(hours=i)
+    return {
+        "id": str(uuid.uuid4()),
+        "name": f"Braided USB-C to Lightning Cable {i} 2m",
+        "slug": f"braided-usb-c-to-lightning-cable-{i}-2m",
+        "description": "Durable braided nylon cable with reinforced connectors. "
+                       "Supports fast charging and data sync up to 480 Mbps. " * 3,
+        "category": "cables",
+        "price": 19.99 + i % 10,
+        "compare_price": 29.99,
+        "sku": f"GLENN{i:06d}",
+        "images": [f"https://glenntek.pt/api/images/{uuid.uuid4()}" for _ in range(4)],
+        "variants": [{"color": c, "stock": 10} for c in ("black", "white", "red")],
+        "stock_quantity": 100 - i % 100,
+        "low_stock_threshold": 10,
+        "tags": ["cable", "usb-c", "lightning", "braided", "fast-charge"],
+        "specifications": {"Length": "2m", "Material": "Nylon", "Connector": "USB-C / Lightning", "Warranty": "2 years"},
+        "seo_title": f"USB-C Lightning Cable {i}",
+        "seo_description": "Premium braided cable for iPhone and iPad",
+        "is_active": True,
+        "created_at": created.isoformat(),
+        "updated_at": created.isoformat(),
+    }
+
+
+def bench(label: str, fn, rounds: int) -> float:
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    per_call = (time.perf_counter() - start) / rounds * 1000
+    print(f"   {label:<22} {per_call:8.3f} ms/page")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    docs = [make_product(i) for i in range(args.page_size)]
+    adapter = TypeAdapter(List[Product])
+
+    def response_model_path():
+        validated = adapter.validate_python(docs)
+        content = adapter.dump_python(validated, mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+    def fast_path():
+        return orjson.dumps(docs, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+    print(f"📊 Serializing {args.page_size} products x{args.rounds} ({len(fast_path()) / 1024:.1f} KiB/page)")
+    slow = bench("response_model + json", response_model_path, args.rounds)
+    fast = bench("orjson fast path", fast_path, args.rounds)
+    print(f"   speed-up {slow / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Exercise the LLM gateway against the local fake LLM (no network, no database)
+
+  * coalescing - N concurrent identical requests share one LLM call
+  * caching    - repeats are answered from the cache
+  * timeout    - a slow LLM is abandoned after --timeout seconds
+  * breaker    - after repeated failures calls short-circuit to the local fallback
+
+    python scripts/bench_llm_gateway.py --concurrency 100 --delay 0.5
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "glenntek_ecommerce")
+
+import argparse
+import asyncio
+import time
+
+from server import CircuitBreaker, FakeLlm, LlmGateway
+
+PROMPT = "User query: usb c cable\n\nProducts:\nID: 5f0c2a1e-8d4b-4c3a-9e1f-2b7d6a9c0e11 | Cable"
+
+
+async def timed(label: str, calls):
+    start = time.perf_counter()
+    answers = await asyncio.gather(*calls)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"   {label:<34} {elapsed:8.1f} ms  answered {sum(a is not None for a in answers)}/{len(answers)}")
+
+
+async def run(concurrency: int, delay: float, timeout: float):
+    llm = FakeLlm(delay=delay)
+    gateway = LlmGateway(llm, timeout=delay * 4)
+    key = ("search", "usb c cable")
+
+    print(f"📊 Fake LLM with {delay * 1000:.0f} ms latency")
+    await timed(f"{concurrency} concurrent identical", [gateway.complete(key, "", PROMPT) for _ in range(concurrency)])
+    await timed(f"{concurrency} repeats (cached)", [gateway.complete(key, "", PROMPT) for _ in range(concurrency)])
+    print(f"   LLM calls made: {llm.calls}")
+
+    print(f"🐢 Fake LLM slower than the {timeout * 1000:.0f} ms timeout")
+    slow = LlmGateway(FakeLlm(delay=timeout * 4), timeout=timeout,
+                      breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+    for i in range(5):
+        await timed(f"distinct query {i + 1} (breaker {slow.breaker.state})", [slow.complete(("q", i), "", PROMPT)])
+    print(f"   {dict(slow.stats)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=0.5, help="Fake LLM latency in seconds")
+    parser.add_argument("--timeout", type=float, default=0.2, help="Gateway timeout in seconds")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.concurrency, args.delay, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bytes per listing page and BSON decode time, view=full vs view=card
+
+Offline mode builds realistic product documents, applies the same projection
+the API uses, and measures BSON size, BSON decode time and JSON size:
+
+    python scripts/bench_projection.py --page-size 50
+
+With --url it also measures real /api/products responses from a running server:
+
+    python scripts/bench_projection.py --url http://localhost:8001 --page-size 50
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "glenntek_ecommerce")
+
+import argparse
+import time
+from datetime import datetime
+
+import bson
+import orjson
+
+from server import PRODUCT_CARD_PROJECTION
+from bench_json import make_product
+
+
+def project_card(doc: dict) -> dict:
+    """Apply PRODUCT_CARD_PROJECTION the way MongoDB would"""
+    card = {}
+    for field, rule in PRODUCT_CARD_PROJECTION.items():
+        if field == "_id" or field not in doc:
+            continue
+        card[field] = doc[field][:rule["$slice"]] if isinstance(rule, dict) else doc[field]
+    return card
+
+
+def as_stored(doc: dict) -> dict:
+    """Documents as MongoDB holds them: timestamps are BSON dates"""
+    return {k: datetime.fromisoformat(v) if k in ("created_at", "updated_at") else v for k, v in doc.items()}
+
+
+def measure(label: str, docs: list, rounds: int):
+    encoded = [bson.encode(doc) for doc in docs]
+    bson_bytes = sum(len(raw) for raw in encoded)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for raw in encoded:
+            bson.decode(raw)
+    decode_ms = (time.perf_counter() - start) / rounds * 1000
+
+    json_bytes = len(orjson.dumps(docs))
+    print(f"   {label:<6} BSON {bson_bytes / 1024:8.1f} KiB  decode {decode_ms:6.3f} ms  JSON {json_bytes / 1024:8.1f} KiB")
+    return json_bytes
+
+
+def measure_live(url: str, page_size: int):
+    import httpx
+
+    print(f"🌐 Live /api/products?limit={page_size}")
+    sizes = {}
+    with httpx.Client(base_url=url, timeout=30) as client:
+        for view in ("full", "card"):
+            response = client.get("/api/products", params={"limit": page_size, "view": view})
+            response.raise_for_status()
+            sizes[view] = len(response.content)
+            print(f"   {view:<6} {sizes[view] / 1024:8.1f} KiB for {len(response.json())} products")
+    if sizes["full"]:
+        print(f"   card payload is {sizes['card'] / sizes['full'] * 100:.1f}% of full")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--url", default=None, help="Also measure a running backend")
+    args = parser.parse_args()
+
+    full = [as_stored(make_product(i)) for i in range(args.page_size)]
+    cards = [project_card(doc) for doc in full]
+
+    print(f"📊 {args.page_size} products per page")
+    full_json = measure("full", full, args.rounds)
+    card_json = measure("card", cards, args.rounds)
+    print(f"   card payload is {card_json / full_json * 100:.1f}% of full")
+
+    if args.url:
+        measure_live(args.url, args.page_size)
+
+
+if __name__ == "__main__":
+    main()
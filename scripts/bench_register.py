@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for POST /api/auth/register
+
+Run it against a server built from each revision you want to compare, e.g.:
+
+    python scripts/bench_register.py --url http://localhost:8001 -n 200 -c 10
+    python scripts/bench_register.py --url http://localhost:8001 -n 200 -c 10 --referral-code ABCD1234
+
+Each request registers a fresh throwaway user (bench-<uuid>@example.com).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+async def register_once(client: httpx.AsyncClient, referral_code: str = None) -> float:
+    payload = {
+        "email": f"bench-{uuid.uuid4().hex}@example.com",
+        "password": "bench-password",
+        "full_name": "Bench User",
+    }
+    if referral_code:
+        payload["referral_code"] = referral_code
+
+    start = time.perf_counter()
+    response = await client.post("/api/auth/register", json=payload)
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return elapsed
+
+
+async def run_benchmark(url: str, total: int, concurrency: int, referral_code: str = None):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        # Warm up connections and the server's first-request paths
+        await register_once(client, referral_code)
+
+        async def worker():
+            async with semaphore:
+                latencies.append(await register_once(client, referral_code))
+
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(total)))
+        wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    ms = [l * 1000 for l in latencies]
+    print(f"📊 POST /api/auth/register x{total} (concurrency {concurrency}, referral={'yes' if referral_code else 'no'})")
+    print(f"   mean {statistics.mean(ms):8.1f} ms")
+    print(f"   p50  {ms[len(ms) // 2]:8.1f} ms")
+    print(f"   p95  {ms[int(len(ms) * 0.95) - 1]:8.1f} ms")
+    print(f"   max  {ms[-1]:8.1f} ms")
+    print(f"   throughput {total / wall:.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001", help="Backend base URL")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="Number of registrations")
+    parser.add_argument("-c", "--concurrency", type=int, default=10, help="Concurrent requests")
+    parser.add_argument("--referral-code", default=None, help="Register every user with this referral code")
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args.url, args.requests, args.concurrency, args.referral_code))
+
+
+if __name__ == "__main__":
+    main()
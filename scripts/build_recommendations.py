@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Batch job: rebuild the product_recommendations collection
+
+Mines co-purchases from orders, co-occurrence from wishlists and tag/category
+similarity, then writes one recommendation document per active product.
+New orders keep "also bought" lists current between runs; schedule this job
+(e.g. nightly via cron) to refresh the blended "related" lists. Reads
+MONGO_URL / DB_NAME from backend/.env:
+
+    python scripts/build_recommendations.py --batch-size 500
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+
+import argparse
+import asyncio
+import time
+
+import server
+
+
+async def run_build(batch_size: int):
+    print("🧮 Building product recommendations...")
+    start = time.perf_counter()
+    written = await server.build_recommendations(batch_size)
+    print(f"✅ {written} products written in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per bulk_write batch")
+    args = parser.parse_args()
+
+    asyncio.run(run_build(args.batch_size))
+    server.client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Check that every product listing sort is served by an index
+
+Runs explain() for the filter/sort combinations the listing endpoints issue
+(no category, one category, a category with subcategories, price ranges) and
+fails if any winning plan contains an in-memory SORT stage. Reads MONGO_URL /
+DB_NAME from backend/.env; run it after the server has created its indexes:
+
+    python scripts/explain_product_sorts.py --category cables
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+
+import argparse
+import asyncio
+
+import server
+
+
+def plan_stages(plan: dict):
+    """Yield every stage name in an explain() plan tree"""
+    yield plan.get("stage")
+    for child in plan.get("inputStages", []) + [plan[k] for k in ("inputStage", "queryPlan") if k in plan]:
+        yield from plan_stages(child)
+
+
+async def explain(label: str, query: dict, sort: list, limit: int) -> bool:
+    result = await server.db.products.find(query).sort(sort).limit(limit).explain()
+    plan = result["queryPlanner"]["winningPlan"]
+    stages = [s for s in plan_stages(plan) if s]
+    ok = "SORT" not in stages
+    print(f"   {'✅' if ok else '❌'} {label:<44} {' <- '.join(stages)}")
+    return ok
+
+
+async def run(category: str, limit: int) -> bool:
+    await server.ensure_indexes()
+    await server.category_tree.ensure_current()
+    subtree = server.category_tree.expand(category)
+
+    filters = {
+        "all products": {"is_active": True},
+        f"category={category}": {"is_active": True, "category": category},
+        f"category={category} + subcategories": {"is_active": True, "category": {"$in": subtree}},
+        "price 10-100": {"is_active": True, "price": {"$gte": 10, "$lte": 100}},
+        f"category={category} price 10-100": {"is_active": True, "category": category,
+                                                "price": {"$gte": 10, "$lte": 100}},
+    }
+    ok = True
+    for sort_name, sort in server.PRODUCT_SORTS.items():
+        print(f"🔎 sort={sort_name}")
+        for label, query in filters.items():
+            ok &= await explain(label, query, sort, limit)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--category", default="cables", help="Category slug to filter by")
+    parser.add_argument("--limit", type=int, default=50, help="Page size")
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args.category, args.limit))
+    server.client.close()
+    print("✅ No in-memory sorts" if ok else "❌ Some listings sort in memory")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Bulk import / export of the product catalog (CSV or JSONL)
+
+Uses the same engine as POST /api/products/import and GET /api/products/export,
+reading MONGO_URL / DB_NAME from backend/.env:
+
+    python scripts/import_products.py import catalog.csv
+    python scripts/import_products.py import catalog.jsonl --chunk-size 1000
+    python scripts/import_products.py export products.csv
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+
+import argparse
+import asyncio
+
+import server
+
+
+def file_format(path: str, fmt: str = None) -> str:
+    return server.product_file_format(os.path.basename(path), fmt)
+
+
+async def run_import(path: str, fmt: str, chunk_size: int) -> int:
+    print(f"📥 Importing products from {path} ({fmt})...")
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        report = await server.import_products(server.read_product_rows(stream, fmt), chunk_size)
+
+    print(f"✅ Processed {report['processed']} rows: "
+          f"{report['inserted']} inserted, {report['updated']} updated, {len(report['errors'])} errors")
+    for error in report["errors"]:
+        print(f"   ❌ Row {error['row']}: {error['error']}")
+    return 1 if report["errors"] else 0
+
+
+async def run_export(path: str, fmt: str) -> int:
+    print(f"📤 Exporting products to {path} ({fmt})...")
+    with open(path, "w", encoding="utf-8", newline="") as stream:
+        async for chunk in server.export_products(fmt):
+            stream.write(chunk)
+    print("✅ Export completed")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("path", help="CSV or JSONL file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None,
+                        help="File format (default: from the file extension)")
+    parser.add_argument("--chunk-size", type=int, default=server.PRODUCT_IMPORT_CHUNK_SIZE,
+                        help="Rows per bulk_write batch")
+    args = parser.parse_args()
+
+    fmt = file_format(args.path, args.format)
+    if args.action == "import":
+        code = asyncio.run(run_import(args.path, fmt, args.chunk_size))
+    else:
+        code = asyncio.run(run_export(args.path, fmt))
+    server.client.close()
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Online migration: convert legacy ISO-string timestamps to native BSON dates
+
+Walks every collection listed in server.TIMESTAMP_FIELDS in _id order and
+rewrites string created_at / updated_at / ... values in batches. It is safe to
+run while the app is serving traffic and safe to re-run; reads MONGO_URL /
+DB_NAME from backend/.env:
+
+    python scripts/migrate_timestamps.py --batch-size 1000
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+
+import argparse
+import asyncio
+
+import server
+
+
+def report_batch(collection_name: str, converted: int):
+    print(f"   {collection_name}: {converted} fields converted so far", end="\r")
+
+
+async def run_migration(batch_size: int):
+    print("🕒 Converting string timestamps to BSON dates...")
+    converted = await server.migrate_timestamps(batch_size, on_batch=report_batch)
+    for collection_name, count in converted.items():
+        print(f"✅ {collection_name}: {count} fields converted" + " " * 20)
+    print(f"🎉 Migration completed: {sum(converted.values())} fields converted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per bulk_write batch")
+    args = parser.parse_args()
+
+    asyncio.run(run_migration(args.batch_size))
+    server.client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -31,7 +31,7 @@ async def seed_database():
             "full_name": "Admin User",
             "phone": "00351928489086",
             "role": "admin",
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": datetime.now(timezone.utc),
             "is_active": True
         }
         await db.users.insert_one(admin_user)
@@ -55,7 +55,7 @@ async def seed_database():
                 "image": None,
                 "parent_id": None,
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
             await db.categories.insert_one(category)
     print("✅ Categories created")
@@ -139,8 +139,8 @@ async def seed_database():
                 "seo_title": None,
                 "seo_description": None,
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
             }
             await db.products.insert_one(product)
     print("✅ Sample products created")
@@ -178,8 +178,8 @@ async def seed_database():
                 "seo_title": None,
                 "seo_description": None,
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
             }
             await db.pages.insert_one(page)
     print("✅ Default pages created")
@@ -202,7 +202,7 @@ async def seed_database():
             "tax_rate": 23.0,
             "shipping_zones": [],
             "payment_methods": {},
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }
         await db.settings.insert_one(settings)
     print("✅ Settings initialized")
@@ -0,0 +1,55 @@
+"""Fixtures running the API against an in-memory MongoDB (mongomock-motor).
+
+mongomock has no multi-document transactions, so writes take the same sequential
+path as a standalone mongod.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("LLM_PROVIDER", "none")
+
+from cachetools import TTLCache  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient(tz_aware=True)["test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "transactions_supported", False)
+    monkeypatch.setattr(server, "product_search", server.ProductSearchIndex())
+    for value in vars(server).values():
+        if isinstance(value, TTLCache):
+            value.clear()
+    server.category_tree.mark_changed()
+    server.shipping_rates.mark_changed()
+    return database
+
+
+@pytest.fixture
+def client(db):
+    # Not used as a context manager: startup (index builds, background sweeps) stays off
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def make_user(db):
+    """Insert a user and return (user_id, auth headers)"""
+    def make(role: str = "customer", email: str = None):
+        user = server.User(email=email or f"{uuid.uuid4().hex[:8]}@example.com", full_name="Test User", role=role)
+        asyncio.run(db.users.insert_one({**user.model_dump(), "password": server.hash_password("secret")}))
+        token = server.create_access_token({"sub": user.id})
+        return user.id, {"Authorization": f"Bearer {token}"}
+    return make
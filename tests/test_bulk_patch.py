@@ -0,0 +1,49 @@
+"""Bulk price/stock patches: per-line reporting of lines that matched nothing"""
+import asyncio
+
+
+def add_product(db, product_id, sku, stock):
+    asyncio.run(db.products.insert_one({
+        "id": product_id, "name": product_id, "slug": product_id, "description": "", "category": "cases",
+        "price": 10.0, "sku": sku, "images": [], "stock_quantity": stock, "is_active": True
+    }))
+
+
+def test_unmatched_lines_are_reported_by_index(client, db, make_user):
+    add_product(db, "p1", "SKU-1", stock=5)
+    add_product(db, "p2", "SKU-2", stock=1)
+    _, headers = make_user(role="admin")
+
+    response = client.patch("/api/products/bulk", headers=headers, json=[
+        {"sku": "SKU-1", "price": 12.0},
+        {"id": "missing", "price": 1.0},
+        {"id": "p2", "stock_delta": -3},
+        {"sku": "NOPE", "stock_delta": 2},
+        {"id": "p1", "stock_delta": -2},
+    ])
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["matched"] == 2
+    assert body["errors"] == []
+    assert body["unmatched"] == [
+        {"index": 1, "error": "Unknown product id"},
+        {"index": 2, "error": "Not enough stock for stock_delta"},
+        {"index": 3, "error": "Unknown SKU"},
+    ]
+    assert asyncio.run(db.products.find_one({"id": "p2"}))["stock_quantity"] == 1
+    p1 = asyncio.run(db.products.find_one({"id": "p1"}))
+    assert (p1["price"], p1["stock_quantity"]) == (12.0, 3)
+
+
+def test_zero_stock_delta_alone_is_rejected(client, db, make_user):
+    add_product(db, "p1", "SKU-1", stock=5)
+    _, headers = make_user(role="admin")
+
+    response = client.patch("/api/products/bulk", headers=headers, json=[{"id": "p1", "stock_delta": 0}])
+
+    assert response.status_code == 422
+    assert "updated_at" not in asyncio.run(db.products.find_one({"id": "p1"}))
+    # With another field the zero delta is just ignored
+    response = client.patch("/api/products/bulk", headers=headers, json=[{"id": "p1", "stock_delta": 0, "price": 9.0}])
+    assert response.json()["unmatched"] == []
@@ -0,0 +1,20 @@
+"""Migration of legacy ISO string timestamps to BSON dates"""
+import asyncio
+from datetime import datetime, timezone
+
+import server
+
+
+def test_string_timestamps_are_converted_in_every_collection(db):
+    asyncio.run(db.images.insert_one({"id": "img", "filename": "a.png", "created_at": "2024-03-01T10:00:00"}))
+    asyncio.run(db.products.insert_one({
+        "id": "p1", "created_at": "2024-03-01T10:00:00+00:00", "updated_at": datetime(2024, 3, 2, tzinfo=timezone.utc)
+    }))
+
+    converted = asyncio.run(server.migrate_timestamps(batch_size=1))
+
+    assert converted["images"] == 1
+    assert converted["products"] == 1
+    image = asyncio.run(db.images.find_one({"id": "img"}))
+    assert image["created_at"] == datetime(2024, 3, 1, 10, tzinfo=timezone.utc)
+    assert asyncio.run(server.migrate_timestamps())["images"] == 0
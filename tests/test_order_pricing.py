@@ -0,0 +1,36 @@
+"""Server-side order pricing: totals are recomputed from the catalog and mismatches rejected"""
+import asyncio
+import uuid
+
+ADDRESS = {"full_name": "Test User", "address": "Rua 1", "city": "Lisboa", "postal_code": "1000-001",
+           "country": "Portugal", "phone": "910000000"}
+
+
+def test_price_change_after_the_cart_was_priced_is_rejected(client, db, make_user):
+    product_id = str(uuid.uuid4())
+    asyncio.run(db.products.insert_one({
+        "id": product_id, "name": "Screen Protector", "slug": "screen-protector", "description": "",
+        "category": "protectors", "price": 10.0, "sku": "SP-1", "images": [], "stock_quantity": 5,
+        "reserved_quantity": 0, "is_active": True
+    }))
+    _, headers = make_user()
+    # Totals the customer saw at 10.00 a unit: 20.00 + 23% VAT + 5.00 shipping
+    order = {
+        "items": [{"product_id": product_id, "name": "Screen Protector", "price": 10.0, "quantity": 2}],
+        "subtotal": 20.0, "tax": 4.6, "shipping_cost": 5.0, "total": 29.6,
+        "payment_method": "card", "shipping_address": ADDRESS, "billing_address": ADDRESS
+    }
+    asyncio.run(db.products.update_one({"id": product_id}, {"$set": {"price": 12.5}}))
+
+    response = client.post("/api/orders", json=order, headers=headers)
+
+    assert response.status_code == 409
+    assert response.json()["detail"]["expected"] == {"subtotal": 25.0, "shipping_cost": 5.0, "tax": 5.75, "total": 35.75}
+    assert asyncio.run(db.orders.count_documents({})) == 0
+    assert asyncio.run(db.products.find_one({"id": product_id}))["stock_quantity"] == 5
+
+    # Confirming the server's totals goes through, at the catalog price
+    response = client.post("/api/orders", json={**order, **response.json()["detail"]["expected"]}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["items"][0]["price"] == 12.5
+    assert response.json()["total"] == 35.75
@@ -0,0 +1,18 @@
+"""Price histogram of the product facets"""
+import asyncio
+
+import server
+
+
+def test_price_buckets_keep_expensive_and_unpriced_products_apart(db):
+    prices = [5.0, 30, 499.99, 500, 1200.0, None, "12.50"]
+    asyncio.run(db.products.insert_many([
+        {"id": f"p{n}", "category": "cases", **({} if price is None else {"price": price})}
+        for n, price in enumerate(prices)
+    ]))
+
+    buckets = asyncio.run(db.products.aggregate(server.price_facet({"category": "cases"})).to_list(None))
+
+    assert [(b["min"], b["max"], b["count"]) for b in server.price_histogram(buckets)] == [
+        (0, 10, 1), (10, 25, 0), (25, 50, 1), (50, 100, 0), (100, 250, 0), (250, 500, 1), (500, None, 2)
+    ]
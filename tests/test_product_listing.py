@@ -0,0 +1,38 @@
+"""Listing payloads skip per-row validation but must still look like Product/ProductCard"""
+import asyncio
+import uuid
+
+LEGACY = {
+    "id": str(uuid.uuid4()), "name": "Old Cable", "slug": "old-cable", "description": "From before images",
+    "category": "cables", "price": 4.5, "sku": "OLD-1", "is_active": True, "wishlist_count": 7, "reserved_quantity": 2,
+    "internal_note": "not a model field"
+}
+
+
+def test_full_listing_fills_defaults_and_hides_stored_fields(client, db):
+    asyncio.run(db.products.insert_one(dict(LEGACY)))
+    product = client.get("/api/products").json()[0]
+
+    assert product["images"] == []
+    assert product["tags"] == []
+    assert product["compare_price"] is None
+    assert product["low_stock_threshold"] == 10
+    for field in ("wishlist_count", "reserved_quantity", "internal_note"):
+        assert field not in product
+
+
+def test_card_listing_and_detail_hide_stored_fields(client, db):
+    asyncio.run(db.products.insert_one(dict(LEGACY)))
+    card = client.get("/api/products", params={"view": "card"}).json()[0]
+    assert card["images"] == []
+    assert "wishlist_count" not in card
+
+    detail = client.get(f"/api/products/{LEGACY['id']}").json()
+    assert detail["stock_quantity"] == 0
+    assert "wishlist_count" not in detail
+    assert "reserved_quantity" not in detail
+
+
+def test_internal_fields_cannot_be_requested(client, db):
+    response = client.get("/api/products", params={"fields": "name,reserved_quantity"})
+    assert response.status_code == 400
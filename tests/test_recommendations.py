@@ -0,0 +1,29 @@
+"""Incremental recommendation updates after an order"""
+import asyncio
+import uuid
+
+import server
+
+
+def test_order_update_sets_category_and_trims_co_purchases(db, monkeypatch):
+    monkeypatch.setattr(server, "CO_PURCHASE_KEEP", 2)
+    ids = [str(uuid.uuid4()) for _ in range(4)]
+    asyncio.run(db.products.insert_many([{"id": pid, "category": f"cat-{n}"} for n, pid in enumerate(ids)]))
+    frequent, rare = str(uuid.uuid4()), str(uuid.uuid4())
+    asyncio.run(db.product_recommendations.insert_one({
+        "product_id": ids[0], "category": "cat-0", "purchases": 5, "co_purchases": {frequent: 5, rare: 1}
+    }))
+    asyncio.run(db.product_recommendations.update_one({"product_id": ids[0]}, {"$inc": {f"co_purchases.{ids[1]}": 2}}))
+
+    asyncio.run(server.record_order_recommendations(ids[:3] + [str(uuid.uuid4())]))
+
+    first = asyncio.run(db.product_recommendations.find_one({"product_id": ids[0]}))
+    assert first["purchases"] == 6
+    assert first["co_purchases"] == {frequent: 5, ids[1]: 3}
+    assert first["also_bought"][:2] == [frequent, ids[1]]
+
+    created = asyncio.run(db.product_recommendations.find_one({"product_id": ids[1]}))
+    assert created["category"] == "cat-1"
+    assert created["co_purchases"] == {ids[0]: 1, ids[2]: 1}
+    # Unknown ids get no recommendation document
+    assert asyncio.run(db.product_recommendations.count_documents({})) == 3
@@ -0,0 +1,46 @@
+"""Referral totals after a registration that used a referral code"""
+
+
+def register(client, email, referral_code=None):
+    response = client.post("/api/auth/register", json={
+        "email": email, "password": "secret", "full_name": "New Customer", "referral_code": referral_code
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_registration_with_referral_counts_in_totals(client, make_user):
+    referrer = register(client, "referrer@example.com")
+    referrer_headers = {"Authorization": f"Bearer {referrer['access_token']}"}
+    code = client.get("/api/referral/my-code", headers=referrer_headers).json()["referral_code"]
+
+    register(client, "friend@example.com", code)
+
+    _, admin_headers = make_user(role="admin")
+    listing = client.get("/api/referral/admin/all", headers=admin_headers).json()
+    assert listing["totals"] == {"count": 1, "rewarded": 1, "total_paid_out": 10.0}
+    assert listing["items"][0]["status"] == "completed"
+
+    stats = client.get("/api/referral/my-code", headers=referrer_headers).json()
+    assert stats["total_referrals"] == 1
+    assert stats["completed_referrals"] == 1
+    assert stats["total_earned"] == 5.0
+
+
+def test_admin_totals_cover_every_page(client, make_user):
+    referrer = register(client, "referrer@example.com")
+    referrer_headers = {"Authorization": f"Bearer {referrer['access_token']}"}
+    code = client.get("/api/referral/my-code", headers=referrer_headers).json()["referral_code"]
+    for i in range(3):
+        register(client, f"friend{i}@example.com", code)
+
+    _, admin_headers = make_user(role="admin")
+    first = client.get("/api/referral/admin/all", params={"limit": 2}, headers=admin_headers).json()
+    assert len(first["items"]) == 2
+    assert first["totals"]["count"] == 3
+    rest = client.get(
+        "/api/referral/admin/all", params={"limit": 2, "cursor": first["next_cursor"]}, headers=admin_headers
+    ).json()
+    assert len(rest["items"]) == 1
+    assert rest["next_cursor"] is None
+    assert "totals" not in rest
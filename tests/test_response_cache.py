@@ -0,0 +1,43 @@
+"""Response cache entries must not outlive an invalidation that overlapped their load"""
+import asyncio
+
+from starlette.requests import Request
+
+import server
+
+
+def listing_request():
+    return Request({"type": "http", "method": "GET", "path": "/api/products", "query_string": b"",
+                    "headers": [], "route": None})
+
+
+def test_load_overlapping_invalidation_is_not_stored(db):
+    async def stale_loader():
+        # An admin edit lands while the listing is being read
+        server.invalidate_cached_responses("products")
+        return {"products": ["before the edit"]}
+
+    async def fresh_loader():
+        return {"products": ["after the edit"]}
+
+    async def scenario():
+        await server.cached_json(listing_request(), "products", stale_loader)
+        return await server.cached_json(listing_request(), "products", fresh_loader)
+
+    response = asyncio.run(scenario())
+    assert b"after the edit" in response.body
+
+
+def test_load_without_invalidation_is_reused(db):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return {"products": []}
+
+    async def scenario():
+        await server.cached_json(listing_request(), "products", loader)
+        await server.cached_json(listing_request(), "products", loader)
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
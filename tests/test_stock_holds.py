@@ -0,0 +1,115 @@
+"""Stock holds and order stock checks, on the sequential (no transaction) write path"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def add_product(db, stock, reserved=0, price=10.0):
+    product_id = str(uuid.uuid4())
+    asyncio.run(db.products.insert_one({
+        "id": product_id, "name": "Phone Case", "slug": f"case-{product_id[:8]}", "description": "",
+        "category": "cases", "price": price, "sku": f"SKU-{product_id[:8]}", "images": [],
+        "stock_quantity": stock, "reserved_quantity": reserved, "is_active": True
+    }))
+    return product_id
+
+
+def product(db, product_id):
+    return asyncio.run(db.products.find_one({"id": product_id}, {"_id": 0}))
+
+
+def order_payload(product_id, quantity, price=10.0, wallet_credit=0.0):
+    subtotal = round(price * quantity, 2)
+    shipping = 0.0 if subtotal > server.DEFAULT_FREE_SHIPPING_THRESHOLD else server.DEFAULT_SHIPPING_COST
+    tax = round(subtotal * 0.23, 2)
+    address = {"full_name": "Test User", "address": "Rua 1", "city": "Lisboa", "postal_code": "1000-001",
+               "country": "Portugal", "phone": "910000000"}
+    return {
+        "items": [{"product_id": product_id, "name": "Phone Case", "price": price, "quantity": quantity}],
+        "subtotal": subtotal, "shipping_cost": shipping, "tax": tax, "total": round(subtotal + shipping + tax - wallet_credit, 2),
+        "payment_method": "card", "shipping_address": address, "billing_address": address, "wallet_credit": wallet_credit
+    }
+
+
+def hold(client, headers, product_id, quantity):
+    return client.post("/api/checkout/hold", json={"items": [{"product_id": product_id, "quantity": quantity}]},
+                       headers=headers)
+
+
+def test_failed_payment_restores_only_the_reserved_units_released(client, db, make_user):
+    # The hold document survived but the counter drifted to 0: the order releases nothing
+    # from reserved_quantity, so undoing it must not add the held 2 units back
+    product_id = add_product(db, stock=5, reserved=0)
+    user_id, headers = make_user()
+    asyncio.run(db.stock_holds.insert_one({
+        "id": str(uuid.uuid4()), "user_id": user_id, "product_id": product_id, "quantity": 2,
+        "expires_at": datetime.now(timezone.utc) + timedelta(minutes=5), "created_at": datetime.now(timezone.utc),
+        "claimed_by": None, "claimed_at": None, "released_at": None
+    }))
+
+    # No wallet, so the wallet debit fails after the stock was taken
+    response = client.post("/api/orders", json=order_payload(product_id, 2, wallet_credit=1.0), headers=headers)
+
+    assert response.status_code == 400
+    doc = product(db, product_id)
+    assert doc["stock_quantity"] == 5
+    assert doc["reserved_quantity"] == 0
+    hold_doc = asyncio.run(db.stock_holds.find_one({"user_id": user_id}))
+    assert hold_doc["claimed_by"] is None and hold_doc["released_at"] is None
+
+
+def test_concurrent_holds_cannot_reserve_more_than_stock(db, make_user):
+    product_id = add_product(db, stock=3)
+    first, _ = make_user()
+    second, _ = make_user()
+    items = [server.StockHoldItem(product_id=product_id, quantity=2)]
+
+    async def both():
+        return await asyncio.gather(
+            server.place_holds(first, items), server.place_holds(second, items), return_exceptions=True
+        )
+
+    results = asyncio.run(both())
+
+    rejected = [r for r in results if isinstance(r, server.HTTPException)]
+    assert len(rejected) == 1 and rejected[0].status_code == 409
+    assert rejected[0].detail["available"] == {product_id: 1}
+    assert product(db, product_id)["reserved_quantity"] == 2
+    assert asyncio.run(db.stock_holds.count_documents({"released_at": None})) == 1
+
+
+def test_order_cannot_take_stock_held_by_another_customer(client, db, make_user):
+    product_id = add_product(db, stock=3)
+    _, holder = make_user()
+    _, buyer = make_user()
+    assert hold(client, holder, product_id, 2).status_code == 200
+
+    response = client.post("/api/orders", json=order_payload(product_id, 2), headers=buyer)
+    assert response.status_code == 409
+    assert response.json()["detail"]["available"] == {product_id: 1}
+
+    assert client.post("/api/orders", json=order_payload(product_id, 1), headers=buyer).status_code == 200
+    assert client.post("/api/orders", json=order_payload(product_id, 2), headers=holder).status_code == 200
+    doc = product(db, product_id)
+    assert doc["stock_quantity"] == 0
+    assert doc["reserved_quantity"] == 0
+
+
+def test_sweep_releases_expired_holds(client, db, make_user):
+    product_id = add_product(db, stock=2)
+    holder_id, holder = make_user()
+    _, other = make_user()
+    assert hold(client, holder, product_id, 2).status_code == 200
+    assert hold(client, other, product_id, 1).status_code == 409
+
+    asyncio.run(db.stock_holds.update_many(
+        {"user_id": holder_id}, {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    ))
+    assert asyncio.run(server.release_expired_holds()) == 2
+    assert asyncio.run(server.release_expired_holds()) == 0
+
+    assert product(db, product_id)["reserved_quantity"] == 0
+    assert asyncio.run(db.stock_holds.find_one({"user_id": holder_id}))["released_at"] is not None
+    assert hold(client, other, product_id, 2).status_code == 200